@@ -0,0 +1,168 @@
+"""Walker/Vose alias tables for constant-time weighted transcript selection."""
+
+# Import modules
+import os                                # Library for interacting with the operating system
+import hashlib                           # Library for hashing, used to name the cached tables
+import numpy as np                       # Library for numerical computing
+
+from position_store import TRIPLETS
+
+MAX_CACHED_TABLES = 16                   # Cached alias_<hash>.npz files kept per database folder, the least recently used go first
+
+
+# ====================
+# ALIAS TABLES
+# ====================
+
+#region Alias
+
+# Function to build one alias table (Vose's method)
+def build_alias_table(weights):
+    """
+    Builds an alias table from a list of weights.
+    Returns the acceptance probability and the alias of every entry.
+    """
+
+    n = len(weights)
+    weights = np.asarray(weights, dtype=np.float64)
+    scaled = (weights * n / weights.sum()).tolist()          # Scaled so the average weight is 1
+    prob = np.ones(n, dtype=np.float64)
+    alias = np.arange(n, dtype=np.int64)                     # Entries left over at the end keep themselves as alias
+
+    small = [i for i, w in enumerate(scaled) if w < 1.0]
+    large = [i for i, w in enumerate(scaled) if w >= 1.0]
+
+    while small and large:
+        s = small.pop()
+        l = large.pop()
+        prob[s] = scaled[s]
+        alias[s] = l                                         # The rest of the column of s is filled by l
+        scaled[l] = (scaled[l] + scaled[s]) - 1.0
+        if scaled[l] < 1.0:
+            small.append(l)
+        else:
+            large.append(l)
+
+    return prob, alias                                       # example output: array([0.6, 1.0]), array([1, 1])
+
+
+# Function to draw from an alias table
+def draw_alias(prob, alias, size, rng):
+    """
+    Draws size entries from an alias table in constant time per draw.
+    """
+
+    column = rng.integers(0, len(prob), size=size)           # Picks a column uniformly
+    accept = rng.random(size) < prob[column]                 # Keeps the column or takes its alias
+    return np.where(accept, column, alias[column])
+
+
+# Function to build the alias tables of all triplets
+def build_alias_tables(rows, counts):
+    """
+    Builds one alias table per triplet from the store rows and count matrix of the selected transcripts (see frequency.compute_count_matrix).
+    Returns a dictionary {triplet code: (store rows of the transcripts, acceptance probabilities, aliases)}.
+    """
+
+    alias_tables = {}
+
+    for code in np.flatnonzero(counts.sum(axis=0)):                 # Column sums: triplets found in at least one transcript
+        column = np.asarray(counts[:, code])
+        present = np.flatnonzero(column)                           # Transcripts containing the triplet
+        prob, alias = build_alias_table(column[present])
+        alias_tables[int(code)] = (rows[present], prob, alias)
+
+    return alias_tables
+
+#endregion
+
+
+# ====================
+# CACHE
+# ====================
+
+#region Cache
+
+# Function to name the cached tables after the counts they were built from
+def count_matrix_digest(rows, counts, kind="triplet"):
+    """
+    Returns a hash of the store rows and count matrix. The same transcripts and counts in the same store always give the same hash.
+    The shape and the kind of table ('triplet', or 'context' for context_index.py columns) are hashed too, so the two kinds never share a file.
+    """
+
+    counts = np.asarray(counts)
+    digest = hashlib.sha1()
+    digest.update(f"{kind}:{counts.shape}".encode())
+    digest.update(np.ascontiguousarray(rows, dtype=np.int64).tobytes())
+    digest.update(np.ascontiguousarray(counts, dtype=np.uint32).tobytes())
+    return digest.hexdigest()
+
+
+# Function to save alias tables in a single npz file
+def save_alias_tables(alias_tables, path):
+    """
+    Saves alias tables as concatenated arrays with one offset per column code (triplet code, or context code, see context_index.py).
+    """
+
+    n_codes = max(len(TRIPLETS), max(alias_tables, default=0) + 1)
+    offsets = np.zeros(n_codes + 1, dtype=np.int64)
+    for code in range(n_codes):
+        offsets[code + 1] = offsets[code] + (len(alias_tables[code][0]) if code in alias_tables else 0)
+
+    parts = [alias_tables[code] for code in range(n_codes) if code in alias_tables]
+    rows, prob, alias = (np.concatenate([p[j] for p in parts]) if parts else np.zeros(0) for j in range(3))
+
+    np.savez(path, offsets=offsets, rows=rows.astype(np.int64), prob=prob.astype(np.float64), alias=alias.astype(np.int64))
+
+
+# Function to load alias tables saved by save_alias_tables()
+def load_alias_tables(path):
+    """
+    Loads alias tables from an npz file. Returns the same dictionary as build_alias_tables().
+    """
+
+    with np.load(path) as saved:
+        offsets, rows, prob, alias = saved['offsets'], saved['rows'], saved['prob'], saved['alias']
+
+    return {code: (rows[offsets[code]:offsets[code + 1]], prob[offsets[code]:offsets[code + 1]], alias[offsets[code]:offsets[code + 1]])
+            for code in range(len(offsets) - 1) if offsets[code + 1] > offsets[code]}
+
+
+# Function to remove cached alias tables from the database folder
+def purge_alias_cache(db_folder, keep=0):
+    """
+    Removes the cached alias_<hash>.npz files of the database folder except the keep most recently used ones (all of them by default).
+    Returns the number of files removed.
+    """
+
+    cached = [entry for entry in os.scandir(db_folder) if entry.name.startswith("alias_") and entry.name.endswith(".npz")]
+    cached.sort(key=lambda entry: entry.stat().st_mtime, reverse=True)    # Most recently used first
+    for entry in cached[keep:]:
+        try:
+            os.remove(entry.path)
+        except FileNotFoundError:                                          # Already removed by a concurrent run
+            pass
+    return max(len(cached) - keep, 0)
+
+
+# Function to get alias tables from the database folder, building them if needed
+def get_alias_tables(rows, counts, db_folder, kind="triplet", max_cached=MAX_CACHED_TABLES):
+    """
+    Returns the alias tables for the count matrix. Tables are cached in the database folder as alias_<hash>.npz,
+    so repeated runs over the same transcripts skip the build. kind names the columns of the matrix, see count_matrix_digest().
+    Every distinct selection of transcripts adds a file, so only the max_cached most recently used files are kept.
+    """
+
+    cache_path = os.path.join(db_folder, f"alias_{count_matrix_digest(rows, counts, kind)}.npz")
+
+    if os.path.exists(cache_path):
+        alias_tables = load_alias_tables(cache_path)
+        os.utime(cache_path)                                               # Marks the file as recently used
+        return alias_tables
+
+    alias_tables = build_alias_tables(rows, counts)
+    save_alias_tables(alias_tables, cache_path)
+    purge_alias_cache(db_folder, keep=max_cached)
+    return alias_tables
+
+#endregion
@@ -0,0 +1,246 @@
+"""Benchmark suite: times every stage of the pipeline on synthetic transcriptomes and signatures, and writes the results as JSON."""
+
+# Import modules
+import os                                # Library for interacting with the operating system
+import sys                               # Library for the Python version in the metadata
+import json                              # Library for writing and reading the results
+import time                              # Library for the timers
+import platform                          # Library for the machine description in the metadata
+import tempfile                          # Library for the temporary benchmark folder
+import subprocess                        # Library for reading the git commit of the benchmarked version
+import argparse                          # Library for parsing command-line arguments
+import io                                # Library for the silenced output of the API stage
+from contextlib import redirect_stdout   # Library for the silenced output of the API stage
+from datetime import datetime            # Library for handling dates
+import numpy as np                       # Library for numerical computing
+
+from position_store import PositionStore
+from frequency import get_freq, process_triplet_positions, compute_triplet_counts, compute_count_matrix
+from alias_tables import build_alias_tables
+from randomized_operations import random_sampling, build_channel_table, sample_channels, simulate_mutations, format_hgvsc
+from ensembl_request import get_hgvs_genomic, hgvs_converter
+from ensembl_stub import start_stub_server, fake_hgvsg
+from vcf_output import vcf_writer
+
+
+# Stages in pipeline order
+STAGES = ("get_freq", "process_triplet_positions", "compute_triplet_counts", "random_sampling", "sampling_loop",
+          "api_request", "hgvs_converter", "vcf_writer", "vcf_writer_bgzip")
+
+
+# ====================
+# SYNTHETIC INPUT
+# ====================
+
+#region Input
+
+# Function to make up a transcriptome
+def synthetic_transcriptome(n_transcripts, rng, mean_length=1500):
+    """
+    Returns n_transcripts (ID, coding sequence) tuples. Lengths follow a log-normal distribution around mean_length
+    and are rounded to whole codons, sequences start with ATG.
+    """
+
+    lengths = np.maximum(rng.lognormal(np.log(mean_length), 0.6, size=n_transcripts).astype(np.int64) // 3 * 3, 30)
+    bases = np.frombuffer(b"ACGT", dtype=np.uint8)
+    sequences = []
+    for i, length in enumerate(lengths.tolist()):
+        sequence = "ATG" + bases[rng.integers(0, 4, size=length - 3)].tobytes().decode()
+        sequences.append((f"ENSTBENCH{i:08d}", sequence))
+    return sequences                     # example output: [('ENSTBENCH00000000', 'ATGCGACTG...'), ...]
+
+
+# Function to make up a signature count file
+def synthetic_signature(path, rng):
+    """
+    Writes a 96 channel count file (triplet, change, count) with Dirichlet distributed weights, in the format read by get_freq().
+    """
+
+    counts = rng.multinomial(100000, rng.dirichlet(np.full(96, 0.5)))
+    channel = 0
+    with open(path, "w") as outfile:
+        for ref, alts in (("C", "AGT"), ("T", "ACG")):
+            for alt in alts:
+                for first in "ACGT":
+                    for last in "ACGT":
+                        outfile.write(f"{first}{ref}{last}\t{ref}/{alt}\t{counts[channel]}\n")
+                        channel += 1
+
+#endregion
+
+
+# ====================
+# TIMING
+# ====================
+
+#region Timing
+
+# Function to time a stage
+def time_stage(function, repeat):
+    """
+    Calls function repeat times and returns the wall clock seconds of each call and the result of the last one.
+    """
+
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        seconds.append(time.perf_counter() - start)
+    return seconds, result
+
+
+# Function to describe the benchmarked version and machine
+def benchmark_metadata(args):
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {'date': datetime.now().isoformat(timespec='seconds'), 'commit': commit, 'python': sys.version.split()[0],
+            'numpy': np.__version__, 'platform': platform.platform(), 'cpus': os.cpu_count(), 'arguments': args}
+
+
+# Function to run all stages for one transcriptome size
+def benchmark_transcriptome(n_transcripts, n_values, args, workdir, results):
+    """
+    Builds a database of n_transcripts synthetic transcripts and times every stage for each number of mutations in n_values.
+    Results are appended to results as {'stage', 'transcripts', 'n', 'seconds', 'best', 'mean'} entries.
+    """
+
+    rng = np.random.default_rng(args['seed'])
+    repeat = args['repeat']
+    stages = set(args['stages'])
+
+    def record(stage, n, seconds):
+        results.append({'stage': stage, 'transcripts': n_transcripts, 'n': n, 'seconds': seconds,
+                        'best': min(seconds), 'mean': sum(seconds) / len(seconds)})
+        print(f"{stage:<26} transcripts={n_transcripts:<7} n={str(n):<8} best={min(seconds):.4f}s")
+
+    sequences = synthetic_transcriptome(n_transcripts, rng)
+    signature_file = os.path.join(workdir, "signature.count")
+    synthetic_signature(signature_file, rng)
+
+    # Transcriptome stages. The database is rebuilt in a fresh folder for every repeat.
+    seconds, freq = time_stage(lambda: get_freq(signature_file), repeat)
+    if "get_freq" in stages:
+        record("get_freq", None, seconds)
+
+    db_folders = [tempfile.mkdtemp(prefix="db_", dir=workdir) for _ in range(repeat)]      # Empty folders, the store is appended to otherwise
+    built = []
+
+    def build_store():
+        built.append(db_folders.pop())
+        process_triplet_positions(sequences, built[-1])
+
+    seconds, _ = time_stage(build_store, repeat)
+    if "process_triplet_positions" in stages:
+        record("process_triplet_positions", None, seconds)
+    db_folder = built[-1]                                                   # Built above: a reused --workdir may hold db_ folders of earlier runs
+
+    transcripts = [transcript for transcript, _ in sequences]
+    seconds, _ = time_stage(lambda: compute_triplet_counts(transcripts, db_folder), repeat)
+    if "compute_triplet_counts" in stages:
+        record("compute_triplet_counts", None, seconds)
+
+    store = PositionStore(db_folder)
+    alias_tables = build_alias_tables(*compute_count_matrix(None, store))
+    channels, channel_triplets, channel_probs = build_channel_table(freq)
+
+    # Mutation stages
+    for n in n_values:
+        if "random_sampling" in stages:
+            record("random_sampling", n, time_stage(lambda: random_sampling(freq, n), repeat)[0])
+
+        def sampling_loop():
+            channel_codes = sample_channels(channel_probs, n, rng)
+            rows, positions = simulate_mutations(channel_codes, channel_triplets, alias_tables, store, rng)
+            return format_hgvsc(rows, positions, channel_codes, channels, store)
+        seconds, hgvsc_list = time_stage(sampling_loop, repeat)
+        if "sampling_loop" in stages:
+            record("sampling_loop", n, seconds)
+
+        # REST API round trips against the local stand-in, on at most api_max mutations
+        if "api_request" in stages:
+            api_input = hgvsc_list[:args['api_max']]
+            headers = {"Content-Type": "application/json", "Accept": "application/json"}
+            server, url = start_stub_server(latency=args['api_latency'])
+            for batch_size in args['batch_sizes']:
+                with redirect_stdout(io.StringIO()):                       # get_hgvs_genomic() prints a line per batch
+                    seconds, _ = time_stage(lambda: get_hgvs_genomic(api_input, url, headers, batch_size, workers=args['api_workers']), repeat)
+                results.append({'stage': "api_request", 'transcripts': n_transcripts, 'n': len(api_input), 'batch_size': batch_size,
+                                'seconds': seconds, 'best': min(seconds), 'mean': sum(seconds) / len(seconds)})
+                print(f"{'api_request':<26} transcripts={n_transcripts:<7} n={len(api_input):<8} batch={batch_size} best={min(seconds):.4f}s")
+            server.shutdown()
+
+        hgvs_genomic = {coding: fake_hgvsg(coding) for coding in hgvsc_list}      # Same answers as the stand-in, without the round trips
+        seconds, chr_info = time_stage(lambda: hgvs_converter(hgvs_genomic), repeat)
+        if "hgvs_converter" in stages:
+            record("hgvs_converter", n, seconds)
+
+        if "vcf_writer" in stages:
+            record("vcf_writer", n, time_stage(lambda: vcf_writer(chr_info, os.path.join(workdir, "bench.vcf")), repeat)[0])
+        if "vcf_writer_bgzip" in stages:
+            record("vcf_writer_bgzip", n, time_stage(lambda: vcf_writer(chr_info, os.path.join(workdir, "bench.vcf.gz")), repeat)[0])
+
+
+# Function to compare two result files
+def compare_results(baseline, current, threshold):
+    """
+    Prints the ratio current / baseline of the best time of every stage measured in both files.
+    Returns the entries slower than threshold (e.g. 1.2 = 20 % slower).
+    """
+
+    def key(entry):
+        return entry['stage'], entry['transcripts'], entry['n'], entry.get('batch_size')
+
+    baseline_best = {key(entry): entry['best'] for entry in baseline['results']}
+    regressions = []
+    for entry in current['results']:
+        if key(entry) not in baseline_best:
+            continue
+        ratio = entry['best'] / baseline_best[key(entry)] if baseline_best[key(entry)] > 0 else float('inf')
+        flag = " REGRESSION" if ratio > threshold else ""
+        print(f"{entry['stage']:<26} transcripts={entry['transcripts']:<7} n={str(entry['n']):<8} {ratio:6.2f}x{flag}")
+        if ratio > threshold:
+            regressions.append(entry)
+    return regressions
+
+#endregion
+
+
+#### Benchmark ####
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Times the stages of the pipeline on synthetic data and writes the results as JSON.")
+    parser.add_argument('--transcripts', type=int, nargs='+', default=[1000], help="Transcriptome sizes, e.g. 1000 20000 100000")
+    parser.add_argument('-n', type=int, nargs='+', default=[100, 10000], help="Numbers of simulated mutations, e.g. 100 10000 1000000")
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES), help="Stages to time")
+    parser.add_argument('--repeat', type=int, default=3, help="Timed repeats of every stage (the best one is reported)")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed of the synthetic data")
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[50, 200], help="API batch sizes to time")
+    parser.add_argument('--api-max', type=int, default=10000, help="Maximum number of mutations sent to the stand-in API")
+    parser.add_argument('--api-latency', type=float, default=0.0, help="Seconds the stand-in API adds to every answer")
+    parser.add_argument('--api-workers', type=int, default=4, help="Number of API request batches in flight at the same time")
+    parser.add_argument('--workdir', required=False, help="Folder for the synthetic databases (default: a temporary folder)")
+    parser.add_argument('-o', required=False, default="benchmark.json", help="JSON result file")
+    parser.add_argument('--compare', required=False, help="Earlier JSON result file to compare with")
+    parser.add_argument('--threshold', type=float, default=1.2, help="Slowdown ratio reported as a regression by --compare")
+    args = vars(parser.parse_args())
+
+    results = []
+    with tempfile.TemporaryDirectory() as temporary:
+        workdir = args['workdir'] or temporary
+        for n_transcripts in args['transcripts']:
+            run_folder = os.path.join(workdir, f"transcripts_{n_transcripts}")
+            os.makedirs(run_folder, exist_ok=True)
+            benchmark_transcriptome(n_transcripts, args['n'], args, run_folder, results)
+
+    report = {'metadata': benchmark_metadata(args), 'results': results}
+    with open(args['o'], "w") as outfile:
+        json.dump(report, outfile, indent=1)
+    print(f"Results written to {args['o']}")
+
+    if args['compare'] is not None:
+        with open(args['compare'], "r") as baseline_file:
+            regressions = compare_results(json.load(baseline_file), report, args['threshold'])
+        sys.exit(1 if regressions else 0)
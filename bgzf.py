@@ -0,0 +1,162 @@
+"""BGZF (blocked gzip) writer and tabix index builder, so VCF output can be queried without bgzip/tabix."""
+
+# Import modules
+import zlib                              # Library for the deflate compression of each block
+import struct                            # Library for packing the binary block headers and index
+
+
+# Largest amount of uncompressed data per block, as used by htslib
+BLOCK_SIZE = 0xff00
+# Empty block marking the end of a BGZF file
+EOF_BLOCK = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+# Tabix binning scheme: 16 kb linear windows, 5 levels of bins
+MIN_SHIFT = 14
+PSEUDO_BIN = 37450                       # Bin holding the per-reference metadata (offsets, number of records)
+TABIX_VCF = (2, 1, 2, 0, ord("#"), 0)    # Preset: format, sequence column, begin column, end column, comment character, skipped lines
+
+
+# ====================
+# BGZF WRITING
+# ====================
+
+#region Writing
+
+class BGZFWriter:
+    """
+    Writes a BGZF file: a series of gzip members of at most 64 kb each, which gzip and zcat read as one stream.
+    tell() returns the virtual offset (compressed block start << 16 | offset in the block) used by tabix.
+    """
+
+    def __init__(self, path, level=6):
+        self.handle = open(path, "wb")
+        self.level = level
+        self.buffer = bytearray()
+        self.block_start = 0                 # Compressed offset of the block being filled
+
+    def tell(self):
+        return (self.block_start << 16) | len(self.buffer)
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= BLOCK_SIZE:
+            self._write_block(bytes(self.buffer[:BLOCK_SIZE]))
+            del self.buffer[:BLOCK_SIZE]
+
+    def _write_block(self, data):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)          # Raw deflate, the gzip header is written here
+        compressed = compressor.compress(data) + compressor.flush()
+        if len(compressed) > BLOCK_SIZE:                                        # Data that does not compress is stored
+            compressor = zlib.compressobj(0, zlib.DEFLATED, -15)
+            compressed = compressor.compress(data) + compressor.flush()
+
+        block_size = len(compressed) + 26                                      # 18 bytes header, 8 bytes CRC32 and size
+        header = struct.pack("<4BI2BH2BHH", 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, block_size - 1)
+        self.handle.write(header + compressed + struct.pack("<II", zlib.crc32(data), len(data)))
+        self.block_start += block_size
+
+    def close(self):
+        if self.buffer:
+            self._write_block(bytes(self.buffer))
+            self.buffer.clear()
+        self.handle.write(EOF_BLOCK)
+        self.handle.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+#endregion
+
+
+# ====================
+# TABIX INDEX
+# ====================
+
+#region Index
+
+# Function to get the smallest bin containing a region
+def reg2bin(begin, end):
+    """
+    Returns the tabix bin of a 0-based, half-open region (same computation as in the SAM/tabix specification).
+    """
+
+    end -= 1
+    for shift, first_bin in ((14, 4681), (17, 585), (20, 73), (23, 9), (26, 1)):
+        if begin >> shift == end >> shift:
+            return first_bin + (begin >> shift)
+    return 0
+
+
+class TabixIndex:
+    """
+    Collects the tabix index of a sorted BGZF file while it is written. Records are added in file order with their
+    0-based, half-open region and the virtual offsets before and after their line.
+    """
+
+    def __init__(self, preset=TABIX_VCF):
+        self.preset = preset
+        self.names = []
+        self.references = []                 # Per reference: {'bins': {bin: [[start, end], ...]}, 'linear': [...], 'first', 'last', 'n'}
+
+    def add(self, chromosome, begin, end, start_offset, end_offset):
+        if not self.names or self.names[-1] != chromosome:
+            self.names.append(chromosome)
+            self.references.append({'bins': {}, 'linear': [], 'first': start_offset, 'last': end_offset, 'n': 0})
+        reference = self.references[-1]
+
+        # Chunks of consecutive records in the same bin are merged
+        chunks = reference['bins'].setdefault(reg2bin(begin, end), [])
+        if chunks and chunks[-1][1] == start_offset:
+            chunks[-1][1] = end_offset
+        else:
+            chunks.append([start_offset, end_offset])
+
+        # Linear index: offset of the first record overlapping each 16 kb window
+        linear = reference['linear']
+        for window in range(begin >> MIN_SHIFT, ((end - 1) >> MIN_SHIFT) + 1):
+            if window >= len(linear):
+                linear.extend([None] * (window + 1 - len(linear)))
+            if linear[window] is None:
+                linear[window] = start_offset
+
+        reference['last'] = end_offset
+        reference['n'] += 1
+
+    def to_bytes(self):
+        """
+        Returns the uncompressed .tbi content.
+        """
+
+        names = b"".join(name.encode() + b"\0" for name in self.names)
+        parts = [b"TBI\1", struct.pack("<i6i", len(self.names), *self.preset), struct.pack("<i", len(names)), names]
+
+        for reference in self.references:
+            bins = dict(reference['bins'])
+            bins[PSEUDO_BIN] = [[reference['first'], reference['last']], [reference['n'], 0]]
+            parts.append(struct.pack("<i", len(bins)))
+            for bin_number in sorted(bins):
+                chunks = bins[bin_number]
+                parts.append(struct.pack("<Ii", bin_number, len(chunks)))
+                parts.extend(struct.pack("<QQ", start, end) for start, end in chunks)
+
+            # Windows without records point to the next record, as htslib does
+            linear = reference['linear']
+            for window in range(len(linear) - 2, -1, -1):
+                if linear[window] is None:
+                    linear[window] = linear[window + 1]
+            parts.append(struct.pack(f"<i{len(linear)}Q", len(linear), *linear))
+
+        parts.append(struct.pack("<Q", 0))                                   # No records without coordinates
+        return b"".join(parts)
+
+    def save(self, path):
+        """
+        Writes the index, BGZF compressed like the .tbi files of tabix.
+        """
+        with BGZFWriter(path) as out:
+            out.write(self.to_bytes())
+
+#endregion
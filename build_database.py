@@ -0,0 +1,301 @@
+"""Streaming, multi-process builder of the triplet position database."""
+
+# Import modules
+import os                                # Library for interacting with the operating system
+import gzip                              # Library for reading gzip compressed FASTA files
+import json                              # Library for reading and writing the manifest
+import hashlib                           # Library for hashing, used for the per-transcript sequence hashes
+import shutil                            # Library for removing the temporary sync folder
+import argparse                          # Library for parsing command-line arguments
+from datetime import datetime            # Library for handling dates
+from collections import deque            # Queue of the chunks being indexed
+from concurrent.futures import ProcessPoolExecutor
+
+from frequency import encode_sequence, index_encoded
+from position_store import PositionStore, PositionStoreWriter, is_position_store, TRANSCRIPTS_FILE, OFFSETS_FILE, POSITIONS_FILE, COUNTS_FILE, \
+    SEQUENCES_FILE, SEQUENCE_OFFSETS_FILE
+from context_index import CONTEXT_FILES
+from alias_tables import purge_alias_cache
+
+
+MANIFEST_FILE = "manifest.json"          # Metadata of the database: source FASTA, release and one entry per transcript
+
+
+# ====================
+# FASTA STREAMING
+# ====================
+
+#region Streaming
+
+# Function to read a FASTA file one record at a time
+def stream_fasta(fasta_file):
+    """
+    Reads a FASTA file (plain or gzip) and yields (ID, version, sequence) tuples one transcript at a time.
+    IDs are cut at the first '|', ' ' or version '.', so they match transcript lists and HGVS coding.
+    The version is kept separately ('' if the header has none).
+    """
+
+    opener = gzip.open if fasta_file.endswith(".gz") else open
+    header = None
+    sequence = []
+
+    with opener(fasta_file, "rt") as fasta:
+        for line in fasta:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith(">"):
+                if header is not None:
+                    yield (*split_header(header), "".join(sequence))
+                header = line[1:]
+                sequence = []
+            else:
+                sequence.append(line.upper())
+
+    if header is not None:
+        yield (*split_header(header), "".join(sequence))          # Example output: ('ENSTxxx', '8', 'ATGCGACTGATCGATCGTACG')
+
+
+# Function to split a FASTA header into ID and version
+def split_header(header):
+    transcript, _, version = header.split('|')[0].split(' ')[0].partition('.')
+    return transcript, version.split('.')[0]
+
+
+# Function to group a stream into lists
+def chunked(records, chunk_size):
+    """
+    Yields lists of at most chunk_size records.
+    """
+
+    chunk = []
+    for record in records:
+        chunk.append(record)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+#endregion
+
+
+# ====================
+# MANIFEST
+# ====================
+
+#region Manifest
+
+# Function to hash a sequence
+def sequence_hash(sequence):
+    return hashlib.sha1(sequence.encode("ascii")).hexdigest()
+
+
+# Function to read the manifest of a database
+def read_manifest(db_folder):
+    """
+    Returns the manifest of a database, or an empty one if the database has none yet.
+    Example: {'fasta': 'cds.fa.gz', 'release': '110', 'updated': '...', 'transcripts': {'ENST01': {'version': '8', 'sha1': '...', 'length': 1200, 'triplets': 1198}}}
+    """
+
+    path = os.path.join(db_folder, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {'fasta': None, 'release': None, 'updated': None, 'transcripts': {}}
+    with open(path, "r") as manifest_file:
+        return json.load(manifest_file)
+
+
+# Function to write the manifest of a database
+def write_manifest(manifest, db_folder, fasta_file, release):
+    """
+    Writes the manifest (through a temporary file, so an interrupted write never leaves a broken manifest).
+    """
+
+    manifest['fasta'] = os.path.abspath(fasta_file)
+    if release is not None:
+        manifest['release'] = release
+    manifest['updated'] = datetime.now().isoformat(timespec='seconds')
+
+    path = os.path.join(db_folder, MANIFEST_FILE)
+    with open(path + ".tmp", "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+# Function to describe one transcript in the manifest
+def manifest_entry(version, sequence, counts):
+    return {'version': version, 'sha1': sequence_hash(sequence), 'length': len(sequence), 'triplets': int(counts.sum())}
+
+#endregion
+
+
+# ====================
+# BUILDING
+# ====================
+
+#region Building
+
+# Function run by the worker processes
+def index_chunk(chunk):
+    """
+    Indexes a list of (ID, sequence) tuples. Returns a list of (ID, counts, positions, encoded sequence) tuples ready for the store.
+    """
+    rows = []
+    for transcript, sequence in chunk:
+        encoded = encode_sequence(sequence)
+        rows.append((transcript, *index_encoded(encoded), encoded))
+    return rows
+
+
+# Function to index a stream of chunks in worker processes, keeping the order of the chunks
+def index_chunks(chunks, workers):
+    """
+    Takes (item, [(ID, sequence), ...]) pairs and yields (item, indexed rows) pairs in the same order.
+    At most two chunks per worker are in flight, so memory stays bounded whatever the size of the FASTA.
+    """
+
+    if workers <= 1:
+        for item, chunk in chunks:
+            yield item, index_chunk(chunk)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        in_flight = deque()
+        for item, chunk in chunks:
+            in_flight.append((item, executor.submit(index_chunk, chunk)))
+            if len(in_flight) >= 2 * workers:                             # Waits for the oldest chunk before reading more of the FASTA
+                item, future = in_flight.popleft()
+                yield item, future.result()
+        while in_flight:
+            item, future = in_flight.popleft()
+            yield item, future.result()
+
+
+# Function to build or extend a database from a FASTA file
+def build_database(fasta_file, db_folder, workers=1, chunk_size=200, release=None):
+    """
+    Streams the FASTA file and appends every transcript that is not in the database yet, recording it in the manifest.
+    Chunks of transcripts are indexed in worker processes. Returns the IDs of all transcripts in the FASTA (new and already present).
+    """
+
+    existing = set(PositionStore(db_folder).transcripts) if is_position_store(db_folder) else set()
+    manifest = read_manifest(db_folder)
+    fasta_transcripts = []
+    n_added = 0
+
+    # Only transcripts not seen before (in the database or earlier in this FASTA) are indexed
+    def new_chunks():
+        for chunk in chunked(stream_fasta(fasta_file), chunk_size):
+            fasta_transcripts.extend(transcript for transcript, _, _ in chunk)
+            new = []
+            for record in chunk:
+                if record[0] not in existing:
+                    existing.add(record[0])
+                    new.append(record)
+            yield new, [(transcript, sequence) for transcript, _, sequence in new]
+
+    with PositionStoreWriter(db_folder) as writer:
+        for records, rows in index_chunks(new_chunks(), workers):
+            for (transcript, version, sequence), (_, counts, positions, encoded) in zip(records, rows):
+                writer.add(transcript, counts, positions, encoded)
+                manifest['transcripts'][transcript] = manifest_entry(version, sequence, counts)
+            n_added += len(rows)
+
+    write_manifest(manifest, db_folder, fasta_file, release)
+    print(f"Indexed {n_added} new transcripts, {len(fasta_transcripts) - n_added} already in the database")
+    return fasta_transcripts
+
+
+# Function to bring a database in line with a (new) FASTA file
+def sync_database(fasta_file, db_folder, workers=1, chunk_size=200, release=None):
+    """
+    Re-indexes only the transcripts whose sequence hash changed (or that are new), copies unchanged transcripts
+    from the current store and drops transcripts that are no longer in the FASTA.
+    The new store is written next to the old one and swapped in at the end. Returns the numbers of kept, indexed and dropped transcripts.
+    """
+
+    old_store = PositionStore(db_folder) if is_position_store(db_folder) else None
+    old_manifest = read_manifest(db_folder)
+    manifest = {**old_manifest, 'transcripts': {}}
+    seen = set()
+
+    # A transcript is kept if its hash matches the manifest, and it is still in the store with its sequence
+    def unchanged(transcript, sequence):
+        entry = old_manifest['transcripts'].get(transcript)
+        return old_store is not None and transcript in old_store and entry is not None and entry['sha1'] == sequence_hash(sequence) \
+            and old_store.get_sequence(transcript) is not None
+
+    def sync_chunks():
+        for chunk in chunked(stream_fasta(fasta_file), chunk_size):
+            first = []
+            for record in chunk:                                                       # First occurrence of a transcript wins, as in build_database()
+                if record[0] not in seen:
+                    seen.add(record[0])
+                    first.append(record)
+            chunk = first
+            keep = [unchanged(transcript, sequence) for transcript, _, sequence in chunk]
+            yield (chunk, keep), [(transcript, sequence) for (transcript, _, sequence), kept in zip(chunk, keep) if not kept]
+
+    sync_folder = os.path.join(db_folder, ".sync")
+    shutil.rmtree(sync_folder, ignore_errors=True)
+    n_kept = n_indexed = 0
+
+    with PositionStoreWriter(sync_folder) as writer:
+        for (chunk, keep), rows in index_chunks(sync_chunks(), workers):
+            rows = iter(rows)
+            for (transcript, version, sequence), kept in zip(chunk, keep):
+                if kept:                                                           # Copied from the old store, no re-indexing
+                    row = old_store.offsets[old_store.row[transcript]]
+                    writer.add(transcript, old_store.get_counts(transcript), old_store.positions[row[0]:row[-1]], old_store.get_sequence(transcript))
+                    manifest['transcripts'][transcript] = old_manifest['transcripts'][transcript]
+                    n_kept += 1
+                else:
+                    _, counts, positions, encoded = next(rows)
+                    writer.add(transcript, counts, positions, encoded)
+                    manifest['transcripts'][transcript] = manifest_entry(version, sequence, counts)
+                    n_indexed += 1
+
+    # Swap the new store in. The transcript table goes last, so readers never see rows without their data.
+    old_transcripts = set(old_store.transcripts) if old_store is not None else set()
+    del old_store
+    for store_file in (SEQUENCES_FILE, SEQUENCE_OFFSETS_FILE, POSITIONS_FILE, OFFSETS_FILE, COUNTS_FILE, TRANSCRIPTS_FILE):
+        os.replace(os.path.join(sync_folder, store_file), os.path.join(db_folder, store_file))
+    shutil.rmtree(sync_folder)
+
+    # Cached alias tables and the context index refer to store rows, which have changed
+    purge_alias_cache(db_folder)
+    for cached in os.listdir(db_folder):
+        if cached in CONTEXT_FILES:
+            os.remove(os.path.join(db_folder, cached))
+
+    n_dropped = len((old_transcripts | set(old_manifest['transcripts'])) - seen)
+    write_manifest(manifest, db_folder, fasta_file, release)
+    print(f"Kept {n_kept} transcripts, re-indexed {n_indexed}, dropped {n_dropped}")
+    return n_kept, n_indexed, n_dropped
+
+#endregion
+
+
+#### Build database ####
+def main(argv=None, prog=None):
+    """
+    Builds, extends or syncs the database with the command-line arguments argv (default sys.argv[1:]), as 'speculator.py build-db' does.
+    """
+
+    parser = argparse.ArgumentParser(prog=prog, description="Builds or extends the triplet position database from a FASTA file.")
+    parser.add_argument('-i', required=True, help="FASTA transcript file (plain or gzip)")
+    parser.add_argument('-d', required=True, help="Database folder")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="Number of indexing processes")
+    parser.add_argument('--chunk-size', type=int, default=200, help="Number of transcripts indexed per task")
+    parser.add_argument('--release', required=False, help="Ensembl release of the FASTA, recorded in the manifest")
+    parser.add_argument('--sync', action='store_true', help="Re-index changed transcripts and drop the ones no longer in the FASTA")
+    args = vars(parser.parse_args(argv))
+
+    if args['sync']:
+        sync_database(args['i'], args['d'], args['workers'], args['chunk_size'], args['release'])
+    else:
+        build_database(args['i'], args['d'], args['workers'], args['chunk_size'], args['release'])
+
+
+if __name__ == "__main__":
+    main()
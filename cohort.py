@@ -0,0 +1,198 @@
+"""Cohort mode: simulates many samples, each with its own mutation burden and signature, against one shared database."""
+
+# Import modules
+import os                                # Library for interacting with the operating system
+import time                              # Library for timing the samples
+import argparse                          # Library for parsing command-line arguments
+import numpy as np                       # Library for numerical computing
+
+from frequency import get_freq, read_transcript_list, compute_count_matrix
+from position_store import PositionStore
+from alias_tables import get_alias_tables
+from randomized_operations import build_channel_table, simulate_mutations, simulate_context_mutations, format_hgvsc
+from context_index import ContextIndex, profile_context_length, build_context_channel_table
+from signature_matrix import COSMIC_SIGNATURES, build_signature_channel_table, sample_channel_counts
+from output_paths import HGVSWriter
+from vcf_output import vcf_writer
+from gtf_mapping import load_cds_index
+from hgvs_cache import HGVSCache
+from hgvs_resolution import resolve_hgvsc
+
+
+# Profile files (as used with -f) are recognized by their extension, anything else in the signature column is a mixture
+PROFILE_EXTENSIONS = (".count", ".counts")
+
+
+# ====================
+# SAMPLE SHEET
+# ====================
+
+#region Sheet
+
+# Function to read the sample sheet
+def read_sample_sheet(sheet_file):
+    """
+    Reads a tab separated sample sheet with a header line and the columns sample_id, n, signature and (optionally) transcripts.
+    signature is a profile count file, a mixture like SBS1:0.3,SBS4:0.7 or an exposure file. transcripts is a transcript list file
+    (empty: all transcripts of the database).
+    Sample IDs name the output files, so they must be unique and must not contain path separators.
+    Returns a list of dictionaries, one per sample.
+    """
+
+    with open(sheet_file, "r") as sheet:
+        lines = [line.rstrip("\n") for line in sheet if line.strip() and not line.startswith("#")]
+
+    columns = lines[0].split("\t")
+    missing = {'sample_id', 'n', 'signature'} - set(columns)
+    if missing:
+        raise ValueError(f"{sheet_file}: missing columns {', '.join(sorted(missing))}")
+
+    samples = []
+    seen = set()
+    for line in lines[1:]:
+        sample = dict(zip(columns, line.split("\t")))
+        sample_id = sample['sample_id']
+        if not sample_id or sample_id in (".", "..") or "/" in sample_id or "\\" in sample_id:
+            raise ValueError(f"{sheet_file}: sample ID {sample_id!r} cannot be used as a file name")
+        if sample_id in seen:
+            raise ValueError(f"{sheet_file}: sample ID {sample_id} is used more than once")
+        seen.add(sample_id)
+        samples.append({'sample_id': sample['sample_id'], 'n': int(sample['n']), 'signature': sample['signature'],
+                        'transcripts': sample.get('transcripts') or None})
+    return samples                       # example output: [{'sample_id': 'T1', 'n': 500, 'signature': 'SBS1:0.3,SBS4:0.7', 'transcripts': None}]
+
+#endregion
+
+
+# ====================
+# COHORT SIMULATION
+# ====================
+
+#region Simulation
+
+class Cohort:
+    """
+    Shared state of a cohort: the memory-mapped database, and the channel and alias tables of every distinct signature and
+    transcript list, each built once and reused by all samples that refer to it.
+    Profiles with contexts other than triplets (e.g. pentanucleotide .counts files) are simulated from the context index, as in simulator.py.
+    """
+
+    def __init__(self, db_folder, signature_matrix=COSMIC_SIGNATURES):
+        self.db_folder = db_folder
+        self.signature_matrix = signature_matrix
+        self.store = PositionStore(db_folder)
+        self.context_index = None        # Opened (and built if needed) by the first sample with a longer context profile
+        self.channel_tables = {}         # signature -> (channels, channel_columns, channel_probs, contexts or None for triplets)
+        self.count_matrices = {}         # transcript list file (None: all transcripts) -> store rows and triplet counts
+        self.sampling_tables = {}        # (transcript list file, contexts) -> alias tables and context table (None for triplets)
+
+    def get_channel_table(self, signature):
+        if signature not in self.channel_tables:
+            if not signature.endswith(PROFILE_EXTENSIONS):
+                self.channel_tables[signature] = (*build_signature_channel_table(signature, self.signature_matrix), None)
+            else:
+                freq = get_freq(signature)
+                if profile_context_length(freq) == 3:
+                    self.channel_tables[signature] = (*build_channel_table(freq), None)
+                else:
+                    channels, channel_contexts, channel_probs, contexts = build_context_channel_table(freq)
+                    self.channel_tables[signature] = (channels, channel_contexts, channel_probs, tuple(contexts))
+        return self.channel_tables[signature]
+
+    def get_count_matrix(self, transcript_list):
+        if transcript_list not in self.count_matrices:
+            transcripts = read_transcript_list(transcript_list) if transcript_list is not None else None
+            self.count_matrices[transcript_list] = compute_count_matrix(transcripts, self.store)
+        return self.count_matrices[transcript_list]
+
+    def get_sampling_tables(self, transcript_list, contexts=None):
+        key = (transcript_list, contexts)
+        if key not in self.sampling_tables:
+            rows, counts = self.get_count_matrix(transcript_list)
+            if contexts is None:
+                self.sampling_tables[key] = (get_alias_tables(rows, counts, self.db_folder), None)
+            else:
+                if self.context_index is None:
+                    self.context_index = ContextIndex.open(self.db_folder)
+                context_counts, context_starts = self.context_index.count_matrix(list(contexts), rows)
+                alias_tables = get_alias_tables(np.arange(len(rows)), context_counts, self.db_folder, kind="context")    # Indices into rows
+                self.sampling_tables[key] = (alias_tables, (rows, context_counts, context_starts))
+        return self.sampling_tables[key]
+
+    def simulate(self, sample, seed_sequence):
+        """
+        Simulates one sample. Returns the store rows, positions, channel codes and HGVS coding strings of its mutations.
+        """
+
+        rng = np.random.default_rng(seed_sequence)
+        channels, channel_columns, channel_probs, contexts = self.get_channel_table(sample['signature'])
+        channel_codes = sample_channel_counts(channel_probs, sample['n'], rng)
+        alias_tables, context_table = self.get_sampling_tables(sample['transcripts'], contexts)
+        if context_table is None:
+            rows, positions = simulate_mutations(channel_codes, channel_columns, alias_tables, self.store, rng)
+        else:
+            rows, positions = simulate_context_mutations(channel_codes, channel_columns, alias_tables, context_table, self.context_index, rng)
+        return rows, positions, channel_codes, format_hgvsc(rows, positions, channel_codes, channels, self.store)
+
+    def run(self, samples, seed=None):
+        """
+        Simulates the samples one after another and yields (sample, rows, positions, channel codes, HGVS coding strings).
+        Every sample gets its own random stream, so a sample's output does not depend on the rest of the sheet.
+        """
+
+        for sample, seed_sequence in zip(samples, np.random.SeedSequence(seed).spawn(len(samples))):
+            yield (sample, *self.simulate(sample, seed_sequence))
+
+#endregion
+
+
+#### Cohort simulation ####
+def main(argv=None):
+    """
+    Simulates the cohort of the command-line arguments argv (default sys.argv[1:]).
+    """
+
+    parser = argparse.ArgumentParser(description="Simulates a cohort of samples from a sample sheet against one database.")
+    parser.add_argument('sheet', help="Sample sheet (tab separated: sample_id, n, signature, optional transcripts)")
+    parser.add_argument('-d', required=True, help="Database folder with the pre-processed triplet position store")
+    parser.add_argument('-o', required=False, default="output/cohort", help="Output folder, one HGVS coding file (and VCF) per sample")
+    parser.add_argument('--seed', type=int, required=False, help="Random seed. Every sample gets its own stream derived from it")
+    parser.add_argument('--signature-matrix', required=False, default=COSMIC_SIGNATURES, help="Signature matrix CSV used for mixtures")
+    parser.add_argument('--gzip', action='store_true', help="Gzip compress the HGVS coding output")
+    parser.add_argument('--vcf', action='store_true', help="Resolve the mutations and write a VCF per sample")
+    parser.add_argument('--bgzip', action='store_true', help="Write the VCF output bgzip compressed with a tabix index")
+    parser.add_argument('-g', required=False, help="Local GTF annotation for offline resolution")
+    parser.add_argument('-b', type=int, required=False, default=50, help="Batch size for API requests")
+    parser.add_argument('--api-workers', type=int, required=False, default=4, help="Number of API request batches in flight at the same time")
+    parser.add_argument('--retries', type=int, required=False, default=5, help="Retries of a rate limited or failed API request batch")
+    parser.add_argument('--ensembl-url', required=False, default="https://rest.ensembl.org/variant_recoder/homo_sapiens", help="Ensembl variant_recoder endpoint")
+    parser.add_argument('--cache', required=False, help="SQLite HGVS cache file")
+    parser.add_argument('--cache-size', type=int, required=False, default=1000000, help="Maximum number of entries kept in the HGVS cache")
+    args = vars(parser.parse_args(argv))
+
+    samples = read_sample_sheet(args['sheet'])
+    os.makedirs(args['o'], exist_ok=True)
+
+    start = time.perf_counter()
+    cohort = Cohort(args['d'], args['signature_matrix'])                  # Database is opened once for the whole cohort
+    cds_index = load_cds_index(args['g']) if args['vcf'] and args['g'] is not None else None
+    cache = HGVSCache(args['cache'], args['cache_size']) if args['vcf'] and args['cache'] is not None else None
+    print(f"Setup: {time.perf_counter() - start:.3f} s, samples: {len(samples)}")
+
+    last = time.perf_counter()
+    for sample, rows, positions, channel_codes, hgvsc_list in cohort.run(samples, args['seed']):
+        output_path = os.path.join(args['o'], sample['sample_id'])
+        with HGVSWriter(output_path + ".txt", compress=args['gzip']) as writer:
+            writer.write_lines(hgvsc_list)
+        if args['vcf']:
+            chr_info, hgvs_failed = resolve_hgvsc(hgvsc_list, args, cds_index, cache)
+            vcf_writer(chr_info, output_path + (".vcf.gz" if args['bgzip'] else ".vcf"), compress=args['bgzip'])
+        now = time.perf_counter()
+        print(f"{sample['sample_id']}: {len(hgvsc_list)} mutations in {(now - last) * 1000:.1f} ms")      # Simulation and output of the sample
+        last = now
+
+    print(f"Cohort done in {time.perf_counter() - start:.3f} s")
+
+
+if __name__ == "__main__":
+    main()
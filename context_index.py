@@ -0,0 +1,257 @@
+"""Sequence context index for any odd k up to 7 (mono- to heptanucleotide), built once per database."""
+
+# Import modules
+import os                                # Library for interacting with the operating system
+import argparse                          # Library for parsing command-line arguments
+import numpy as np                       # Library for numerical computing
+
+from position_store import PositionStore, TRANSCRIPTS_FILE, _map_array
+from metrics import METRICS
+
+
+# ====================
+# CONTEXT KEYS
+# ====================
+
+#region Keys
+
+# Every position of a transcript gets one key describing the 7 bases around it, read from the centre outwards:
+#   digits = base[p], base[p-1], base[p+1], base[p-2], base[p+2], base[p-3], base[p+3]
+# Each digit is a base code (A=0, C=1, G=2, T=3) or 4 for N / outside the transcript, and the key is the base 5 number of the digits.
+# Positions sharing a k-mer context share the first k digits, so in a sorted key array each context is one contiguous range.
+MAX_K = 7
+OFFSETS_FROM_CENTRE = (0, -1, 1, -2, 2, -3, 3)
+KEY_RANGE = 5 ** MAX_K                   # 78125 possible keys
+MISSING = 4
+
+# Files of the index (kept inside the -d database folder, next to the position store)
+CONTEXT_KEYS_FILE = "context_keys.u32"           # Sorted keys of every transcript, transcripts one after another
+CONTEXT_POSITIONS_FILE = "context_positions.u32" # Position (0-based) of the centre base of every key
+CONTEXT_OFFSETS_FILE = "context_offsets.u64"     # Start of every transcript in the two arrays above (one more entry than transcripts)
+CONTEXT_FILES = (CONTEXT_KEYS_FILE, CONTEXT_POSITIONS_FILE, CONTEXT_OFFSETS_FILE)
+
+BASE_INDEX = {base: code for code, base in enumerate("ACGT")}
+
+
+# Function to compute the context keys of an encoded sequence
+def context_keys(encoded):
+    """
+    Takes a sequence encoded as base codes (4 for anything else) and returns the sorted context keys of the positions with a known base
+    and their positions, in key order.
+    """
+
+    padded = np.concatenate((np.full(3, MISSING, dtype=np.uint32), np.minimum(encoded, MISSING).astype(np.uint32), np.full(3, MISSING, dtype=np.uint32)))
+    length = len(encoded)
+    keys = np.zeros(length, dtype=np.uint32)
+    for offset in OFFSETS_FROM_CENTRE:
+        keys = keys * 5 + padded[3 + offset:3 + offset + length]
+
+    positions = np.flatnonzero(encoded < MISSING).astype(np.uint32)
+    keys = keys[positions]
+    order = np.argsort(keys, kind="stable")                      # Positions stay sorted within a context
+    return keys[order], positions[order]
+
+
+# Function to turn a context into its range of keys
+def context_range(context):
+    """
+    Returns the [low, high) key range of an odd length context of A, C, G and T, e.g. 'ACA' or 'TTCGA'.
+    """
+
+    k = len(context)
+    if k % 2 == 0 or k > MAX_K:
+        raise ValueError(f"Contexts must have an odd length up to {MAX_K}: {context}")
+    centre = k // 2
+    low = 0
+    for offset in OFFSETS_FROM_CENTRE[:k]:
+        low = low * 5 + BASE_INDEX[context[centre + offset]]
+    width = 5 ** (MAX_K - k)
+    return low * width, (low + 1) * width
+
+#endregion
+
+
+# ====================
+# BUILDING
+# ====================
+
+#region Building
+
+# Function to build the context index of a database
+def build_context_index(store_folder):
+    """
+    Builds the context index of every transcript of the position store, in store row order, from the sequences kept in the store.
+    Returns the number of transcripts indexed. Raises a ValueError if a transcript was stored without its sequence.
+    """
+
+    store = PositionStore(store_folder)
+    paths = {name: os.path.join(store_folder, name) for name in CONTEXT_FILES}
+    start = 0
+
+    with METRICS.stage('build_context_index'), open(paths[CONTEXT_KEYS_FILE] + ".tmp", "wb") as keys_out, \
+            open(paths[CONTEXT_POSITIONS_FILE] + ".tmp", "wb") as positions_out:
+        offsets = np.zeros(len(store) + 1, dtype=np.uint64)
+        for row in range(len(store)):
+            encoded = store.get_sequence(store.transcripts[row])
+            if encoded is None:
+                raise ValueError(f"{store.transcripts[row]} has no sequence in {store_folder}, re-index it from the FASTA with build_database.py --sync")
+            keys, positions = context_keys(encoded)
+            keys_out.write(keys.tobytes())
+            positions_out.write(positions.tobytes())
+            start += len(keys)
+            offsets[row + 1] = start
+        with open(paths[CONTEXT_OFFSETS_FILE] + ".tmp", "wb") as offsets_out:
+            offsets_out.write(offsets.tobytes())
+
+    for name in (CONTEXT_KEYS_FILE, CONTEXT_POSITIONS_FILE, CONTEXT_OFFSETS_FILE):    # Offsets last: they decide if the index is complete
+        os.replace(paths[name] + ".tmp", paths[name])
+    return len(store)
+
+#endregion
+
+
+# ====================
+# READING
+# ====================
+
+#region Reading
+
+class ContextIndex:
+    """
+    Read-only, memory-mapped context index of a database. Rows are the rows of the position store.
+    Counts and positions of any odd k-mer context are found with a binary search in the sorted keys of a transcript.
+    """
+
+    def __init__(self, store_folder):
+        with open(os.path.join(store_folder, TRANSCRIPTS_FILE), "r") as table:
+            self.transcripts = [line.rstrip("\n") for line in table]
+        self.row = {transcript: i for i, transcript in enumerate(self.transcripts)}
+
+        self.offsets = _map_array(os.path.join(store_folder, CONTEXT_OFFSETS_FILE), np.uint64).astype(np.int64)
+        if len(self.offsets) != len(self.transcripts) + 1:
+            raise ValueError(f"The context index of {store_folder} is out of date, rebuild it with context_index.py")
+        self.keys = _map_array(os.path.join(store_folder, CONTEXT_KEYS_FILE), np.uint32)
+        self.positions = _map_array(os.path.join(store_folder, CONTEXT_POSITIONS_FILE), np.uint32)
+
+    @classmethod
+    def open(cls, store_folder):
+        """
+        Opens the context index of a database, building it first if it is missing or older than the store.
+        """
+        offsets_path = os.path.join(store_folder, CONTEXT_OFFSETS_FILE)
+        transcripts_path = os.path.join(store_folder, TRANSCRIPTS_FILE)
+        if not os.path.exists(offsets_path) or os.path.getmtime(offsets_path) < os.path.getmtime(transcripts_path):
+            print("Build context index")
+            build_context_index(store_folder)
+        return cls(store_folder)
+
+    def __len__(self):
+        return len(self.transcripts)
+
+    def _slice(self, transcript, context):
+        row = self.row[transcript]
+        start, stop = self.offsets[row], self.offsets[row + 1]
+        low, high = context_range(context)
+        keys = self.keys[start:stop]
+        return start + np.searchsorted(keys, low), start + np.searchsorted(keys, high)
+
+    def get_count(self, transcript, context):
+        """
+        Returns the number of positions of the transcript with the given context.
+        """
+        first, last = self._slice(transcript, context)
+        return int(last - first)
+
+    def get_positions(self, transcript, context):
+        """
+        Returns the positions (0-based) of the centre base of every occurrence of the context in the transcript, sorted.
+        """
+        first, last = self._slice(transcript, context)
+        return np.sort(self.positions[first:last])
+
+    def count_matrix(self, contexts, rows, chunk_size=10000000):
+        """
+        Returns, for the given store rows and contexts, the number of matching positions (rows x contexts, uint32)
+        and the index of the first one in the position array (rows x contexts, int64).
+        Rows are processed in chunks of about chunk_size positions, each with one vectorized binary search.
+        """
+
+        ranges = np.array([context_range(context) for context in contexts], dtype=np.int64).reshape(-1, 2)
+        rows = np.asarray(rows, dtype=np.int64)
+        counts = np.zeros((len(rows), len(contexts)), dtype=np.uint32)
+        starts = np.zeros((len(rows), len(contexts)), dtype=np.int64)
+
+        lengths = self.offsets[rows + 1] - self.offsets[rows]
+        cumulative = np.cumsum(lengths)
+        boundaries = np.unique(np.searchsorted(cumulative, np.arange(chunk_size, cumulative[-1] if len(rows) else 0, chunk_size)))
+        for chunk in np.split(np.arange(len(rows)), boundaries):
+            if len(chunk) == 0 or lengths[chunk].sum() == 0:
+                continue
+            # Index of every key of the chunk in the key array, and the keys made unique across transcripts (local row * KEY_RANGE + key)
+            local = np.repeat(np.arange(len(chunk), dtype=np.int64), lengths[chunk])
+            first = np.concatenate(([0], np.cumsum(lengths[chunk])[:-1]))
+            index = np.arange(len(local)) - first[local] + self.offsets[rows[chunk]][local]
+            global_keys = local * KEY_RANGE + self.keys[index].astype(np.int64)
+
+            bases = np.arange(len(chunk), dtype=np.int64)[:, None] * KEY_RANGE
+            low = np.searchsorted(global_keys, (bases + ranges[:, 0]).ravel()).reshape(len(chunk), -1)
+            high = np.searchsorted(global_keys, (bases + ranges[:, 1]).ravel()).reshape(len(chunk), -1)
+            counts[chunk] = high - low
+            starts[chunk] = index[np.minimum(low, len(index) - 1)]
+
+        return counts, starts
+
+#endregion
+
+
+# ====================
+# CHANNELS
+# ====================
+
+#region Channels
+
+# Function to get the context length of a profile
+def profile_context_length(frequencies):
+    """
+    Returns the context length of a get_freq() dictionary (3 for the usual 96 channel profiles). Raises a ValueError for mixed lengths.
+    """
+
+    lengths = {len(context) for context in frequencies}
+    if len(lengths) != 1:
+        raise ValueError(f"The profile mixes contexts of lengths {sorted(lengths)}")
+    return lengths.pop()
+
+
+# Function to turn the frequency dictionary of a longer context profile into integer-coded channels
+def build_context_channel_table(frequencies):
+    """
+    Same as randomized_operations.build_channel_table() for profiles with contexts of any odd length (e.g. 'TTCGA' with 'C/T').
+    Returns the channels, the context code of each channel (index into the returned list of distinct contexts), the channel probabilities
+    and the contexts.
+    """
+
+    channels = []
+    probs = []
+    for context in frequencies:
+        context_range(context)                                  # Raises a ValueError for unsupported lengths
+        for change in frequencies[context]:
+            ref, alt = change.split("/")
+            channels.append((context, ref, alt))
+            probs.append(frequencies[context][change]['freq'])
+
+    contexts = list(dict.fromkeys(context for context, _, _ in channels))
+    context_code = {context: code for code, context in enumerate(contexts)}
+    channel_contexts = np.array([context_code[context] for context, _, _ in channels], dtype=np.int64)
+    return channels, channel_contexts, np.array(probs), contexts
+
+#endregion
+
+
+#### Build the context index of a database ####
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Builds the k-mer context index (odd k up to 7) of a database folder.")
+    parser.add_argument('-d', required=True, help="Database folder with a position store")
+    args = vars(parser.parse_args())
+
+    print(f"Indexed {build_context_index(args['d'])} transcripts")
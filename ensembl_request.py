@@ -2,8 +2,43 @@
 
 # Import modules
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+import random
+import time
 import json
 import re
+import math
+import email.utils
+from datetime import datetime, timezone
+
+from metrics import METRICS
+
+# Status codes worth retrying: rate limited, and transient server errors
+RETRY_STATUS = {429, 500, 502, 503, 504}
+MAX_BATCH_SIZE = 200                      # Largest POST accepted by variant_recoder
+
+pattern_version = re.compile(r'^([^:.]+)\.\d+:')                      # Transcript version, e.g. the '.12' in 'ENST00000169551.12:c.609G>A'
+
+
+# Function to compare HGVS coding strings regardless of the transcript version
+def strip_version(hgvs):
+    """
+    Removes the transcript version from a HGVS string.
+    """
+    return pattern_version.sub(r'\1:', hgvs)
+
+
+# Function to pick the genomic notation out of the hgvsg list of a response
+def pick_hgvsg(hgvsg_list):
+    """
+    Returns the first hgvsg on a chromosome (NC_) accession, which hgvs_converter() needs, or the first one if there is none.
+    """
+    for genomic in hgvsg_list:
+        if genomic.startswith("NC_"):
+            return genomic
+    return hgvsg_list[0] if hgvsg_list else None
 
 # Takes the list of hgvs_coding if it contains more than 200 items and splits it into smaller lists.
 # Integrated into get_hgvs_genomic function
@@ -15,77 +50,205 @@ def split_list(list, size):
     # Return a list of sublists with the specified size
     return [list[i:i + size] for i in range(0, len(list), size)] 
 
-# TODO: This function needs optimization. It loops every input multiple times.
+# Function to read the Retry-After header, which holds a delay in seconds or an HTTP date (RFC 9110)
+def parse_retry_after(value):
+    """
+    Returns the number of seconds to wait from a Retry-After value, or None if it is neither a number of seconds nor an HTTP date.
+    """
+    try:
+        seconds = float(value)
+        return max(seconds, 0.0) if math.isfinite(seconds) else None
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if when.tzinfo is None:                                                # Dates without a zone are UTC, as HTTP dates always are
+        when = when.replace(tzinfo=timezone.utc)
+    return max((when - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class RateLimit:
+    """
+    Shared pause for all threads talking to Ensembl. Set from the Retry-After and X-RateLimit-* response headers.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.resume_at = 0.0
+    
+    def pause(self, seconds):
+        with self.lock:
+            self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+    
+    def update(self, response_headers):
+        """
+        Pauses until the rate limit resets when Ensembl reports no requests left, or asks to retry later.
+        Returns True if a readable Retry-After header set the pause (an unreadable one is ignored, the caller's backoff applies).
+        """
+        if "Retry-After" in response_headers:
+            seconds = parse_retry_after(response_headers["Retry-After"])
+            if seconds is not None:
+                self.pause(seconds)
+                return True
+        elif response_headers.get("X-RateLimit-Remaining") == "0" and "X-RateLimit-Reset" in response_headers:
+            seconds = parse_retry_after(response_headers["X-RateLimit-Reset"])     # Seconds until the reset
+            if seconds is not None:
+                self.pause(seconds)
+        return False
+    
+    def wait(self):
+        with self.lock:
+            delay = self.resume_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+# Function to open a pooled connection to Ensembl
+def make_session(workers):
+    """
+    Returns a requests session keeping up to 'workers' connections open, so batches reuse connections.
+    """
+    
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# Sends one batch to Ensembl. Retries rate limited and transient failures with jittered exponential backoff.
+def post_batch(session, url, headers, sublist, rate_limit, max_retries=5, backoff=0.5, timeout=60):
+    """
+    Posts one batch of HGVS coding to the REST API.
+    Returns the parsed JSON (None if the batch failed), the last status (or error message), the latency in seconds and the number of attempts.
+    """
+    
+    data = json.dumps({"ids": sublist})                                   # Ensembl REST API (variant_recorder)
+    start = time.perf_counter()
+    status = None
+    
+    for attempt in range(max_retries + 1):
+        rate_limit.wait()                                                  # Honours pauses requested by any earlier response
+        retry_after = False
+        try:
+            response = session.post(url, headers=headers, data=data, timeout=timeout)
+        except requests.exceptions.RequestException as e:
+            status = f"error: {e}"                                         # Connection problems are transient, retried below
+        else:
+            status = response.status_code
+            retry_after = rate_limit.update(response.headers)
+            if status == 200:
+                try:
+                    return response.json(), status, time.perf_counter() - start, attempt + 1
+                except ValueError:
+                    status = "error: invalid JSON body"                    # Truncated answer or an HTML page (proxy, maintenance), retried below
+            elif status not in RETRY_STATUS:
+                print(f"Failed to retrieve data: {status}\n")
+                print(f"{response.text}\n")
+                break
+        
+        if attempt < max_retries and not retry_after:                      # With a readable Retry-After, rate_limit.wait() already pauses as long as asked
+            time.sleep(backoff * 2 ** attempt * random.uniform(0.5, 1.5))   # Jitter spreads the retries of concurrent batches
+    
+    return None, status, time.perf_counter() - start, attempt + 1
+
+
+# Matches the answer of one batch back to its inputs, with hashed lookups only (linear in the size of the batch).
+def reconcile_batch(sublist, result):
+    """
+    Returns {hgvsc: hgvsg} for every input of the batch found in the variant_recoder answer.
+    Each input keeps its own hgvsg: answers are matched through their 'input' and through every transcript notation in their 'hgvsc' list,
+    so several mutations in the same transcript (which Ensembl may answer in one entry, one allele each) do not collapse into one result.
+    """
+    
+    lookup = {}                                                          # Version-less HGVS coding -> inputs of the batch
+    for hgvs in sublist:
+        lookup.setdefault(strip_version(hgvs), []).append(hgvs)
+    
+    resolved = {}
+    for allele in result:
+        for _, variant_data in allele.items():                           # One dictionary per allele. Errors are saved as lists or strings.
+            if type(variant_data) != dict:
+                continue
+            genomic = pick_hgvsg(variant_data.get('hgvsg', []))
+            if genomic is None:
+                continue
+            
+            for coding in [variant_data.get('input', '')] + variant_data.get('hgvsc', []):
+                for hgvs in lookup.get(strip_version(coding), ()):
+                    resolved.setdefault(hgvs, genomic)                  # The first (most specific) match of an input wins
+    
+    return resolved
+
+
 # Takes a list of HGVS coding, url to ensembl,and Ensembl REST API (variant_recorder) 
 # headers as input and returns a dictionary with the corresponding HGVS genomic (HGVSG) notation.
-def get_hgvs_genomic(hgvs_input, url, headers, batch_size):
+def get_hgvs_genomic(hgvs_input, url, headers, batch_size, cache=None, workers=4, max_retries=5, metrics=METRICS):
     """
     Extracts and HGVS genomic (HGVSG) corresponding to the input HGVS coding (HGVSC).
+    If a cache (hgvs_cache.HGVSCache) is given, it is consulted first and only cache misses are sent to Ensembl.
+    Up to 'workers' batches are in flight at the same time over one pooled session.
+    API and cache counters go to metrics (e.g. the Metrics of one simulation run).
+    Returns {hgvsc: hgvsg} and the set of HGVS coding that could not be resolved.
     """
     
     hgvs_input = list(set(hgvs_input))                                 # Remove duplicates
-    
-    # Check if input needs to be split into smaller lists
-    if len(hgvs_input) > batch_size:                  
-        sublists = split_list(hgvs_input, batch_size)              # Split the list into smaller lists   
-    else:
-        sublists = [hgvs_input]                                         # If the list is smaller than the maximum batch size, save it as a sublist
+    if batch_size > MAX_BATCH_SIZE:
+        print(f"Batch size {batch_size} is above the API maximum, using {MAX_BATCH_SIZE}")
+        batch_size = MAX_BATCH_SIZE
         
     # Storage
     hgvs_genomic = {}
-    hgvs_failed = [(i, hgvs) for i, hgvs in enumerate(hgvs_input)]       # A list of tuples (index, value)
-    index_map = {hgvs: i for i, hgvs in enumerate(hgvs_input)}           # A dictionary mapping hgvs to its original index
+    hgvs_failed = set(hgvs_input)                                        # Removed from as inputs get resolved
+    hgvs_negative = []                                                   # Inputs Ensembl answered for, but could not resolve
     
-    #Start request loop for sublists
-    for sublist in sublists:
-        
-        # TODO: Remove testprint when fixed
-        # Testprint Before request
-        print("\nSublist entering request")
-        #for coding in sublist:
-        #    print(coding)
-            
-        print("Accessing Ensembl REST API...")
-        # Ensembl REST API (variant_recorder)
-        data = json.dumps({"ids": sublist}) 
+    # Consult the cache before batching, so only misses go to the network
+    hgvs_request = hgvs_input
+    if cache is not None:
+        cached, cached_negative, hgvs_request = cache.get_many(hgvs_input)
+        hgvs_genomic.update(cached)
+        hgvs_failed.difference_update(cached)
+        metrics.count('resolutions_cached', len(cached))
+        metrics.count('resolutions_cached_negative', len(cached_negative))
+        print(f"Cache hits: {len(cached)}, cached failures: {len(cached_negative)}, misses: {len(hgvs_request)}")
+    
+    # Split the remaining input into smaller lists of at most batch_size
+    sublists = split_list(hgvs_request, batch_size)
+    
+    # Send the batches concurrently and process them as they come back
+    print(f"Accessing Ensembl REST API: {len(sublists)} batches, {workers} in flight")
+    session = make_session(workers)
+    rate_limit = RateLimit()
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(post_batch, session, url, headers, sublist, rate_limit, max_retries): sublist for sublist in sublists}
         
-        # Execute request
-        try:
-            response = requests.post(url, headers=headers, data=data) 
-        except requests.exceptions.RequestException as e:
-            print(f"An error occurred while making the POST request: {e}")
-            continue
-        # Proceed with successful requests
-        if response.status_code == 200:                                      # Status code 200 means successfull request                         
+        for future in as_completed(futures):
+            sublist = futures[future]
+            result, status, latency, attempts = future.result()
+            print(f"Batch of {len(sublist)}: status {status}, {latency:.2f}s, {attempts} attempt(s)")   # Per-batch latency report
+            metrics.count('api_batches')
+            metrics.count('api_attempts', attempts)
+            metrics.observe('api_latency_seconds', latency)
             
-            result = response.json()                                         # Parse the response JSON
-            # Testprint
-            #print("\nOutput JSON from ensembl:")
-            #print(json.dumps(result, indent=4))
-            processed = set()                                                # A set to keep track of processed items
-            found_match = False                                              # Flag for matching HGVS coding
+            # Failed batches stay in hgvs_failed, after all retries were used
+            if result is None:
+                metrics.count('api_failed_batches')
+                continue
             
-            print("\nTesting matching coding/genomic:")
-            # Iterate over each HGVS coding
-            for allele in result:                       
-                for _, variant_data in allele.items():                       # Iterate over each dictionary in the list
-                    if type(variant_data) == dict:                           # Errors saved as lists, hits saved as dictionaries.
-                        
-                        if variant_data['input'] in sublist:                 
-                            j = sublist.index(variant_data['input'])         # Identify which input entry is this element
-                            hgvs_genomic[sublist[j]] = variant_data['hgvsg'][0]
-                            hgvs_failed.remove((index_map[sublist[j]], sublist[j]))
-                                    
-                    else:
-                        print("Input contains errors.")
-                        
-            #if not found_match:
-            #    print("No matching HGVS coding found.")
-                
-        # Print error status code and message if the request failed
-        else:
-            print(f"Failed to retrieve data: {response.status_code}\n")
-            print(f"{response.text}\n")
+            resolved = reconcile_batch(sublist, result)
+            hgvs_genomic.update(resolved)
+            hgvs_failed.difference_update(resolved)
+            hgvs_negative += [hgvs for hgvs in sublist if hgvs not in resolved]     # Answered, but not resolved
+    
+    # Store the new results. Batches that failed to return are not stored, so they are retried next time.
+    if cache is not None:
+        cache.put_many({hgvs: hgvs_genomic[hgvs] for hgvs in hgvs_request if hgvs in hgvs_genomic}, hgvs_negative)
+    
+    metrics.count('resolutions_api', sum(1 for hgvs in hgvs_request if hgvs in hgvs_genomic))
+    metrics.count('resolutions_failed', len(hgvs_failed))
             
     return hgvs_genomic, hgvs_failed
 
@@ -0,0 +1,123 @@
+"""Local stand-in for the Ensembl REST API (variant_recoder), for testing and benchmarking without network access."""
+
+# Import modules
+import json                              # Library for JSON encoding and decoding
+import re                                # Library for regular expressions
+import time                              # Library for the simulated latency
+import random                            # Library for the simulated rate limiting
+import zlib                              # Only used for a stable hash of transcript IDs
+import threading                         # Library for running the server in the background
+import argparse                          # Library for parsing command-line arguments
+import email.utils                       # Library for the HTTP date form of Retry-After
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+pattern_hgvsc = re.compile(r'^([^:.]+)(?:\.\d+)?:c\.(\d+)([ACGT])>([ACGT])$')
+
+
+# Function to make up a genomic notation for a HGVS coding string
+def fake_hgvsg(coding):
+    """
+    Returns a stable, made up HGVS genomic string (NC_ chromosome accession) for a HGVS coding string, or None if it cannot be parsed.
+    """
+
+    match = pattern_hgvsc.match(coding)
+    if not match:
+        return None
+
+    transcript, c_position, reference, alternative = match.groups()
+    chromosome = zlib.crc32(transcript.encode()) % 24 + 1                 # 1-22, 23 = X, 24 = Y, as in hgvs_converter()
+    locus = 1000000 + (zlib.crc32(transcript.encode()) % 1000) * 100000 + int(c_position)
+    return f"NC_0000{chromosome:02d}.11:g.{locus}{reference}>{alternative}"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Answers POST requests like variant_recoder: one entry per input, keyed by the alternative allele.
+    """
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        with server.lock:
+            server.n_requests += 1
+            scripted = server.script.pop(0) if server.script else None
+
+        # Scripted failures first, then simulated rate limiting
+        if scripted == "bad_json":                                          # A 200 answer with an HTML body, like the Ensembl maintenance page
+            payload = b"<html><body>Service temporarily unavailable</body></html>"
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+        if scripted in ("429", "429_date", "429_invalid") or random.random() < server.rate_limit_fraction:
+            if scripted == "429_date":                                      # HTTP date form, allowed by RFC 9110
+                retry_after = email.utils.formatdate(time.time() + server.retry_after, usegmt=True)
+            else:
+                retry_after = "soon" if scripted == "429_invalid" else str(server.retry_after)
+            self.send_response(429)
+            self.send_header("Retry-After", retry_after)
+            self.end_headers()
+            return
+
+        time.sleep(server.latency)
+
+        result = []
+        for coding in json.loads(body)["ids"]:
+            genomic = fake_hgvsg(coding)
+            if genomic is None:
+                result.append({"warnings": [f"Unable to parse {coding}"]})
+            else:
+                result.append({genomic[-1]: {"input": coding, "hgvsg": [genomic], "hgvsc": [coding]}})
+
+        payload = json.dumps(result).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass                                                               # Keeps the output of the simulator readable
+
+
+# Function to start the stand-in server in a background thread
+def start_stub_server(port=0, latency=0.0, rate_limit_fraction=0.0, retry_after=0.1, script=()):
+    """
+    Starts the stand-in server on localhost. Port 0 picks a free port.
+    script lists the answers of the first requests, in order: "429" (rate limited), "429_date" (rate limited, Retry-After as an HTTP date),
+    "429_invalid" (rate limited, unreadable Retry-After) or "bad_json" (200 with an HTML body).
+    Returns the server (call server.shutdown() to stop it) and the variant_recoder URL to use.
+    """
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    server.latency = latency                                  # Seconds added to every answer
+    server.rate_limit_fraction = rate_limit_fraction          # Fraction of requests answered with 429
+    server.retry_after = retry_after                          # Retry-After header of the 429 answers
+    server.n_requests = 0
+    server.script = list(script)                              # Answers of the first requests, see above
+    server.lock = threading.Lock()
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/variant_recoder/homo_sapiens"
+    return server, url
+
+
+#### Run the stand-in server ####
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Local stand-in for the Ensembl variant_recoder endpoint.")
+    parser.add_argument('--port', type=int, default=8000, help="Port to listen on")
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every answer")
+    parser.add_argument('--rate-limit', type=float, default=0.0, help="Fraction of requests answered with 429")
+    args = vars(parser.parse_args())
+
+    server, url = start_stub_server(args['port'], args['latency'], args['rate_limit'])
+    print(f"Serving on {url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
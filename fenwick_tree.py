@@ -0,0 +1,98 @@
+"""Fenwick (binary indexed) trees for exact sampling of positions without replacement."""
+
+# Import modules
+import numpy as np                       # Library for numerical computing
+
+
+# ====================
+# FENWICK TREE
+# ====================
+
+#region Fenwick
+
+class FenwickTree:
+    """
+    Binary indexed tree over n entries holding weights[i] sites each (one site each by default), all available at the start.
+    Popping the k-th remaining site (finding its entry and removing it) takes O(log n), so every draw stays as cheap as the first,
+    however many sites are already taken.
+    """
+
+    def __init__(self, n, weights=None):
+        self.n = n
+        # Node i covers the entries (i - (i & -i), i] (1-based), so it holds the difference of two prefix sums of the weights
+        nodes = np.arange(n + 1, dtype=np.int64)
+        if weights is None:
+            tree = nodes & -nodes
+        else:
+            prefix = np.zeros(n + 1, dtype=np.int64)
+            np.cumsum(np.asarray(weights, dtype=np.int64), out=prefix[1:])
+            tree = prefix[nodes] - prefix[nodes - (nodes & -nodes)]
+        self.remaining = n if weights is None else int(prefix[-1])
+        self.tree = tree.tolist()                            # Python list: single element access is much faster than on an array
+        self.top = 1 << (n.bit_length() - 1) if n > 0 else 0 # Largest power of two <= n, where the descent starts
+
+    def pop(self, k):
+        """
+        Finds the entry (0-based) holding the k-th remaining site (k from 0 to remaining - 1) and removes that site, in one descent:
+        the nodes the descent does not step over are exactly the nodes covering the found site.
+        Returns the entry and the rank of the site among the remaining sites of that entry.
+        """
+        tree = self.tree
+        n = self.n
+        node = 0
+        step = self.top
+        while step:
+            child = node + step
+            if child <= n:
+                if tree[child] <= k:
+                    k -= tree[child]
+                    node = child
+                else:
+                    tree[child] -= 1                         # The site is inside this subtree
+            step >>= 1
+        self.remaining -= 1
+        return node, k
+
+#endregion
+
+
+# ====================
+# SITE SAMPLING
+# ====================
+
+#region Sites
+
+# Function to draw distinct sites for every column of a count matrix
+def draw_sites_without_replacement(codes, counts, rng):
+    """
+    Draws one site for every entry of codes (column codes of the count matrix, e.g. triplet codes), with no site drawn twice.
+    Every remaining site of a column is equally likely: a tree over the rows, weighted by their remaining sites, picks the row,
+    then a tree over the sites of that row picks the site. Site trees are only built for the rows that are hit, so a run costs
+    O(rows) per drawn column and O(log) per draw, not O(sites).
+    Returns the count matrix row and the index of the position within the row's slice, for every entry of codes.
+    """
+
+    local_rows = np.empty(len(codes), dtype=np.int64)
+    offsets = np.empty(len(codes), dtype=np.int64)
+
+    order = np.argsort(codes, kind="stable")                             # Groups the draws by column
+    columns, starts = np.unique(codes[order], return_index=True)
+    for code, group in zip(columns, np.split(order, starts[1:])):
+        column = np.asarray(counts[:, code], dtype=np.int64)
+        rows_tree = FenwickTree(len(column), column)
+        if len(group) > rows_tree.remaining:
+            raise ValueError(f"{len(group)} mutations drawn without replacement from column {code}, which has only {rows_tree.remaining} sites")
+
+        site_trees = {}                                                  # Row -> tree over its sites, built on the first hit
+        drawn = []
+        for u in rng.random(len(group)).tolist():
+            row, rank = rows_tree.pop(min(int(u * rows_tree.remaining), rows_tree.remaining - 1))
+            sites = site_trees.get(row)
+            if sites is None:
+                sites = site_trees[row] = FenwickTree(int(column[row]))
+            drawn.append((row, sites.pop(rank)[0]))                     # The rank-th remaining site of the row
+        local_rows[group], offsets[group] = np.array(drawn, dtype=np.int64).reshape(-1, 2).T
+
+    return local_rows, offsets
+
+#endregion
@@ -1,6 +1,12 @@
 """Frequencies and position functions"""
 
+import os
 import pickle
+import numpy as np
+
+from metrics import METRICS
+
+from position_store import TRIPLETS, TRIPLET_INDEX, PositionStore, PositionStoreWriter, is_position_store
 
 # Function to calculate frequencies
 def get_freq(profile_file):
@@ -10,6 +16,7 @@ def get_freq(profile_file):
     """
     freq = {}
     total_count = 0
+    METRICS.count('bytes_read', os.path.getsize(profile_file))
     
     with open(profile_file, 'r') as file:                          # Opens the mutational count file
         for line in file:
@@ -54,13 +61,11 @@ def calculate_triplet_counts(sequences):
     # Iterate sequences dictionary extracted from FASTA transcripts        Example:     {'sequenceID': 'ATGCGACTGATCGATCGTACG',}
     for transcript, sequence in sequences.items():                         # Iterates over the sequences dicrionary input
         gene_length[transcript] = len(sequence)                            # Adds the length of the sequence to the dictionary as value, ex: {'sequenceID': 21}
-        triplets = [sequence[i:i+3] for i in range(len(sequence) - 2)]     # Creates a list of triplets from the sequence. [i:i+3] is the slice of the sequence.
-                                                                        # -2 since it is triplets so lenght is two less than the full sequence. [i:i+3] gives 3 positions. 
+        counts, positions = index_sequence(sequence)                       # Vectorised 2-bit indexing, see index_sequence(). Triplets containing N are not counted.
+        
         # Count triplets (per transcript and total), triplet frequencies (per transcript), store positions of triplets
-        count = {}
-        for i, triplet in enumerate(triplets):                                         # Iterates over the triplets. enumerate() function is used to get both the index (i) and the value (triplet) of each element.
-            count[triplet] = count.get(triplet, 0) + 1                                 # counting the occurrences of each triplet. The get() method of the dictionary is used to retrieve the current count of the triplet (or 0 if the triplet is not yet in the dictionary), and then 1 is added to this count. The result is then stored back in the count dictionary with the triplet as the key.
-            pos_in_gene.setdefault(transcript, {}).setdefault(triplet, []).append(i)   # Adds the position of the triplet in the gene to the dictionary. This line is storing the positions of each triplet in the pos_in_gene dictionary. The setdefault() method is used to ensure that there is a dictionary for each transcript and a list for each triplet. The index i is then appended to the list of positions for the triplet. The index i is then appended to the list of positions for the triplet. This results in a nested dictionary structure where the keys are the transcript values, each transcript maps to another dictionary where the keys are the triplet values, and each triplet maps to a list of positions.
+        count = {TRIPLETS[code]: int(counts[code]) for code in np.flatnonzero(counts)}
+        pos_in_gene[transcript] = {triplet: part.tolist() for triplet, part in zip(count, np.split(positions, np.cumsum(counts[counts > 0])[:-1]))}
                         # example: {'transcript1': {'ATG': [0, 5, 10], 'TGC': [1, 6]}, 'transcript2': {'ATG': [0, 3, 7], 'TGC': [1]}}
         triplet_count[transcript] = {triplet: {'count': c, 'freq': c/(len(sequence)-2)} for triplet, c in count.items()}    # Adds the triplet count and frequency to the dictionary. This line of code is creating a dictionary comprehension that maps each triplet to another dictionary. This inner dictionary contains two keys: 'count' and 'freq'.
                         # example: {'transcript1': {'ATG': {'count': 3, 'freq': 0.3}, 'TGC': {'count': 2, 'freq': 0.2}}}
@@ -70,46 +75,199 @@ def calculate_triplet_counts(sequences):
     return triplet_count, gene_length, pos_in_gene, counting               
 
 
-def process_triplet_positions(sequences, db_folder, triplet_counts={}):
+# Lookup table from ASCII byte to 2-bit base code (A=0, C=1, G=2, T=3). Every other character (N, gaps, ...) maps to 4.
+BASE_CODES = np.full(256, 4, dtype=np.uint8)
+for code, base in enumerate("ACGT"):
+    BASE_CODES[ord(base)] = code
+    BASE_CODES[ord(base.lower())] = code
+
+
+# Function to encode a sequence as an array of base codes
+def encode_sequence(sequence):
+    """
+    Encodes a sequence string as a uint8 array of 2-bit base codes (4 for anything that is not A, C, G or T).
+    """
+    return BASE_CODES[np.frombuffer(sequence.encode("ascii"), dtype=np.uint8)]
+
+
+# Function to compute the triplet code at every position of an encoded sequence
+def encode_triplets(encoded):
+    """
+    Computes the 6-bit triplet code (index into TRIPLETS) of the triplet starting at every position, in one vectorised pass.
+    Returns the codes and a mask of the positions whose triplet only contains A, C, G and T.
+    """
+    
+    if len(encoded) < 3:
+        return np.zeros(0, dtype=np.uint8), np.zeros(0, dtype=bool)
+    
+    valid = encoded < 4
+    valid = valid[:-2] & valid[1:-1] & valid[2:]                       # Triplets containing N are masked out explicitly
+    codes = ((encoded[:-2] & 3) << 4) | ((encoded[1:-1] & 3) << 2) | (encoded[2:] & 3)
+    return codes, valid
+
+
+# Function to index the triplets of one sequence
+def index_sequence(sequence):
+    """
+    Finds the positions of every triplet in a sequence.
+    Returns a count array (one entry per triplet code) and the positions packed into one uint32 array ordered by triplet code.
+    Triplets containing anything other than A, C, G and T are left out.
+    """
+    
+    return index_encoded(encode_sequence(sequence))
+
+
+# Function to index the triplets of one sequence already encoded as base codes
+def index_encoded(encoded):
+    """
+    Same as index_sequence() for a sequence encoded with encode_sequence(), so the codes can be kept in the store as well.
+    """
+    
+    codes, valid = encode_triplets(encoded)
+    positions = np.flatnonzero(valid).astype(np.uint32)                # Start of every ACGT triplet
+    codes = codes[valid]
+    
+    counts = np.bincount(codes, minlength=len(TRIPLETS)).astype(np.uint32)
+    order = np.argsort(codes, kind="stable")                           # Groups positions by triplet, keeping them sorted within a triplet
+    return counts, positions[order]
+
+
+def process_triplet_positions(sequences, db_folder, triplet_counts=None):
     """
     Calculates triplet counts and probabilities for each sequence.
-    Saves triplet positions within each transcript as it processes them.
+    Saves triplet positions within each transcript into the position store of the database folder as it processes them.
     Returns a dictionary containig triplet counts.
     Triplets counts can be supplied (if one wants to append to a previously computed dictionary) or started from empty
+    Transcripts already in the database are counted but not appended again, and only the first of repeated IDs is used, as in build_database.py.
     """
     
-    for (transcript, sequence) in sequences:                               # Iterates over the sequences
-        triplets = [sequence[i:i+3] for i in range(len(sequence) - 2)]     # Creates a list of triplets from the sequence
-        count = {}
-        pos_in_transcript = {}
-        
-        for i, triplet in enumerate(triplets):                                         # Iterates over the triplets
-            count[triplet] = count.get(triplet, 0) + 1                                 # Adds the triplet to the dictionary and counts it. If in the dictionary, adds 1 to the count. If not, adds the triplet to the dictionary count 1.
-            pos_in_transcript.setdefault(triplet, []).append(i)                        # Adds the position of the triplet in the gene to the (transcript-specific) dictionary
-        del triplets      # Delete triplets to help reduce memory usage
-        
-        dbname = db_folder+'/'+transcript+'.pkl'                                      # Used to construct a file path for a pickle file that is specific to each transcript.
-        with open(dbname, 'wb') as saved_dict:
-            pickle.dump(pos_in_transcript, saved_dict, pickle.HIGHEST_PROTOCOL)       # Pickle the processed triplet positions dictionary using the highest protocol available. pickle.HIGHEST_PROTOCOL is a constant that represents the highest protocol number available in your Python interpreter. Using the highest protocol allows you to pickle more kinds of Python objects
-        [triplet_counts.setdefault(triplet, [[],[]])[1].append(c) for triplet, c in count.items()]  # Add triplet count info to total counts. If info on triplet does not exist yet, then initialises it as two lists
-        [triplet_counts[triplet][0].append(transcript) for triplet in count.keys()]
+    if triplet_counts is None:                                                 # A new dictionary on every call (a {} default would be shared between calls)
+        triplet_counts = {}
+    store = PositionStore(db_folder) if is_position_store(db_folder) else None
+    seen = set()
+    
+    with METRICS.stage('process_triplet_positions'), PositionStoreWriter(db_folder) as writer:    # Keeps the store files open while the transcripts are processed
+        for (transcript, sequence) in sequences:                               # Iterates over the sequences
+            if transcript in seen:
+                continue
+            seen.add(transcript)
+            if store is not None and transcript in store:
+                counts = store.get_counts(transcript)                          # Already in the database, a second row would be counted twice
+            else:
+                encoded = encode_sequence(sequence)
+                counts, positions = index_encoded(encoded)
+                writer.add(transcript, counts, positions, encoded)             # Appends the transcript row (and its sequence) to the store
+            add_triplet_counts(triplet_counts, transcript, counts)             # Add triplet count info to total counts
         
     return triplet_counts             # Returns one count dictionary
 
+
+# Function to add the counts of one transcript to the triplet_counts dictionary
+def add_triplet_counts(triplet_counts, transcript, counts):
+    """
+    Adds the triplet counts of a transcript (in triplet code order) to the total counts. If info on a triplet does not exist yet, then initialises it as two lists.
+    """
+    
+    for code in np.flatnonzero(counts):
+        entry = triplet_counts.setdefault(TRIPLETS[code], [[],[]])
+        entry[0].append(transcript)
+        entry[1].append(int(counts[code]))          # example: {'CGA': [['ENST01', 'ENST02'], [3, 5]]}
+
+
 def compute_triplet_counts(seqIDs, db_folder):
     """
     Calculates triplet counts for given list of transcripts, when transcripts are already in database
     """
     triplet_counts={}    
+    store = PositionStore(db_folder)                                       # Memory-maps the position store, nothing is unpickled
     
     for transcript in seqIDs:                                              # Iterates over the sequences
-        with open(db_folder+'/'+transcript+'.pkl', 'rb') as read_db:       # Pathing together the file path for the pickle file that is specific to each transcript. Opens the pickle file in read mode. The 'r' stands for read mode, and the 'b' stands for binary mode. So 'rb' means the file is opened for reading in binary mode. This is typically used for non-text files like images or executable files, or in this case, pickle files.
-            posingene = pickle.load(read_db)                               # Read pickled transcript dictionary
-        [triplet_counts.setdefault(triplet, [[],[]])[1].append(len(pos)) for triplet, pos in posingene.items()]  # Add triplet count info to total counts. If info on triplet does not exist yet, then initialises it as two lists
-        [triplet_counts[triplet][0].append(transcript) for triplet in posingene.keys()]
+        counts = store.get_counts(transcript)                              # Number of occurrences of each triplet, in triplet code order
+        add_triplet_counts(triplet_counts, transcript, counts)
                     
     return triplet_counts 
 
+
+# ====================
+# COUNT MATRIX
+# ====================
+
+# The simulator works on a transcript x triplet count matrix instead of the triplet_counts dictionary:
+#   rows   - store rows of the selected transcripts
+#   counts - uint32 matrix, counts[j, code] = occurrences of triplet 'code' in transcript rows[j]
+
+# Function to read a transcript list given with -t
+def read_transcript_list(transcript_list_file):
+    """
+    Reads in list of transcript IDs to consider
+    """
+    seqIDs = []
+    with open(transcript_list_file, "r") as list_in:
+        lines = list_in.readlines()
+    seqIDs = [(l.strip().split('|')[0]).split('.')[0] for l in lines] # processing to ignore .version and other info
+    return seqIDs                                                     # example output: ['ENST000001', 'ENST000002']
+
+
+# Function to select the count matrix rows of a list of transcripts
+def compute_count_matrix(seqIDs, store):
+    """
+    Returns the store rows and triplet count matrix of the given transcripts (a row selection of the memory-mapped matrix).
+    If no transcripts are given, all transcripts of the database are used, each once (the latest row of a transcript added twice).
+    """
+    
+    if seqIDs is None:
+        rows = np.unique(np.fromiter(store.row.values(), dtype=np.int64, count=len(store.row)))
+    else:
+        rows = store.select(seqIDs)
+    return rows, store.counts[rows]                                        # Fancy indexing copies only the selected rows
+    
+
+# Function to turn a triplet_counts dictionary into the count matrix
+def count_matrix_from_dict(triplet_counts, store):
+    """
+    Converts a triplet_counts dictionary (e.g. an old pickled -c file) into store rows and a count matrix.
+    """
+    
+    transcripts = list(dict.fromkeys(name for names, _ in triplet_counts.values() for name in names))    # Unique, in order of appearance
+    rows = store.select(transcripts)
+    position = {transcript: j for j, transcript in enumerate(transcripts)}
+    
+    counts = np.zeros((len(rows), len(TRIPLETS)), dtype=np.uint32)
+    for triplet, (names, values) in triplet_counts.items():
+        if triplet in TRIPLET_INDEX:                                       # Triplets containing N etc. are left out
+            counts[[position[name] for name in names], TRIPLET_INDEX[triplet]] = values
+    return rows, counts
+
+
+# Function to save a count file for -c
+def save_count_file(path, transcripts, counts):
+    """
+    Saves a count matrix as a .npy file, with its transcript IDs in <path without .npy>.transcripts.txt
+    """
+    
+    np.save(path, np.asarray(counts, dtype=np.uint32))
+    with open(path[:-len(".npy")] + ".transcripts.txt", "w") as table:
+        table.write("".join(transcript + "\n" for transcript in transcripts))
+
+
+# Function to read a count file given with -c
+def load_count_file(path, store):
+    """
+    Reads a count file: a .npy count matrix (memory-mapped) with its .transcripts.txt table, or an old pickled triplet_counts dictionary.
+    Returns store rows and the count matrix.
+    """
+    
+    METRICS.count('bytes_read', os.path.getsize(path))
+    if path.endswith(".pkl"):
+        with open(path, 'rb') as read_db:                                  # Read in saved count file
+            METRICS.count('pickle_loads')
+            return count_matrix_from_dict(pickle.load(read_db), store)
+    
+    with open(path[:-len(".npy")] + ".transcripts.txt", "r") as table:
+        transcripts = [line.strip() for line in table]
+    return store.select(transcripts), np.load(path, mmap_mode="r")
+
+
 # Function to calculate probabilities for each triplet in each transcript
 def calculate_probabilities(triplet_count, counting):   # Takes the previous dictionaries as arguments
     """
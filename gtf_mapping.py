@@ -0,0 +1,215 @@
+"""Offline conversion of HGVS coding (c.) positions to genomic coordinates from a local Ensembl GTF annotation."""
+
+# Import modules
+import os                                # Library for interacting with the operating system
+import re                                # Library for regular expressions
+import gzip                              # Library for reading gzip compressed files
+import argparse                          # Library for parsing command-line arguments
+import numpy as np                       # Library for numerical computing
+
+
+# Features making up the coding sequence. Ensembl GTF files leave the stop codon out of CDS, but the CDS FASTA includes it.
+CODING_FEATURES = ("CDS", "stop_codon")
+COMPLEMENT = {"A": "T", "C": "G", "G": "C", "T": "A"}
+
+pattern_hgvsc = re.compile(r'^([^:.]+)(?:\.\d+)?:c\.(\d+)([ACGT])>([ACGT])$')      # Transcript (version ignored), c. position, reference and alternative
+pattern_transcript = re.compile(r'transcript_id "([^"]+)"')
+
+
+# ====================
+# CDS INDEX
+# ====================
+
+#region Index
+
+# Function to read the coding segments of every transcript from a GTF file
+def read_gtf_segments(gtf_file):
+    """
+    Reads CDS and stop codon lines of a GTF file (plain or gzip).
+    Returns a dictionary {transcript: (chromosome, strand, [(start, end), ...])}.
+    """
+
+    segments = {}
+    opener = gzip.open if gtf_file.endswith(".gz") else open
+
+    with opener(gtf_file, "rt") as gtf:
+        for line in gtf:
+            if line.startswith("#"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 9 or fields[2] not in CODING_FEATURES:
+                continue
+
+            match = pattern_transcript.search(fields[8])
+            if not match:
+                continue
+            transcript = match.group(1).split(".")[0]                       # Ignores the transcript version, as build_database.stream_fasta() does
+            chromosome = fields[0][3:] if fields[0].startswith("chr") else fields[0]
+
+            entry = segments.setdefault(transcript, (chromosome, fields[6], []))
+            entry[2].append((int(fields[3]), int(fields[4])))            # 1-based, inclusive genomic start and end
+
+    return segments                  # example output: {'ENST00000169551': ('18', '-', [(74158100, 74158300), ...])}
+
+
+class CDSIndex:
+    """
+    Compact, array based index of the coding segments of all transcripts of a GTF.
+    Segments are stored in transcript (5' to 3') order, together with the number of coding bases before each of them.
+    """
+
+    def __init__(self, transcripts, chromosomes, tx_chromosome, tx_strand, tx_offsets, seg_start, seg_end, seg_before):
+        self.transcripts = list(transcripts)
+        self.row = {transcript: i for i, transcript in enumerate(self.transcripts)}
+        self.chromosomes = list(chromosomes)
+        self.tx_chromosome = tx_chromosome        # Index into chromosomes, per transcript
+        self.tx_strand = tx_strand                # +1 or -1, per transcript
+        self.tx_offsets = tx_offsets              # Segments of transcript t are seg_*[tx_offsets[t]:tx_offsets[t+1]]
+        self.seg_start = seg_start                # Genomic start of each segment (1-based)
+        self.seg_end = seg_end                    # Genomic end of each segment (inclusive)
+        self.seg_before = seg_before              # Coding bases of the transcript before the segment
+
+        # Segment starts on one global coding axis (all transcripts one after another), so a batch is located with one searchsorted
+        lengths = seg_end - seg_start + 1
+        self.tx_length = np.add.reduceat(lengths, tx_offsets[:-1]) if len(lengths) else np.zeros(0, dtype=np.int64)
+        self.tx_base = np.concatenate(([0], np.cumsum(self.tx_length)[:-1])).astype(np.int64)
+        self.seg_global = self.tx_base[np.repeat(np.arange(len(self.transcripts)), np.diff(tx_offsets))] + seg_before
+
+    @classmethod
+    def from_gtf(cls, gtf_file):
+        """
+        Builds the index from a GTF file.
+        """
+
+        segments = read_gtf_segments(gtf_file)
+        transcripts = sorted(segments)
+        chromosomes = sorted({segments[t][0] for t in transcripts})
+        chromosome_index = {chromosome: i for i, chromosome in enumerate(chromosomes)}
+
+        tx_chromosome = np.array([chromosome_index[segments[t][0]] for t in transcripts], dtype=np.int32)
+        tx_strand = np.array([-1 if segments[t][1] == "-" else 1 for t in transcripts], dtype=np.int8)
+
+        starts, ends, before, offsets = [], [], [], [0]
+        for transcript in transcripts:
+            _, strand, parts = segments[transcript]
+            parts = sorted(parts, reverse=(strand == "-"))                 # 5' to 3' order of the transcript
+            covered = 0
+            for start, end in parts:
+                starts.append(start)
+                ends.append(end)
+                before.append(covered)
+                covered += end - start + 1
+            offsets.append(len(starts))
+
+        return cls(transcripts, chromosomes, tx_chromosome, tx_strand, np.array(offsets, dtype=np.int64),
+                   np.array(starts, dtype=np.int64), np.array(ends, dtype=np.int64), np.array(before, dtype=np.int64))
+
+    def save(self, path):
+        """
+        Saves the index into an npz file.
+        """
+        np.savez(path, transcripts=np.array(self.transcripts), chromosomes=np.array(self.chromosomes),
+                 tx_chromosome=self.tx_chromosome, tx_strand=self.tx_strand, tx_offsets=self.tx_offsets,
+                 seg_start=self.seg_start, seg_end=self.seg_end, seg_before=self.seg_before)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads an index saved by save().
+        """
+        with np.load(path) as saved:
+            return cls(saved['transcripts'].tolist(), saved['chromosomes'].tolist(), saved['tx_chromosome'], saved['tx_strand'],
+                       saved['tx_offsets'], saved['seg_start'], saved['seg_end'], saved['seg_before'])
+
+
+# Function to get the index of a GTF file, reading the GTF only once
+def load_cds_index(gtf_file):
+    """
+    Returns the CDS index of a GTF file. The index is cached next to the GTF as <gtf>.cds_index.npz
+    and rebuilt only when the GTF is newer than the cache.
+    """
+
+    cache_path = gtf_file + ".cds_index.npz"
+
+    if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(gtf_file):
+        return CDSIndex.load(cache_path)
+
+    cds_index = CDSIndex.from_gtf(gtf_file)
+    cds_index.save(cache_path)
+    return cds_index
+
+#endregion
+
+
+# ====================
+# CONVERSION
+# ====================
+
+#region Conversion
+
+# Converts a batch of HGVS coding strings to chromosome and locus information, without the Ensembl REST API.
+def gtf_hgvs_converter(hgvs_coding, cds_index):
+    """
+    Takes a list of HGVS coding strings and a CDS index and returns mutation information for VCF creation,
+    in the same format as ensembl_request.hgvs_converter(): {hgvsc: (chromosome, locus, reference, alternative)}.
+    Also returns the set of HGVS coding strings that could not be converted.
+    """
+
+    chr_info = {}
+    hgvs_failed = set()
+
+    # Parse the input and keep the strings whose transcript is annotated
+    parsed = []
+    for coding in set(hgvs_coding):                                        # Remove duplicates
+        match = pattern_hgvsc.match(coding)
+        if match and match.group(1) in cds_index.row:
+            parsed.append((coding, cds_index.row[match.group(1)], int(match.group(2)), match.group(3), match.group(4)))
+        else:
+            hgvs_failed.add(coding)
+
+    if not parsed:
+        return chr_info, hgvs_failed
+
+    codings, rows, c_positions, references, alternatives = zip(*parsed)
+    rows = np.array(rows, dtype=np.int64)
+    offset = np.array(c_positions, dtype=np.int64) - 1                   # 0-based position in the coding sequence
+
+    # Locate all positions at once on the global coding axis
+    inside = (offset >= 0) & (offset < cds_index.tx_length[rows])
+    segment = np.searchsorted(cds_index.seg_global, cds_index.tx_base[rows] + offset, side="right") - 1
+    into_segment = offset - cds_index.seg_before[segment]
+    strand = cds_index.tx_strand[rows]
+    locus = np.where(strand > 0, cds_index.seg_start[segment] + into_segment, cds_index.seg_end[segment] - into_segment)
+
+    for j, coding in enumerate(codings):
+        if not inside[j]:
+            hgvs_failed.add(coding)
+            continue
+        reference, alternative = references[j], alternatives[j]
+        if strand[j] < 0:                                                  # Alleles are given on the transcript strand, VCF needs the forward strand
+            reference, alternative = COMPLEMENT[reference], COMPLEMENT[alternative]
+        chromosome = cds_index.chromosomes[cds_index.tx_chromosome[rows[j]]]
+        chr_info[coding] = (chromosome, str(int(locus[j])), reference, alternative)
+
+    return chr_info, hgvs_failed
+
+#endregion
+
+
+#### Test program ####
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Converts a list of HGVS coding strings to genomic coordinates with a local GTF.")
+    parser.add_argument('-g', required=True, help="Ensembl GTF annotation (plain or gzip)")
+    parser.add_argument('-o', required=True, help="HGVS coding list")
+    args = vars(parser.parse_args())
+
+    with open(args['o'], "r") as file:
+        hgvs_notation = [line.strip() for line in file if line.strip()]
+
+    chr_info, hgvs_failed = gtf_hgvs_converter(hgvs_notation, load_cds_index(args['g']))
+
+    for key, value in chr_info.items():
+        print(f"key: {key}\nvalue: {value}")
+    for failed in hgvs_failed:
+        print(f"Failed: {failed}")
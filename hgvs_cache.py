@@ -0,0 +1,167 @@
+"""Persistent HGVS coding to HGVS genomic cache, shared across runs and invocations."""
+
+# Import modules
+import sqlite3                           # Library for the on-disk SQLite database
+import time                              # Library for time stamps, used for eviction
+import threading                         # Library for the lock shared by pipeline stage threads
+import argparse                          # Library for parsing command-line arguments
+
+
+# SQLite limits the number of variables in one statement, so lookups are done in chunks
+QUERY_CHUNK = 500
+
+
+class HGVSCache:
+    """
+    SQLite backed cache keyed by HGVS coding. Stores the HGVS genomic result, or NULL for inputs Ensembl could not resolve.
+    When the cache grows above max_entries, the least recently used entries are evicted.
+    The cache may be opened in one thread and used in another (e.g. the resolve stage of the pipeline): every access holds a lock.
+    """
+
+    def __init__(self, path, max_entries=1000000):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.RLock()                                    # Reentrant: put_many() calls evict()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS hgvs (hgvsc TEXT PRIMARY KEY, hgvsg TEXT, last_used REAL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS hgvs_last_used ON hgvs (last_used)")
+        self.connection.commit()
+
+    def get_many(self, hgvs_coding):
+        """
+        Looks up a list of HGVS coding strings.
+        Returns a dictionary of cached results {hgvsc: hgvsg}, the set of cached negative results and the list of misses.
+        """
+
+        found = {}
+        negative = set()
+        hgvs_coding = list(hgvs_coding)
+
+        with self.lock:
+            for i in range(0, len(hgvs_coding), QUERY_CHUNK):
+                chunk = hgvs_coding[i:i + QUERY_CHUNK]
+                rows = self.connection.execute(
+                    f"SELECT hgvsc, hgvsg FROM hgvs WHERE hgvsc IN ({','.join('?' * len(chunk))})", chunk).fetchall()
+                for coding, genomic in rows:
+                    if genomic is None:
+                        negative.add(coding)
+                    else:
+                        found[coding] = genomic
+
+            # Hits count as used, so they are the last to be evicted
+            hits = list(found) + list(negative)
+            if hits:
+                now = time.time()
+                self.connection.executemany("UPDATE hgvs SET last_used = ? WHERE hgvsc = ?", [(now, coding) for coding in hits])
+                self.connection.commit()
+
+        misses = [coding for coding in hgvs_coding if coding not in found and coding not in negative]
+        return found, negative, misses
+
+    def put_many(self, hgvs_genomic, negative=()):
+        """
+        Stores resolved results {hgvsc: hgvsg} and negative results (HGVS coding strings Ensembl could not resolve).
+        """
+
+        now = time.time()
+        entries = [(coding, genomic, now) for coding, genomic in hgvs_genomic.items()]
+        entries += [(coding, None, now) for coding in negative]
+
+        with self.lock:
+            self.connection.executemany("INSERT OR REPLACE INTO hgvs (hgvsc, hgvsg, last_used) VALUES (?, ?, ?)", entries)
+            self.connection.commit()
+            self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used entries above max_entries.
+        """
+
+        with self.lock:
+            excess = len(self) - self.max_entries
+            if excess > 0:
+                self.connection.execute(
+                    "DELETE FROM hgvs WHERE hgvsc IN (SELECT hgvsc FROM hgvs ORDER BY last_used LIMIT ?)", (excess,))
+                self.connection.commit()
+
+    def export_tsv(self, path):
+        """
+        Writes all entries to a tab separated file (hgvsc, hgvsg). Negative results have an empty hgvsg.
+        Returns the number of entries written.
+        """
+
+        n_written = 0
+        with self.lock, open(path, "w") as out:
+            for coding, genomic in self.connection.execute("SELECT hgvsc, hgvsg FROM hgvs ORDER BY hgvsc"):
+                out.write(f"{coding}\t{genomic or ''}\n")
+                n_written += 1
+        return n_written
+
+    def import_tsv(self, path):
+        """
+        Reads a tab separated file written by export_tsv() into the cache. Returns the number of entries read.
+        """
+
+        hgvs_genomic = {}
+        negative = set()
+        with open(path, "r") as tsv:
+            for line in tsv:
+                coding, _, genomic = line.rstrip("\n").partition("\t")
+                if not coding:
+                    continue
+                if genomic:
+                    hgvs_genomic[coding] = genomic
+                else:
+                    negative.add(coding)
+
+        self.put_many(hgvs_genomic, negative)
+        return len(hgvs_genomic) + len(negative)
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM hgvs").fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+#### Cache maintenance ####
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Maintenance of the HGVS coding to genomic cache.")
+    parser.add_argument('cache', help="SQLite cache file")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    warm = subparsers.add_parser('warm', help="Resolve a HGVS coding list (only cache misses go to Ensembl), or import an exported TSV")
+    warm.add_argument('-o', required=False, help="HGVS coding list")
+    warm.add_argument('--tsv', required=False, help="TSV file written by 'export'")
+    warm.add_argument('-b', type=int, required=False, default=50, help="Batch size for API requests")
+
+    export = subparsers.add_parser('export', help="Write all cached entries to a TSV file")
+    export.add_argument('tsv', help="Output TSV file")
+
+    subparsers.add_parser('stats', help="Print the number of cached entries")
+
+    args = vars(parser.parse_args())
+    cache = HGVSCache(args['cache'])
+
+    if args['command'] == 'warm':
+        if args['tsv'] is not None:
+            print(f"Imported {cache.import_tsv(args['tsv'])} entries")
+        if args['o'] is not None:
+            from ensembl_request import get_hgvs_genomic
+
+            with open(args['o'], "r") as file:
+                hgvs_notation = [line.strip() for line in file if line.strip()]
+
+            url = "https://rest.ensembl.org/variant_recoder/homo_sapiens"
+            headers = {"Content-Type": "application/json", "Accept": "application/json"}
+            hgvs_genomic, hgvs_failed = get_hgvs_genomic(hgvs_notation, url, headers, args['b'], cache=cache)
+            print(f"Resolved: {len(hgvs_genomic)}, failed: {len(hgvs_failed)}")
+
+    elif args['command'] == 'export':
+        print(f"Exported {cache.export_tsv(args['tsv'])} entries")
+
+    print(f"Entries in cache: {len(cache)}")
+    cache.close()
@@ -0,0 +1,68 @@
+"""Resolution of HGVS coding strings to genomic coordinates, offline (local GTF) or through the Ensembl REST API."""
+
+# Import modules
+from metrics import METRICS
+
+# The GTF and REST API helpers are imported by the branch that uses them: requests alone takes longer to import
+# than the whole resolution of a short HGVS list with a cached GTF index.
+
+
+# ====================
+# INPUT
+# ====================
+
+#region Input
+
+# Function to read a file of HGVS coding strings
+def read_hgvsc_list(hgvsc_file):
+    """
+    Reads a file with one HGVS coding string per line and returns them as a list. Empty lines are skipped.
+    """
+    with open(hgvsc_file, "r") as file:
+        return [line.strip() for line in file if line.strip()]      # example output: ['ENST00000169551:c.609G>A', ...]
+
+#endregion
+
+
+# ====================
+# HGVS RESOLUTION
+# ====================
+
+#region Resolution
+
+# Function to turn HGVS coding strings into chromosome, position, reference and alternative
+def resolve_hgvsc(hgvsc_list, args, cds_index=None, cache=None, metrics=METRICS):
+    """
+    Converts HGVS coding strings to genomic information for the VCF, either offline with the GTF index (-g) or through the Ensembl REST API.
+    With the REST API, the HGVS cache (--cache) is consulted first. Resolution counters go to metrics.
+    Returns a dictionary {hgvsc: (chromosome, locus, reference, alternative)} and the failed HGVS coding strings.
+    """
+
+    if cds_index is not None:
+        from gtf_mapping import gtf_hgvs_converter
+
+        print("Convert with local GTF annotation")
+        chr_info, hgvs_failed = gtf_hgvs_converter(hgvsc_list, cds_index)        # No network access needed
+        metrics.count('resolutions_gtf', len(chr_info))
+        metrics.count('resolutions_failed', len(hgvs_failed))
+    else:
+        from ensembl_request import get_hgvs_genomic, hgvs_converter
+
+        print("Access ensemble API")
+        headers = {"Content-Type": "application/json", "Accept": "application/json"}
+
+        hgvs_genomic, hgvs_failed = get_hgvs_genomic(hgvsc_list, args['ensembl_url'], headers, args['b'], cache=cache,
+                                                     workers=args['api_workers'], max_retries=args['retries'], metrics=metrics)        # Calls the function to get the HGVS genomic notation from the REST API. The function returns 1 dictionary, 1 set: hgvs_genomic and hgvs_failed.
+        print(f"Number of matches: {len(hgvs_genomic)}")
+
+        print("Extract data for VCF")
+        chr_info = hgvs_converter(hgvs_genomic)
+
+    # Print failed HGVS coding
+    print(f"Number of failed matches: {len(hgvs_failed)}")
+    for value in hgvs_failed:
+        print(value)
+
+    return chr_info, hgvs_failed
+
+#endregion
@@ -0,0 +1,135 @@
+"""Lightweight instrumentation: stage timers, counters and histograms, exported as JSON. Optional cProfile and tracemalloc hooks."""
+
+# Import modules
+import json                              # Library for writing the metrics file
+import time                              # Library for the stage timers
+import bisect                            # Library for placing values in histogram buckets
+import threading                         # Library for the lock shared by pipeline stage threads
+import cProfile                          # Library for the optional profiler
+import tracemalloc                       # Library for the optional memory tracing
+from contextlib import contextmanager    # Library for the stage timer context manager
+
+
+# Upper bounds (seconds) of the API latency histogram buckets. The last bucket counts everything above.
+LATENCY_BOUNDS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Metrics:
+    """
+    Process-wide registry of timers ({stage: seconds and calls}), counters ({name: value}) and histograms.
+    Recording is a dictionary update under a lock, cheap enough to leave on in production runs and safe from several threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.timers = {}
+        self.counters = {}
+        self.histograms = {}
+        self.extra = {}
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Times the enclosed block and adds it to the stage timer.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self.lock:
+                timer = self.timers.setdefault(name, {'seconds': 0.0, 'calls': 0})
+                timer['seconds'] += seconds
+                timer['calls'] += 1
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value, bounds=LATENCY_BOUNDS):
+        """
+        Adds a value to a histogram with the given bucket upper bounds.
+        """
+        with self.lock:
+            histogram = self.histograms.setdefault(name, {'bounds': list(bounds), 'counts': [0] * (len(bounds) + 1),
+                                                          'count': 0, 'sum': 0.0, 'max': 0.0})
+            histogram['counts'][bisect.bisect_left(histogram['bounds'], value)] += 1
+            histogram['count'] += 1
+            histogram['sum'] += value
+            histogram['max'] = max(histogram['max'], value)
+
+    def snapshot(self):
+        """
+        Returns all metrics as a JSON serializable dictionary.
+        """
+        with self.lock:
+            return json.loads(json.dumps({'timers': self.timers, 'counters': self.counters, 'histograms': self.histograms, **self.extra}))
+
+    def merge(self, snapshot):
+        """
+        Adds a snapshot (e.g. of a worker process) to these metrics.
+        """
+        for name, timer in snapshot.get('timers', {}).items():
+            own = self.timers.setdefault(name, {'seconds': 0.0, 'calls': 0})
+            own['seconds'] += timer['seconds']
+            own['calls'] += timer['calls']
+        for name, value in snapshot.get('counters', {}).items():
+            self.count(name, value)
+        for name, histogram in snapshot.get('histograms', {}).items():
+            own = self.histograms.setdefault(name, {'bounds': histogram['bounds'], 'counts': [0] * len(histogram['counts']),
+                                                    'count': 0, 'sum': 0.0, 'max': 0.0})
+            own['counts'] = [a + b for a, b in zip(own['counts'], histogram['counts'])]
+            own['count'] += histogram['count']
+            own['sum'] += histogram['sum']
+            own['max'] = max(own['max'], histogram['max'])
+
+    def write(self, path, **info):
+        """
+        Writes the metrics (and any extra information, e.g. the run index) to a JSON file.
+        """
+        with open(path, "w") as metrics_file:
+            json.dump({**info, **self.snapshot()}, metrics_file, indent=1)
+
+
+# Metrics of this process
+METRICS = Metrics()
+
+
+class Profiler:
+    """
+    Runs code between start() and stop() under cProfile (stats written to profile_path, readable with pstats or snakeviz) and/or
+    tracemalloc (peak traced memory and the top allocation sites are added to METRICS). Does nothing if neither is asked for.
+    """
+
+    def __init__(self, profile_path=None, trace_memory=False, top=10):
+        self.profile_path = profile_path
+        self.trace_memory = trace_memory
+        self.top = top
+        self.profiler = cProfile.Profile() if profile_path is not None else None
+
+    def start(self):
+        if self.trace_memory:
+            tracemalloc.start()
+        if self.profiler is not None:
+            self.profiler.enable()
+
+    def stop(self):
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile_path)
+        if self.trace_memory and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            sites = tracemalloc.take_snapshot().statistics("lineno")[:self.top]
+            tracemalloc.stop()
+            METRICS.extra['memory'] = {'current_bytes': current, 'peak_bytes': peak,
+                                       'top_allocations': [{'site': str(site.traceback), 'bytes': site.size, 'blocks': site.count} for site in sites]}
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -2,9 +2,13 @@
 # TODO: Change name of the file and explanation
 
 # Import modules
-from datetime import date                # Library for handling dates
+from datetime import date, datetime      # Library for handling dates
 import os                                # Library for interacting with the operating system
 import re                                # Library for regular expressions
+import gzip                              # Library for gzip compressed output
+import numpy as np                       # Library for the columnar output
+
+from metrics import METRICS
 
 
 # ====================
@@ -14,6 +18,19 @@ import re                                # Library for regular expressions
 #region Output
 
 
+# Function to name the mutational profile in output paths
+def get_signature_name(args):
+    """
+    Returns the profile file name without extension (-f), the exposure file name, or the mixture with ':' and ',' replaced (-s).
+    """
+    
+    if args['f'] is not None:
+        return '.'.join(args['f'].split('/')[-1].split('.')[:-1])
+    if os.path.exists(args['s']):
+        return '.'.join(args['s'].split('/')[-1].split('.')[:-1]) or args['s'].split('/')[-1]
+    return args['s'].replace(':', '-').replace(',', '_')                  # example output: 'SBS1-0.3_SBS4-0.7'
+
+
 # Function to write output directories
 def get_output_folders(fasta_name, args):
     """
@@ -22,7 +39,7 @@ def get_output_folders(fasta_name, args):
     
     # Metadata for the output directory name
     today = date.today().strftime('%Y%m%d')                                
-    signature_name = '.'.join(args['f'].split('/')[-1].split('.')[:-1])   # may have to change if adding standard signatures.
+    signature_name = get_signature_name(args)
     n_value = str(args['n'])                                              # makes a string of the number of mutations argument.
     
     #### output index #####
@@ -54,7 +71,7 @@ def get_output_path(directories_paths, run_index, fasta_name, args):
     """
     
     # Metadata for file name                                       
-    signature_name = '.'.join(args['f'].split('/')[-1].split('.')[:-1])  
+    signature_name = get_signature_name(args)
     r_value = str(args['r']) 
     
     # Output path
@@ -67,28 +84,85 @@ def get_output_path(directories_paths, run_index, fasta_name, args):
 
 
 
-# Function to write output to a file
+# Function to write the output path of all runs combined
+def get_combined_output_path(fasta_name, args):
+    """
+    Returns the path (without extension) of the combined output of all runs. Named after the inputs and the start time,
+    so no directory has to be scanned. --output-prefix overrides it.
+    """
+    
+    if args['output_prefix'] is not None:
+        return args['output_prefix']
+    
+    signature_name = get_signature_name(args)
+    now = datetime.now().strftime('%Y%m%d_%H%M%S')
+    return f"output/{fasta_name}_{signature_name}_n{args['n']}_r{args['r']}_{now}"
 
-# TODO: remove intermediate
 
-def write_output(output, output_directories, fasta_name, args, i):
+# Function to write the simulated mutations of all runs as columns
+def write_columnar(output_path, columns):
     """
-    Writes an intermediate file and then appends it to an output file.
+    Saves equal length column arrays (and their lookup tables) into one compressed npz file.
+    Example columns: {'run_id': array([1, 1, 2]), 'transcript': array([0, 3, 0]), 'transcripts': array(['ENST01', ...]), ...}
+    """
+    np.savez_compressed(output_path, **columns)
+    METRICS.count('bytes_written', os.path.getsize(output_path if output_path.endswith('.npz') else output_path + '.npz'))
+
+
+# Function to read the columnar output
+def read_columnar(output_path):
     """
+    Reads a file written by write_columnar() into a dictionary of arrays, in one read.
+    """
+    with np.load(output_path) as saved:
+        return {name: saved[name] for name in saved.files}
+
+
+
+class HGVSWriter:
+    """
+    Writes the HGVS coding output of one run. The file stays open for the whole run, lines are buffered and written in large blocks.
+    With compress=True the output is gzip compressed (".gz" is added to the path).
+    """
+    
+    def __init__(self, output_path, compress=False, buffer_lines=10000, metrics=METRICS):
+        self.path = output_path + ".gz" if compress else output_path
+        self.file = gzip.open(self.path, "wt") if compress else open(self.path, "w")
+        self.buffer = []
+        self.buffer_lines = buffer_lines                  # Number of lines kept in memory before a block is written
+        self.metrics = metrics                            # Byte counts go here (e.g. the Metrics of one run)
+    
+    def write(self, line):
+        """
+        Adds one line to the output.
+        """
+        self.buffer.append(line)
+        if len(self.buffer) >= self.buffer_lines:
+            self.flush()
+    
+    def write_lines(self, lines):
+        """
+        Adds several lines to the output.
+        """
+        for line in lines:
+            self.write(line)
+    
+    def flush(self):
+        if self.buffer:
+            block = "\n".join(self.buffer) + "\n"
+            self.file.write(block)                             # One write call per block
+            self.metrics.count('bytes_written', len(block))    # Uncompressed size
+            self.buffer = []
+    
+    def close(self):
+        self.flush()
+        self.file.close()
+    
+    def __enter__(self):
+        return self
     
-    # Output paths
-    filepath_inter = "output/intermediate.txt"
-    filepath_out = get_output_path(output_directories, i+1, fasta_name, args)     # i+1 is the run index
-    
-    # Creating or overwriting intermediate file
-    with open(filepath_inter, "w") as f:
-        f.write(output + '\n')
-        
-    # Appending intermediate file to output file
-    with open(filepath_inter, "r") as rf:       # Read mode intermediate file
-        with open(filepath_out, "a") as wf:     # Append mode for output file
-            for line in rf:
-                wf.write(line)
+    def __exit__(self, *exc):
+        self.close()
 
 #endregion
 
@@ -0,0 +1,88 @@
+"""Producer/consumer pipeline: one thread per stage, connected by bounded queues."""
+
+# Import modules
+import queue                             # Library for the bounded queues between the stages
+import threading                         # Library for the stage threads
+
+
+# Marker sent down the queues after the last item
+_DONE = object()
+
+
+class _Failure:
+    """
+    Sent down the queues in place of an item when a stage raised, so the error reaches the caller.
+    """
+
+    def __init__(self, error):
+        self.error = error
+
+
+# ====================
+# PIPELINE
+# ====================
+
+#region Pipeline
+
+# Function to run items through a chain of stages
+def run_pipeline(items, stages, queue_size=2, poll=0.1):
+    """
+    Passes every item through the stages (functions taking the output of the previous stage), one thread per stage.
+    While the last stage works on item i, the one before can work on item i+1 and so on, e.g. simulating a run while the previous
+    one waits for the Ensembl REST API. At most queue_size items wait between two stages, which bounds the memory used.
+    Yields the output of the last stage for every item, in input order. The first exception of any stage is raised here,
+    and the other stages stop after their current item.
+    """
+
+    stop = threading.Event()
+    queues = [queue.Queue(maxsize=max(queue_size, 1)) for _ in stages]
+
+    def put(outbox, item):
+        while not stop.is_set():
+            try:
+                outbox.put(item, timeout=poll)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(inbox):
+        while not stop.is_set():
+            try:
+                return inbox.get(timeout=poll)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def run_stage(stage, inbox, outbox):
+        source = iter(items) if inbox is None else iter(lambda: get(inbox), _DONE)
+        try:
+            for item in source:
+                if isinstance(item, _Failure):
+                    put(outbox, item)
+                    return
+                if not put(outbox, stage(item)):
+                    return
+            put(outbox, _DONE)
+        except BaseException as error:
+            put(outbox, _Failure(error))
+
+    threads = [threading.Thread(target=run_stage, args=(stage, queues[k - 1] if k > 0 else None, queues[k]), daemon=True)
+               for k, stage in enumerate(stages)]
+    for thread in threads:
+        thread.start()
+
+    try:
+        while True:
+            item = get(queues[-1])
+            if item is _DONE:
+                break
+            if isinstance(item, _Failure):
+                raise item.error
+            yield item
+    finally:
+        stop.set()                       # Also stops the stages if the caller leaves the loop early
+        for thread in threads:
+            thread.join()
+
+#endregion
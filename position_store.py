@@ -0,0 +1,276 @@
+"""Memory-mapped triplet position store, replacing the per-transcript pkl files."""
+
+# Import modules
+import os                                # Library for interacting with the operating system
+import pickle                            # Only used to convert old pkl database folders
+import argparse                          # Library for parsing command-line arguments
+import numpy as np                       # Library for numerical computing
+
+from metrics import METRICS
+
+
+# ====================
+# TRIPLET CODES
+# ====================
+
+#region Codes
+
+# All 64 triplets in A, C, G, T order. The index of a triplet in this list is its integer code.
+TRIPLETS = [a + b + c for a in "ACGT" for b in "ACGT" for c in "ACGT"]
+TRIPLET_INDEX = {triplet: code for code, triplet in enumerate(TRIPLETS)}    # example: {'AAA': 0, 'AAC': 1, ..., 'TTT': 63}
+
+# Files making up a store (all kept inside the -d database folder)
+TRANSCRIPTS_FILE = "transcripts.txt"     # Transcript table, one ID per line. Line number = row in the store.
+OFFSETS_FILE = "offsets.u64"             # 65 uint64 offsets per transcript row into the positions array
+POSITIONS_FILE = "positions.u32"         # Packed uint32 positions, per transcript ordered by triplet code
+COUNTS_FILE = "triplet_counts.npy"       # uint32 matrix of transcripts x 64 triplet counts, rows as in the transcript table
+SEQUENCES_FILE = "sequences.u8"          # Packed base codes of every transcript (A=0, C=1, G=2, T=3, 4 for anything else)
+SEQUENCE_OFFSETS_FILE = "sequence_offsets.u64"    # Start and end (uint64) of every transcript row in the sequences array
+
+#endregion
+
+
+# ====================
+# WRITING
+# ====================
+
+#region Writing
+
+# Function to turn a transcript dictionary into one packed store row
+def pack_positions(pos_in_transcript):
+    """
+    Converts a {triplet: [positions]} dictionary into a count array (64) and a packed uint32 position array.
+    Triplets that are not made of A, C, G and T (e.g. containing N) are left out.
+    """
+
+    counts = np.zeros(len(TRIPLETS), dtype=np.uint32)
+    packed = []
+
+    for code, triplet in enumerate(TRIPLETS):                     # Goes through triplets in code order so positions are grouped by triplet
+        positions = pos_in_transcript.get(triplet)
+        if positions:
+            counts[code] = len(positions)
+            packed.append(np.asarray(positions, dtype=np.uint32))
+
+    positions = np.concatenate(packed) if packed else np.zeros(0, dtype=np.uint32)
+    return counts, positions                                     # example output: array([0, 2, ...]), array([5, 17, ...])
+
+
+class PositionStoreWriter:
+    """
+    Appends transcript rows to a position store. Used as a context manager so the files stay open while a database is built.
+    """
+
+    def __init__(self, store_folder):
+        os.makedirs(store_folder, exist_ok=True)
+        self.store_folder = store_folder
+
+        positions_path = os.path.join(store_folder, POSITIONS_FILE)
+        self.n_positions = os.path.getsize(positions_path) // 4 if os.path.exists(positions_path) else 0    # Positions already in the store (4 bytes each)
+        sequences_path = os.path.join(store_folder, SEQUENCES_FILE)
+        self.n_bases = os.path.getsize(sequences_path) if os.path.exists(sequences_path) else 0
+
+        transcripts_path = os.path.join(store_folder, TRANSCRIPTS_FILE)
+        n_rows = 0
+        if os.path.exists(transcripts_path):
+            with open(transcripts_path, "r") as table:
+                n_rows = sum(1 for _ in table)
+
+        # One sequence entry per transcript row: stores written before sequences were kept get empty entries for their rows
+        sequence_offsets_path = os.path.join(store_folder, SEQUENCE_OFFSETS_FILE)
+        if os.path.exists(sequence_offsets_path) and os.path.getsize(sequence_offsets_path) > 16 * n_rows:
+            os.truncate(sequence_offsets_path, 16 * n_rows)              # Entries of rows that never made it into the transcript table
+        self.sequence_offsets_out = open(sequence_offsets_path, "ab")
+        n_sequence_rows = os.path.getsize(sequence_offsets_path) // 16
+        self.sequence_offsets_out.write(np.full(2 * (n_rows - n_sequence_rows), self.n_bases, dtype=np.uint64).tobytes())
+
+        self.transcripts_out = open(transcripts_path, "a")
+        self.offsets_out = open(os.path.join(store_folder, OFFSETS_FILE), "ab")
+        self.positions_out = open(positions_path, "ab")
+        self.sequences_out = open(sequences_path, "ab")
+
+    def add(self, transcript, counts, positions, encoded=None):
+        """
+        Appends one transcript. counts has one entry per triplet code, positions are ordered by triplet code.
+        encoded is the sequence as base codes (frequency.encode_sequence()), kept for the context index. Without it the row has no sequence.
+        """
+
+        encoded = np.zeros(0, dtype=np.uint8) if encoded is None else np.ascontiguousarray(encoded, dtype=np.uint8)
+        self.sequences_out.write(encoded.tobytes())
+        self.sequence_offsets_out.write(np.array([self.n_bases, self.n_bases + len(encoded)], dtype=np.uint64).tobytes())
+        self.n_bases += len(encoded)
+
+        offsets = np.empty(len(TRIPLETS) + 1, dtype=np.uint64)
+        offsets[0] = self.n_positions
+        np.cumsum(counts, dtype=np.uint64, out=offsets[1:])
+        offsets[1:] += np.uint64(self.n_positions)                   # Offsets are absolute positions in the packed array
+
+        self.positions_out.write(np.ascontiguousarray(positions, dtype=np.uint32).tobytes())
+        self.offsets_out.write(offsets.tobytes())
+        self.transcripts_out.write(transcript + "\n")
+        self.n_positions = int(offsets[-1])
+        METRICS.count('bytes_written', 4 * len(positions) + offsets.nbytes + len(encoded) + 16 + len(transcript) + 1)
+
+    def close(self):
+        self.sequences_out.close()
+        self.sequence_offsets_out.close()
+        self.positions_out.close()
+        self.offsets_out.close()
+        self.transcripts_out.close()                             # Transcript table is closed last, so a row is only visible once its data is written
+        write_count_matrix(self.store_folder)                    # Keeps the count matrix in line with the store
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# Function to write the transcript x triplet count matrix of a store
+def write_count_matrix(store_folder):
+    """
+    Saves the number of occurrences of every triplet in every transcript as a uint32 .npy matrix (one row per transcript table row).
+    """
+
+    with open(os.path.join(store_folder, TRANSCRIPTS_FILE), "r") as table:
+        n_transcripts = sum(1 for _ in table)
+    offsets = _map_array(os.path.join(store_folder, OFFSETS_FILE), np.uint64).reshape(-1, len(TRIPLETS) + 1)[:n_transcripts]
+    counts_path = os.path.join(store_folder, COUNTS_FILE)
+    with open(counts_path + ".tmp", "wb") as counts_out:                  # Written aside and renamed, so readers never map a half-written matrix
+        np.save(counts_out, np.diff(offsets, axis=1).astype(np.uint32))
+    os.replace(counts_path + ".tmp", counts_path)
+
+
+# Function to convert an old database folder of per-transcript pkl files
+def convert_pkl_folder(pkl_folder, store_folder=None):
+    """
+    Reads every <transcript>.pkl file in a database folder and writes them into a position store.
+    The store is written into the same folder unless another one is given. Returns the number of transcripts converted.
+    pkl files hold no sequences: the context index needs the store synced with its FASTA first (build_database.py --sync).
+    """
+
+    if store_folder is None:
+        store_folder = pkl_folder
+
+    pkl_files = sorted(f for f in os.listdir(pkl_folder) if f.endswith(".pkl"))
+
+    with PositionStoreWriter(store_folder) as writer:
+        for pkl_file in pkl_files:
+            with open(os.path.join(pkl_folder, pkl_file), "rb") as read_db:
+                pos_in_transcript = pickle.load(read_db)                    # example: {'ATG': [0, 5, 10], 'TGC': [1, 6]}
+            METRICS.count('pickle_loads')
+            counts, positions = pack_positions(pos_in_transcript)
+            writer.add(pkl_file[:-len(".pkl")], counts, positions)
+
+    return len(pkl_files)
+
+#endregion
+
+
+# ====================
+# READING
+# ====================
+
+#region Reading
+
+# Function to memory-map a raw binary file (np.memmap refuses empty files)
+def _map_array(path, dtype):
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r")
+
+
+# Function to check if a folder holds a position store
+def is_position_store(store_folder):
+    """
+    Returns True if the folder contains a position store.
+    """
+    return os.path.exists(os.path.join(store_folder, TRANSCRIPTS_FILE))
+
+
+class PositionStore:
+    """
+    Read-only, memory-mapped view of a position store.
+    Looking up the positions of a triplet in a transcript is a slice of the mapped array, without opening or unpickling anything.
+    """
+
+    def __init__(self, store_folder):
+        self.store_folder = store_folder
+
+        with open(os.path.join(store_folder, TRANSCRIPTS_FILE), "r") as table:
+            self.transcripts = [line.rstrip("\n") for line in table]
+        self.row = {transcript: i for i, transcript in enumerate(self.transcripts)}    # If a transcript was added twice, the latest row is used
+
+        self.offsets = _map_array(os.path.join(store_folder, OFFSETS_FILE), np.uint64).reshape(-1, len(TRIPLETS) + 1)[:len(self.transcripts)]
+        self.positions = _map_array(os.path.join(store_folder, POSITIONS_FILE), np.uint32)
+
+        # Transcript x triplet count matrix, memory-mapped. Falls back to the offsets if the matrix is missing or out of date.
+        counts_path = os.path.join(store_folder, COUNTS_FILE)
+        self.counts = np.load(counts_path, mmap_mode="r") if os.path.exists(counts_path) else None
+        if self.counts is None or self.counts.shape[0] != len(self.transcripts):
+            self.counts = np.diff(self.offsets, axis=1).astype(np.uint32)
+
+        # Base codes of every transcript, missing in stores converted from pkl files
+        sequence_offsets_path = os.path.join(store_folder, SEQUENCE_OFFSETS_FILE)
+        if os.path.exists(sequence_offsets_path):
+            self.sequence_offsets = _map_array(sequence_offsets_path, np.uint64).reshape(-1, 2)[:len(self.transcripts)]
+            self.sequences = _map_array(os.path.join(store_folder, SEQUENCES_FILE), np.uint8)
+        else:
+            self.sequence_offsets = np.zeros((0, 2), dtype=np.uint64)
+            self.sequences = np.zeros(0, dtype=np.uint8)
+
+    def __contains__(self, transcript):
+        return transcript in self.row
+
+    def __len__(self):
+        return len(self.transcripts)
+
+    def get_positions(self, transcript, triplet):
+        """
+        Returns the positions of the triplet in the transcript (0-based start of the triplet).
+        """
+        row = self.offsets[self.row[transcript]]
+        code = TRIPLET_INDEX[triplet]
+        return self.positions[row[code]:row[code + 1]]
+
+    def get_counts(self, transcript):
+        """
+        Returns the number of occurrences of every triplet (in code order) in the transcript.
+        """
+        return self.counts[self.row[transcript]]
+
+    def get_sequence(self, transcript):
+        """
+        Returns the sequence of the transcript as base codes (A=0, C=1, G=2, T=3, 4 for anything else),
+        or None if the row was written without its sequence (converted from pkl files, or built before sequences were kept).
+        """
+        row = self.row[transcript]
+        if row >= len(self.sequence_offsets):
+            return None
+        start, end = self.sequence_offsets[row]
+        if start == end and self.offsets[row][-1] > self.offsets[row][0]:         # Triplets but no bases: the sequence was never stored
+            return None
+        return self.sequences[start:end]
+
+    def select(self, transcripts):
+        """
+        Returns the store rows of a list of transcripts. Raises a KeyError listing the transcripts missing from the database.
+        """
+        missing = [transcript for transcript in transcripts if transcript not in self.row]
+        if missing:
+            raise KeyError(f"{len(missing)} transcripts are not in the database, e.g. {', '.join(missing[:5])}")
+        return np.array([self.row[transcript] for transcript in transcripts], dtype=np.int64)
+
+#endregion
+
+
+#### Convert pkl database folder ####
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Converts a database folder of per-transcript pkl files into a position store.")
+    parser.add_argument('pkl_folder', help="Database folder with pre-processed transcript pkl files")
+    parser.add_argument('-o', required=False, help="Output folder for the store (default: the pkl folder)")
+    args = vars(parser.parse_args())
+
+    n_converted = convert_pkl_folder(args['pkl_folder'], args['o'])
+    print(f"Converted {n_converted} transcripts")
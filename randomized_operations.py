@@ -2,8 +2,10 @@
 
 # Import modules
 import numpy as np
-import random
-import pickle
+
+from position_store import TRIPLETS, TRIPLET_INDEX
+from alias_tables import draw_alias
+from fenwick_tree import draw_sites_without_replacement
 
 
 # ====================
@@ -31,27 +33,136 @@ def random_sampling(frequencies, n_sim):
     return np.random.choice(elements, size=n_sim, p=probs)      # This is an array of n_sim elements, each of which is a string from the elements list, selected randomly based on the probabilities in the probs list. The exact contents of the array will vary each time the function is called
                                 # Example: array(['CGA_G/A', 'CGA_G/A', 'CGA_C/A', ..., 'CGA_G/A', 'CGA_C/A', 'CGA_G/A'])
 
+#endregion
+
+
+# ====================
+# BATCHED SIMULATION
+# ====================
+
+#region Batched
+
+# The functions below work on integer codes instead of strings:
+#   channel code    - index into the list of (triplet, ref, alt) substitutions of the profile
+#   triplet code    - index into position_store.TRIPLETS
+#   transcript row  - row of the transcript in the position store
+# Transcripts are drawn from alias tables (see alias_tables.py), built once per triplet.
+# HGVS strings are only built at the very end, by format_hgvsc().
+
+# Function to turn the frequency dictionary into integer-coded channels
+def build_channel_table(frequencies):
+    """
+    Takes a dictionary of frequencies (freq) and returns the list of channels, the triplet code of each channel and the channel probabilities.
+    """
+    
+    channels = []
+    probs = []
+    
+    for triplet in frequencies:                                 # From get_freq() - # Example: {'CGA': {'G/A': {'count': 10, 'freq': 0.1}}}
+        for change in frequencies[triplet]:
+            ref, alt = change.split("/")                        # The substitution is split once here instead of once per mutation
+            channels.append((triplet, ref, alt))
+            probs.append(frequencies[triplet][change]['freq'])
+    
+    channel_triplets = np.array([TRIPLET_INDEX[triplet] for triplet, _, _ in channels], dtype=np.int64)
+    return channels, channel_triplets, np.array(probs)          # Example: [('CGA', 'G', 'A'), ...], array([24, ...]), array([0.1, ...])
+
 
-# Function to get a random position in a gene
-def get_random_position_in_gene(posingene, transcript, triplet):
+# Function to sample channel codes
+def sample_channels(channel_probs, n_sim, rng):
     """
-    Gets a random position in a gene for a given transcript and triplet. 
-    Returns a random position that will be mutated
+    Draws n_sim channel codes based on the channel probabilities.
     """
-    # This function returns a random position in a gene where a given triplet occurs in a given transcript.
-    # Input: pos_in_gene{} - {'transcript1': {'ATG': [0, 5, 10], 'TGC': [1, 6]}, 'transcript2': {'ATG': [0, 3, 7], 'TGC': [1]}}
-    positions = posingene[transcript][triplet]   # Retrieves the list of positions where the given triplet occurs in the given transcript from the dictionary.
-    return random.choice(positions) + 1          # A random position is selected from this list using the random.choice() function. +1 is added since the triplet start at the first base and it is the second that will be mutated. 
+    return rng.choice(len(channel_probs), size=n_sim, p=channel_probs / channel_probs.sum())
 
-def get_transcript_position(transcript, triplet, db_folder):
+
+# Function to simulate the transcript and position of all mutations of one run
+def simulate_mutations(channel_codes, channel_triplets, alias_tables, store, rng):
     """
-    Loads a transcript and randomly chooses a position with a given triplet
+    Draws a transcript (weighted by the number of times it contains the triplet) and a position for every sampled channel.
+    Returns the store rows of the transcripts and the positions of the mutated (middle) base, both as arrays.
     """
-    with open(db_folder+'/'+transcript+'.pkl', 'rb') as read_db:
-        posingene = pickle.load(read_db)
     
-    positions = posingene[triplet]   
-    return random.choice(positions) + 1 
+    triplet_codes = channel_triplets[channel_codes]
+    rows = np.empty(len(channel_codes), dtype=np.int64)
+    
+    # Transcripts are drawn one triplet at a time from the alias table of the triplet (constant time per draw)
+    order = np.argsort(triplet_codes, kind="stable")                                   # Groups the mutations by triplet
+    codes, starts = np.unique(triplet_codes[order], return_index=True)
+    for code, group in zip(codes, np.split(order, starts[1:])):
+        if code not in alias_tables:
+            raise KeyError(f"No transcript contains the triplet {TRIPLETS[code]}")
+        table_rows, prob, alias = alias_tables[code]
+        rows[group] = table_rows[draw_alias(prob, alias, len(group), rng)]
+    
+    # Positions are drawn for all mutations at once, as a uniform index into the slice of the packed position array
+    start = store.offsets[rows, triplet_codes].astype(np.int64)
+    stop = store.offsets[rows, triplet_codes + 1].astype(np.int64)
+    positions = store.positions[start + rng.integers(0, stop - start)].astype(np.int64) + 1    # +1 since the middle base of the triplet is mutated
+    
+    return rows, positions
+
+
+# Function to simulate the transcript and position of all mutations of one run, for profiles with longer contexts
+def simulate_context_mutations(channel_codes, channel_contexts, alias_tables, context_table, context_index, rng):
+    """
+    Same as simulate_mutations() for contexts of any odd length, using the context index (see context_index.py).
+    context_table holds the store rows of the selected transcripts and their context counts and start indices (ContextIndex.count_matrix()).
+    The alias tables are built on the selection, so they return indices into these rows.
+    """
+
+    count_rows, counts, starts = context_table
+    context_codes = channel_contexts[channel_codes]
+    selected = np.empty(len(channel_codes), dtype=np.int64)
+
+    order = np.argsort(context_codes, kind="stable")                                   # Groups the mutations by context
+    codes, first = np.unique(context_codes[order], return_index=True)
+    for code, group in zip(codes, np.split(order, first[1:])):
+        if code not in alias_tables:
+            raise KeyError(f"No transcript contains the context of channel {channel_codes[group[0]]}")
+        table_rows, prob, alias = alias_tables[code]
+        selected[group] = table_rows[draw_alias(prob, alias, len(group), rng)]
+
+    # Positions of a context are one slice of the index, starting at starts[selected, context]
+    start = starts[selected, context_codes]
+    positions = context_index.positions[start + rng.integers(0, counts[selected, context_codes])].astype(np.int64)    # Already the centre base
+
+    return count_rows[selected], positions
+
+
+# Function to simulate all mutations of one run with every position used at most once
+def simulate_mutations_without_replacement(channel_codes, channel_columns, site_table, site_positions, rng):
+    """
+    Without replacement version of simulate_mutations() and simulate_context_mutations(): no transcript position is mutated twice in a run.
+    site_table holds the store rows of the selected transcripts, their count matrix (triplet or context columns) and, for every row and column,
+    the index of the first position in site_positions (store.positions or the context index positions).
+    Raises a ValueError if a triplet (or context) gets more mutations than it has positions.
+    Returns the store rows and the positions as found in site_positions.
+    """
+
+    count_rows, counts, starts = site_table
+    codes = channel_columns[channel_codes]
+    local_rows, offsets = draw_sites_without_replacement(codes, counts, rng)     # O(log) per draw, O(rows) per drawn column, see fenwick_tree.py
+    return count_rows[local_rows], site_positions[starts[local_rows, codes] + offsets].astype(np.int64)
+
+
+# Function to create the HGVS coding strings of simulated mutations
+def format_hgvsc(rows, positions, channel_codes, channels, store):
+    """
+    Builds the HGVS coding string of each simulated mutation.
+    """
+    
+    transcripts = store.transcripts
+    return [f"{transcripts[row]}:c.{position + 1}{channels[code][1]}>{channels[code][2]}"     # Example: 'ENST00000169551:c.609G>A'
+            for row, position, code in zip(rows.tolist(), positions.tolist(), channel_codes.tolist())]
+
+
+# Function to name the channels
+def channel_names(channels):
+    """
+    Returns the name of every channel, with the substitution in brackets at the centre of its context, e.g. 'A[C>A]A' or 'TA[C>T]GC'.
+    """
+    return [f"{context[:len(context) // 2]}[{ref}>{alt}]{context[len(context) // 2 + 1:]}" for context, ref, alt in channels]
 
 #endregion
 
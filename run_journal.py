@@ -0,0 +1,142 @@
+"""Checkpointed journal of a simulation: arguments, seed, resolved mutations and failures of every run, for --resume and --retry-failed."""
+
+# Import modules
+import os                                # Library for interacting with the operating system
+import json                              # Library for the journal events
+import threading                         # Library for the lock shared by pipeline stage threads
+from datetime import datetime            # Library for the time stamps of the events
+
+
+# Files in the journal folder
+EVENTS_FILE = "journal.jsonl"            # One JSON event per line, only ever appended to
+
+# Arguments that decide what is simulated. A journal can only be resumed with the same values.
+SIMULATION_ARGS = ('i', 't', 'd', 'c', 'f', 's', 'signature_matrix', 'n', 'r', 'no_replacement', 'output_mode')
+
+
+# ====================
+# RUN JOURNAL
+# ====================
+
+#region Journal
+
+class RunJournal:
+    """
+    Journal of one output directory (or combined output file). Events are appended as single writes, so worker processes and
+    pipeline threads can share it, and a crash loses at most the run being worked on:
+      start    - the arguments and the seed entropy of the simulation
+      resolved - the genomic information of run k was saved in run_<k>.tsv and its failed HGVS coding in run_<k>.failed.txt
+      done     - the output of run k was written
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.path = os.path.join(folder, EVENTS_FILE)
+        self.lock = threading.Lock()
+        self.start_event = None
+        self.resolved = {}               # run -> number of failed HGVS coding of its last resolution
+        self.done = set()
+
+        if os.path.exists(self.path):
+            with open(self.path, "r") as events:
+                for line in events:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:                       # Last line cut off by a crash
+                        continue
+                    self._apply(event)
+
+    @classmethod
+    def create(cls, folder, args, entropy):
+        """
+        Starts a new journal in folder with the arguments and seed entropy of the simulation.
+        """
+        os.makedirs(folder, exist_ok=True)
+        journal = cls(folder)
+        if journal.start_event is not None:
+            raise ValueError(f"{folder} already holds a journal, use --resume to continue it")
+        journal.append({'event': 'start', 'args': {name: args.get(name) for name in SIMULATION_ARGS}, 'seed': entropy})
+        return journal
+
+    @classmethod
+    def resume(cls, folder, args):
+        """
+        Opens the journal in folder for resuming. Raises a ValueError if there is none or if it was started with other simulation arguments.
+        """
+        journal = cls(folder)
+        if journal.start_event is None:
+            raise ValueError(f"No journal found in {folder}")
+        different = [name for name in SIMULATION_ARGS if journal.start_event['args'].get(name) != args.get(name)]
+        if args.get('seed') is not None and args['seed'] != journal.seed:
+            different.append('seed')
+        if different:
+            raise ValueError(f"The journal in {folder} was started with other values of: {', '.join(different)}")
+        journal.append({'event': 'resume'})
+        return journal
+
+    @property
+    def seed(self):
+        return self.start_event['seed']
+
+    def _apply(self, event):
+        if event['event'] == 'start':
+            self.start_event = event
+        elif event['event'] == 'resolved':
+            self.resolved[event['run']] = event['failed']
+        elif event['event'] == 'done':
+            self.done.add(event['run'])
+
+    def append(self, event):
+        """
+        Appends one event (one write of one line, flushed to disk).
+        """
+        event = {**event, 'time': datetime.now().isoformat(timespec='seconds')}
+        line = (json.dumps(event) + "\n").encode()
+        with self.lock:
+            descriptor = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(descriptor, line)
+                os.fsync(descriptor)
+            finally:
+                os.close(descriptor)
+            self._apply(event)
+
+    def _run_path(self, run, suffix):
+        return os.path.join(self.folder, f"run_{run + 1}{suffix}")
+
+    def save_resolution(self, run, chr_info, hgvs_failed):
+        """
+        Saves the genomic information {hgvsc: (chromosome, locus, reference, alternative)} and the failed HGVS coding of a run (index from 0).
+        Files are written under a temporary name first, so a saved resolution is always complete.
+        """
+        for suffix, lines in ((".tsv", ("\t".join((coding, *map(str, info))) for coding, info in chr_info.items())),
+                              (".failed.txt", sorted(hgvs_failed))):
+            path = self._run_path(run, suffix)
+            with open(path + ".tmp", "w") as outfile:
+                outfile.writelines(line + "\n" for line in lines)
+            os.replace(path + ".tmp", path)
+        self.append({'event': 'resolved', 'run': run, 'resolved': len(chr_info), 'failed': len(hgvs_failed)})
+
+    def load_resolution(self, run):
+        """
+        Returns the genomic information and the set of failed HGVS coding saved for a run.
+        """
+        chr_info = {}
+        with open(self._run_path(run, ".tsv"), "r") as infile:
+            for line in infile:
+                coding, chromosome, locus, reference, alternative = line.rstrip("\n").split("\t")
+                chr_info[coding] = (chromosome, locus, reference, alternative)
+        with open(self._run_path(run, ".failed.txt"), "r") as infile:
+            hgvs_failed = {line.rstrip("\n") for line in infile if line.strip()}
+        return chr_info, hgvs_failed
+
+    def mark_done(self, run):
+        self.append({'event': 'done', 'run': run})
+
+    def pending_runs(self, n_runs, retry_failed=False):
+        """
+        Returns the runs (indices from 0) that still have work: not done, or, with retry_failed, resolved with failures.
+        """
+        return [run for run in range(n_runs) if run not in self.done or (retry_failed and self.resolved.get(run, 0) > 0)]
+
+#endregion
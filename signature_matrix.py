@@ -0,0 +1,140 @@
+"""COSMIC SBS signature matrix: loading, exposure mixtures and channel sampling, without per-signature count files."""
+
+# Import modules
+import os                                # Library for interacting with the operating system
+import math                              # Library for mathematical functions
+import argparse                          # Library for parsing command-line arguments
+import numpy as np                       # Library for numerical computing
+
+from position_store import TRIPLET_INDEX
+
+
+# SigProfiler signatures shipped with the repository (96 channels x K signatures)
+COSMIC_SIGNATURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "signatures", "sigProfiler_SBS_signatures_2019_05_22.csv")
+
+# Matrices already read in this process, by path
+_loaded = {}
+
+
+# ====================
+# SIGNATURE MATRIX
+# ====================
+
+#region Matrix
+
+# Function to read a signature matrix
+def load_signature_matrix(matrix_file=COSMIC_SIGNATURES):
+    """
+    Reads a SigProfiler signature CSV (Type, SubType, then one column per signature) once per process.
+    Returns the channels [(triplet, ref, alt)], the signature names and the 96 x K matrix.
+    """
+
+    if matrix_file not in _loaded:
+        with open(matrix_file, "r") as csv:
+            names = csv.readline().strip().split(",")[2:]
+            channels = []
+            rows = []
+            for line in csv:
+                fields = line.strip().split(",")
+                if len(fields) < 3:
+                    continue
+                ref, alt = fields[0].split(">")                          # Type, e.g. 'C>A'
+                channels.append((fields[1], ref, alt))                    # SubType is the triplet, e.g. 'ACA'
+                rows.append([float(value) for value in fields[2:]])
+        _loaded[matrix_file] = (channels, names, np.array(rows))
+
+    return _loaded[matrix_file]          # example output: [('ACA', 'C', 'A'), ...], ['SBS1', 'SBS2', ...], array of shape (96, 65)
+
+
+# Function to read a mixture of signatures
+def parse_exposures(mixture):
+    """
+    Reads signature exposures given as 'SBS1:0.3,SBS4:0.7' or as a file with one 'signature<tab>exposure' line per signature.
+    Returns a dictionary {signature: exposure}.
+    Raises a ValueError for negative or non-finite exposures, or if they sum to zero.
+    """
+
+    if os.path.exists(mixture):
+        with open(mixture, "r") as exposure_file:
+            entries = [line.strip().replace("\t", ":").replace(",", ":").replace(" ", ":") for line in exposure_file]
+        entries = [entry for entry in entries if entry and not entry.startswith("#")]
+    else:
+        entries = mixture.split(",")
+
+    exposures = {}
+    for entry in entries:
+        name, _, exposure = entry.partition(":")
+        exposure = float(exposure or 1)                                   # A signature without exposure counts as 1
+        if not math.isfinite(exposure) or exposure < 0:
+            raise ValueError(f"Exposure of {name.strip()} must be a finite non-negative number, got {exposure}")
+        exposures[name.strip()] = exposures.get(name.strip(), 0.0) + exposure
+    if sum(exposures.values()) <= 0:
+        raise ValueError(f"Exposures of {mixture} sum to zero, so they do not define a mixture")
+    return exposures                     # example output: {'SBS1': 0.3, 'SBS4': 0.7}
+
+
+# Function to mix signatures into one profile
+def mix_signatures(names, matrix, exposures):
+    """
+    Returns the normalized 96 channel profile of the exposure-weighted signatures (one matrix-vector product).
+    Raises a KeyError for signatures that are not in the matrix.
+    """
+
+    column = {name: j for j, name in enumerate(names)}
+    missing = [name for name in exposures if name not in column]
+    if missing:
+        raise KeyError(f"Signatures not in the matrix: {', '.join(missing)}")
+
+    weights = np.zeros(len(names))
+    for name, exposure in exposures.items():
+        weights[column[name]] = exposure
+    profile = matrix @ weights
+    return profile / profile.sum()
+
+#endregion
+
+
+# ====================
+# CHANNEL SAMPLING
+# ====================
+
+#region Sampling
+
+# Function to build the channel table of a signature mixture
+def build_signature_channel_table(mixture, matrix_file=COSMIC_SIGNATURES):
+    """
+    Same output as randomized_operations.build_channel_table(), for a mixture of matrix signatures instead of a count file.
+    """
+
+    channels, names, matrix = load_signature_matrix(matrix_file)
+    probs = mix_signatures(names, matrix, parse_exposures(mixture))
+    channel_triplets = np.array([TRIPLET_INDEX[triplet] for triplet, _, _ in channels], dtype=np.int64)
+    return channels, channel_triplets, probs
+
+
+# Function to sample channel codes with one multinomial draw
+def sample_channel_counts(channel_probs, n_sim, rng):
+    """
+    Draws how many of the n_sim mutations fall in each channel with one multinomial call and returns the channel codes
+    in random order, like sample_channels(), so the outputs are not sorted by channel.
+    """
+
+    counts = rng.multinomial(n_sim, channel_probs / channel_probs.sum())
+    return rng.permutation(np.repeat(np.arange(len(channel_probs)), counts))
+
+#endregion
+
+
+#### Write a mixture as a count file ####
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Writes the mixed profile of signatures as a count file (triplet, change, frequency).")
+    parser.add_argument('mixture', help="Signatures and exposures, e.g. SBS1:0.3,SBS4:0.7, or an exposure file")
+    parser.add_argument('-m', required=False, default=COSMIC_SIGNATURES, help="Signature matrix CSV")
+    parser.add_argument('-o', required=True, help="Output count file")
+    args = vars(parser.parse_args())
+
+    channels, _, probs = build_signature_channel_table(args['mixture'], args['m'])
+    with open(args['o'], "w") as outfile:
+        for (triplet, ref, alt), prob in zip(channels, probs):
+            outfile.write(f"{triplet}\t{ref}/{alt}\t{prob}\n")
@@ -0,0 +1,146 @@
+"""In-memory simulation API: load a database and a profile once, then simulate as often as needed without touching the filesystem."""
+
+# Import modules
+import numpy as np                       # Library for numerical computing
+
+from frequency import get_freq, compute_count_matrix
+from position_store import PositionStore
+from alias_tables import build_alias_tables
+from randomized_operations import (build_channel_table, sample_channels, simulate_mutations, simulate_context_mutations,
+                                   simulate_mutations_without_replacement, channel_names)
+from signature_matrix import COSMIC_SIGNATURES, build_signature_channel_table, sample_channel_counts
+from context_index import ContextIndex, profile_context_length, build_context_channel_table
+from gtf_mapping import CDSIndex, gtf_hgvs_converter
+
+
+# ====================
+# SIMULATOR
+# ====================
+
+#region Simulator
+
+class Simulator:
+    """
+    A database and a mutational profile (-f count file of any odd context length) or signature mixture (-s), loaded once.
+    Every simulate() call only samples from the memory-mapped database: it writes no files and prints nothing,
+    so it can be called thousands of times in one process (notebooks, services).
+
+    Example:
+        simulator = Simulator("db", profile="signatures/test_signature.counts")
+        result = simulator.simulate(1000, runs=10, seed=1)
+        simulator.hgvsc(result)[:2]                      # ['ENST00000169551:c.609G>A', ...]
+    """
+
+    def __init__(self, db_folder, profile=None, signature=None, transcripts=None, signature_matrix=COSMIC_SIGNATURES,
+                 replacement=True, gtf=None):
+        """
+        db_folder        - database folder with the position store (see build_database.py). Profiles with contexts other
+                           than triplets also need its context index (python context_index.py -d db_folder).
+        profile          - mutational profile count file, as for -f
+        signature        - signature mixture, e.g. 'SBS1:0.3,SBS4:0.7', or an exposure file, as for -s (used if profile is None)
+        transcripts      - transcript IDs to simulate on (default: all transcripts of the database)
+        replacement      - False: no transcript position is mutated twice in a run, as with --no-replacement
+        gtf              - GTF annotation to resolve genomic positions with resolve() (the CDS index is built in memory)
+        """
+
+        if profile is None and signature is None:
+            raise ValueError("A mutational profile or a signature mixture is required")
+
+        self.store = PositionStore(db_folder)                                    # Memory-mapped, read-only
+        self.rows, self.counts = compute_count_matrix(transcripts, self.store)  # Raises a KeyError naming transcripts missing from the database
+        self.replacement = replacement
+        self.context_index = None
+        self.context_table = None
+
+        if profile is not None:
+            freq = get_freq(profile)
+            self.sampler = sample_channels
+            if profile_context_length(freq) == 3:
+                self.channels, self.channel_columns, self.channel_probs = build_channel_table(freq)
+            else:
+                self.channels, self.channel_columns, self.channel_probs, contexts = build_context_channel_table(freq)
+                self.context_index = ContextIndex(db_folder)                    # Not built here: that would write to the database folder
+                context_counts, context_starts = self.context_index.count_matrix(contexts, self.rows)
+                self.context_table = (self.rows, context_counts, context_starts)
+        else:
+            self.sampler = sample_channel_counts
+            self.channels, self.channel_columns, self.channel_probs = build_signature_channel_table(signature, signature_matrix)
+
+        # Sampling tables, built in memory (get_alias_tables() would cache them in the database folder)
+        if self.context_table is None:
+            self.alias_tables = build_alias_tables(self.rows, self.counts)
+            self.site_table = (self.rows, self.counts, self.store.offsets[self.rows, :-1].astype(np.int64))
+            self.site_positions = self.store.positions
+        else:
+            self.alias_tables = build_alias_tables(np.arange(len(self.rows)), self.context_table[1])
+            self.site_table = self.context_table
+            self.site_positions = self.context_index.positions
+
+        self.cds_index = CDSIndex.from_gtf(gtf) if gtf is not None else None
+
+    def simulate_run(self, channel_codes, rng):
+        """
+        Draws the transcript and position of the given channel codes. Returns the store rows and the positions (0-based) of the mutated bases.
+        """
+        if not self.replacement:
+            rows, positions = simulate_mutations_without_replacement(channel_codes, self.channel_columns, self.site_table, self.site_positions, rng)
+            if self.context_table is None:
+                positions += 1                                                   # Triplet start to middle base
+            return rows, positions
+        if self.context_table is None:
+            return simulate_mutations(channel_codes, self.channel_columns, self.alias_tables, self.store, rng)
+        return simulate_context_mutations(channel_codes, self.channel_columns, self.alias_tables, self.context_table, self.context_index, rng)
+
+    def simulate(self, n, runs=1, seed=None):
+        """
+        Simulates runs runs of n mutations. The same seed gives the same mutations as simulator.py -n n -r runs --seed seed.
+        Returns a dictionary of arrays with one entry per mutation, like the columnar output mode:
+            run_id     - run number (from 1)
+            transcript - index into 'transcripts'
+            c_position - position in the coding sequence (1-based, as in the HGVS coding)
+            channel    - index into 'channels' (e.g. 'A[C>A]A')
+        and the seed entropy ('seed'), which reproduces the result.
+        """
+
+        seed_sequence = np.random.SeedSequence(seed)
+        channel_seed, *run_seeds = seed_sequence.spawn(runs + 1)
+        channel_codes = self.sampler(self.channel_probs, n, np.random.default_rng(channel_seed))      # Shared by all runs, as in simulator.py
+
+        results = [self.simulate_run(channel_codes, np.random.default_rng(run_seed)) for run_seed in run_seeds]
+        rows = np.concatenate([rows for rows, _ in results]) if results else np.zeros(0, dtype=np.int64)
+        used_rows, transcript_codes = np.unique(rows, return_inverse=True)
+
+        return {
+            'run_id': np.repeat(np.arange(1, runs + 1, dtype=np.uint32), [len(rows) for rows, _ in results]),
+            'transcript': transcript_codes.astype(np.uint32),
+            'c_position': (np.concatenate([positions for _, positions in results]) if results else np.zeros(0, dtype=np.int64)) + 1,
+            'channel': np.tile(channel_codes, runs).astype(np.uint16),
+            'transcripts': np.array([self.store.transcripts[row] for row in used_rows.tolist()], dtype=str),
+            'channels': np.array(channel_names(self.channels), dtype=str),
+            'seed': seed_sequence.entropy,
+        }
+
+    def hgvsc(self, result):
+        """
+        Returns the HGVS coding string of every mutation of a simulate() result, e.g. 'ENST00000169551:c.609G>A'.
+        """
+        substitutions = [f"{ref}>{alt}" for _, ref, alt in self.channels]
+        transcripts = result['transcripts'].tolist()
+        return [f"{transcripts[transcript]}:c.{position}{substitutions[channel]}"
+                for transcript, position, channel in zip(result['transcript'].tolist(), result['c_position'].tolist(), result['channel'].tolist())]
+
+    def resolve(self, result):
+        """
+        Adds the genomic position of every mutation to a simulate() result, using the GTF given to the constructor (offline).
+        Adds 'chrom' and 'pos' ('' and -1 for mutations that could not be resolved) and returns the result.
+        """
+        if self.cds_index is None:
+            raise ValueError("resolve() needs the Simulator to be created with a GTF annotation (gtf=...)")
+        hgvsc_list = self.hgvsc(result)
+        chr_info, _ = gtf_hgvs_converter(hgvsc_list, self.cds_index)
+        genomic = [chr_info.get(hgvsc, ('', -1)) for hgvsc in hgvsc_list]
+        result['chrom'] = np.array([site[0] for site in genomic], dtype=str)
+        result['pos'] = np.array([site[1] for site in genomic], dtype=np.int64)
+        return result
+
+#endregion
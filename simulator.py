@@ -1,26 +1,23 @@
 """Processing FASTA files and mutational profiles to simulate mutational signatures."""
 
-# TODO: Remove modules and functions that are not used in the main program
-# TODO: is "get_random_position_in_gene()" not used at all? Eszter has commented it out :)
 # Import built-in Python libraries
 import argparse                          # Library for parsing command-line arguments
-import random                            # Library for generating random numbers
-from datetime import date                # Library for handling dates
 import os                                # Library for interacting with the operating system
-import re                                # Library for regular expressions
-import pickle                            # This library is particularly useful when you need to save complex Python data structures like lists, dictionaries, or class instances to a file that can be later retrieved
 
 # Import external libraries
-from Bio import SeqIO                    # Biopython library for handling FASTA files
 import numpy as np                       # Library for numerical computing
 
 # Import functions from other files
-# TODO: fix typo! (now commented out as I don't have vcf)
-from frequency import get_freq, calculate_triplet_counts, process_triplet_positions, compute_triplet_counts, calculate_probabilities 
-from output_paths import get_output_folders, get_output_path, write_output
-from randomized_operations import random_sampling, get_random_position_in_gene, get_transcript_position 
-from ensembl_request import get_hgvs_genomic, hgvs_converter 
-from vcf_output import vcf_writer
+from frequency import get_freq, read_transcript_list, compute_count_matrix, load_count_file
+from output_paths import get_output_folders, get_output_path, get_combined_output_path, write_columnar, HGVSWriter
+from randomized_operations import build_channel_table, sample_channels, simulate_mutations, simulate_context_mutations, simulate_mutations_without_replacement, format_hgvsc, channel_names
+from position_store import PositionStore
+from alias_tables import get_alias_tables
+from hgvs_resolution import resolve_hgvsc, read_hgvsc_list
+from metrics import METRICS, Metrics, Profiler
+
+# Modules only some simulations need (context index, signature matrix, GTF index, HGVS cache, run journal, stage pipeline, VCF output)
+# are imported by the branch that uses them, as in hgvs_resolution.py, so '--help' and short runs do not load them.
 
 # TODO: Call in main argument for rerun failed requests - YES
 # TODO: test input/output full step
@@ -35,73 +32,232 @@ from vcf_output import vcf_writer
 
 
 # Function to parse command-line arguments
-def parse_arguments():
+def parse_arguments(argv=None, prog=None):
     """
-    Parses command-line arguments and returns them as a dictionary.
+    Parses command-line arguments (argv, default sys.argv[1:]) and returns them as a dictionary. prog names the program in the usage message.
     """
     
-    parser = argparse.ArgumentParser(description="Script for processing FASTA files and mutational profiles.")   # Creates a new ArgumentParser object with a description
+    parser = argparse.ArgumentParser(prog=prog, description="Script for processing FASTA files and mutational profiles.")   # Creates a new ArgumentParser object with a description
     
     parser.add_argument('-i', required=False, help="FASTA transcript files")                     # Adds -i FASTA file
     parser.add_argument('-t', required=False, help="Transcript list (file)")                     # Adds -t transcript list file
-    parser.add_argument('-d', required=True, help="Database folder with pre-processed transcript pkl files")      # Adds -d database folder
-    parser.add_argument('-c', required=False, help="Pre-processed transcript counts file")                        # Adds -c transcript counts file
-    parser.add_argument('-f', required=True, help="Mutational profile")                         # Adds -f signature file
+    parser.add_argument('-d', required=True, help="Database folder with the pre-processed triplet position store")      # Adds -d database folder
+    parser.add_argument('-c', required=False, help="Pre-processed transcript counts file (.npy count matrix with its .transcripts.txt, or an old .pkl)")                        # Adds -c transcript counts file
+    parser.add_argument('-f', required=False, help="Mutational profile")                        # Adds -f signature file
+    parser.add_argument('-s', required=False, help="Signature mixture from the signature matrix, e.g. SBS1:0.3,SBS4:0.7, or an exposure file. Used instead of -f")
+    parser.add_argument('--signature-matrix', required=False, help="Signature matrix CSV used by -s (default: the COSMIC SBS matrix in signatures/)")
     parser.add_argument('-n', type=int, required=True, help="Number of simulated mutations")    # Adds -n number of mutations
     parser.add_argument('-r', type=int, required=True, help="Number of runs")                   # Adds -r number of runs
     parser.add_argument('-o', required=False, help="HGVS coding list. Overrides simulation and generate VCF from HGVSC list")          # Adds -o HGVS coding file for VCF generation
     parser.add_argument('-b', type=int, required=False, default=50, help="Batch size for API requests")     
+    parser.add_argument('--api-workers', type=int, required=False, default=4, help="Number of API request batches in flight at the same time")
+    parser.add_argument('--retries', type=int, required=False, default=5, help="Retries of a rate limited or failed API request batch")
+    parser.add_argument('--ensembl-url', required=False, default="https://rest.ensembl.org/variant_recoder/homo_sapiens", help="Ensembl variant_recoder endpoint (e.g. a local stand-in)")
+    parser.add_argument('--cache', required=False, help="SQLite HGVS cache file. Only HGVS coding not in the cache is sent to the Ensembl REST API")
+    parser.add_argument('--cache-size', type=int, required=False, default=1000000, help="Maximum number of entries kept in the HGVS cache")
+    parser.add_argument('--gzip', action='store_true', help="Gzip compress the HGVS coding output of each run")
+    parser.add_argument('--workers', type=int, required=False, default=1, help="Number of processes the runs are spread over")
+    parser.add_argument('--queue-size', type=int, required=False, default=2, help="With one worker, runs waiting between the simulate, resolve and write stages. 0 runs the stages one after another")
+    parser.add_argument('--seed', type=int, required=False, help="Random seed. Every run gets its own stream derived from it")
+    parser.add_argument('--no-replacement', action='store_true', help="Never mutate the same transcript position twice in a run. -n may go up to the number of positions of each triplet")
+    parser.add_argument('--bgzip', action='store_true', help="Write the VCF output bgzip compressed (.vcf.gz) with a tabix index (.vcf.gz.tbi)")
+    parser.add_argument('--validate-vcf', action='store_true', help="Read the VCF output back with vcfpy to check it")
+    parser.add_argument('--output-mode', choices=['runs', 'multisample', 'columnar'], default='runs', help="runs: HGVS list and VCF per run in a dated folder. multisample: one VCF with a sample column per run. columnar: one npz file with a row per simulated mutation")
+    parser.add_argument('--output-prefix', required=False, help="Path (without extension) of the multisample or columnar output")
+    parser.add_argument('--metrics', action='store_true', help="Write stage timers and counters as JSON: one file per run and a summary of the invocation")
+    parser.add_argument('--profile', required=False, help="Profile the main process with cProfile and write the stats to this file")
+    parser.add_argument('--tracemalloc', action='store_true', help="Trace memory allocations of the main process (peak and top sites are added to the metrics)")
+    parser.add_argument('--resume', required=False, help="Output folder (or --output-prefix of the combined output modes) of an interrupted simulation to continue. Completed runs are skipped")
+    parser.add_argument('--retry-failed', action='store_true', help="With --resume, resolve the failed HGVS coding of every run again and rewrite its output")
+    parser.add_argument('-g', required=False, help="Local GTF annotation. Converts HGVS coding to genomic positions offline instead of using the Ensembl REST API")
     
-    args = parser.parse_args()                # Reads the command line arguments 
+    args = parser.parse_args(argv)            # Reads the command line arguments 
+    if args.f is None and args.s is None and args.o is None:
+        parser.error("a mutational profile (-f) or a signature mixture (-s) is required")
+    if args.retry_failed and args.resume is None:
+        parser.error("--retry-failed needs --resume")
+    if args.s is not None and args.signature_matrix is None:
+        from signature_matrix import COSMIC_SIGNATURES
+        args.signature_matrix = COSMIC_SIGNATURES
     return vars(args)                         # Returns the arguments as a dictionary
             # output example: {'i': 'input.fasta', 'f': 'profile.txt', 'n': 100, 'r': 10}
 
+#endregion
+
+
+# ====================
+# SIMULATION RUNS
+# ====================
+
+#region Runs
+
+# Shared, read-only state of a simulation. Set once per process by init_simulation(), so worker processes load it only once.
+SIMULATION = {}
+
+
+# Function to set up the shared simulation state in a process
+def init_simulation(state):
+    """
+    Stores the shared simulation state and opens the database (memory-mapped, so processes share its pages), the GTF index and the HGVS cache.
+    """
+    from run_journal import RunJournal
+
+    SIMULATION.update(state)
+    args = state['args']
+    SIMULATION['store'] = PositionStore(args['d'])
+    SIMULATION['context_index'] = SIMULATION['cds_index'] = SIMULATION['cache'] = None
+    if state['context_table'] is not None:                     # Only for profiles with contexts other than triplets
+        from context_index import ContextIndex
+        SIMULATION['context_index'] = ContextIndex(args['d'])
+    SIMULATION['site_positions'] = SIMULATION['store'].positions if state['context_table'] is None else SIMULATION['context_index'].positions
+    if args['g'] is not None:
+        from gtf_mapping import load_cds_index
+        SIMULATION['cds_index'] = load_cds_index(args['g'])
+    elif args['cache'] is not None:
+        from hgvs_cache import HGVSCache
+        SIMULATION['cache'] = HGVSCache(args['cache'], args['cache_size'])
+    SIMULATION['journal'] = RunJournal(state['journal_folder'])
 
-# Function to read a FASTA file and return sequences
-def read_fasta_list(fasta_file):
+
+# Function to simulate the mutations of one run
+def simulate_run(i, seed_sequence, metrics=METRICS):
     """
-    Reads a FASTA file and returns a list of tuples with (ID, sequence) format.
+    First stage of run i: draws its mutations from its own random stream (seed_sequence) and builds their HGVS coding strings,
+    written straight away in the runs output mode. Stage timers go to metrics.
+    Returns the run as a dictionary, passed on to resolve_run() and write_run().
     """
     
-    sequences = []
-    for record in SeqIO.parse(fasta_file, "fasta"):
-        sequences.append(( ((record.id.split('|')[0]).split(' ')[0]).split('.')[0],str(record.seq)))
-    return sequences                                   # Example output: [('ENSTxxx': 'ATGCGACTGATCGATCGTACG')]
+    args = SIMULATION['args']
+    store = SIMULATION['store']
+    rng = np.random.default_rng(seed_sequence)               # Random generator of this run only
+    
+    print(f"\nRun {i+1}\n")                                 # Print the run number
+    print("Simulate mutations")
+    
+    # Draw a transcript (weighted by its triplet count) and a position for all mutations at once
+    channel_codes, channels = SIMULATION['channel_codes'], SIMULATION['channels']
+    with metrics.stage('simulate'):
+        if args['no_replacement']:
+            rows, positions = simulate_mutations_without_replacement(channel_codes, SIMULATION['channel_triplets'], SIMULATION['site_table'],
+                                                                     SIMULATION['site_positions'], rng)
+            if SIMULATION['context_table'] is None:
+                positions += 1                                 # Triplet start to middle base, as in simulate_mutations()
+        elif SIMULATION['context_table'] is None:
+            rows, positions = simulate_mutations(channel_codes, SIMULATION['channel_triplets'], SIMULATION['alias_tables'], store, rng)
+        else:
+            rows, positions = simulate_context_mutations(channel_codes, SIMULATION['channel_triplets'], SIMULATION['alias_tables'],
+                                                         SIMULATION['context_table'], SIMULATION['context_index'], rng)
+        hgvsc_list = format_hgvsc(rows, positions, channel_codes, channels, store)   # HGVS coding strings are only built here, e.g. 'ENST00000169551:c.609G>A'
+    metrics.count('mutations', len(hgvsc_list))
+    
+    # Output HGVS coding to file (the combined output modes write all runs together in write_combined_output())
+    if args['output_mode'] == 'runs':
+        output_path = get_output_path(SIMULATION['directories'], i+1, SIMULATION['run_name'], args)
+        with metrics.stage('write_hgvs'), HGVSWriter(output_path, compress=args['gzip'], metrics=metrics) as writer:     # One open file per run, written in blocks
+            writer.write_lines(hgvsc_list)
+    
+    return {'index': i, 'rows': rows, 'positions': positions, 'hgvsc_list': hgvsc_list, 'metrics': metrics}
 
 
-# Function to read a FASTA file and return sequences
-def read_fasta(fasta_file):
+# Function to resolve the genomic coordinates of one run
+def resolve_run(run):
     """
-    Reads a FASTA file and returns a dictionary of sequences with their IDs.
+    Second stage of a run: retrieves chromosome and chromosome position (local GTF or Ensembl REST API) of its mutations.
     """
     
-    sequences = {}
-    for record in SeqIO.parse(fasta_file, "fasta"):    # SeqIO.parse() reads FASTA
-        sequences[record.id] = str(record.seq)         # Adds the ID and sequence to the dictionary
-        
-    return sequences                                   # Example output: {'sequenceID': 'ATGCGACTGATCGATCGTACG',}
+    # TODO: Clean up all prints
+    args, journal, i = SIMULATION['args'], SIMULATION['journal'], run['index']
+    with run['metrics'].stage('resolve'):
+        if i in journal.resolved:                               # Resolved before an interruption: only the failures are sent again, if asked for
+            chr_info, hgvs_failed = journal.load_resolution(i)
+            run['metrics'].count('resolutions_journal', len(chr_info))
+            if args['retry_failed'] and hgvs_failed:
+                print(f"Retry {len(hgvs_failed)} failed HGVS coding")
+                retried, hgvs_failed = resolve_hgvsc(sorted(hgvs_failed), args, SIMULATION['cds_index'], SIMULATION['cache'], run['metrics'])
+                chr_info.update(retried)
+                journal.save_resolution(i, chr_info, hgvs_failed)
+        else:
+            chr_info, hgvs_failed = resolve_hgvsc(run['hgvsc_list'], args, SIMULATION['cds_index'], SIMULATION['cache'], run['metrics'])
+            journal.save_resolution(i, chr_info, hgvs_failed)      # Checkpoint: the API round trips of this run are not repeated
+    run['chr_info'], run['hgvs_failed'] = chr_info, hgvs_failed
+    return run
+
+
+# Function to write the output of one run
+def write_run(run):
+    """
+    Last stage of a run: writes its VCF (and metrics file) in the runs output mode.
+    Returns the run index, for the combined output modes the simulated mutations (rows, positions, HGVS coding, genomic information)
+    instead of writing files, and the metrics of the run.
+    """
+    
+    args = SIMULATION['args']
+    i, metrics = run['index'], run['metrics']
+    if args['output_mode'] != 'runs':
+        SIMULATION['journal'].mark_done(i)
+        return i, (run['rows'], run['positions'], run['hgvsc_list'], run['chr_info']), metrics.snapshot()
+    
+    #### Create VCF ####
+    # TODO: Change name of simulator in vcf_output once decided.
+    from vcf_output import vcf_writer
+    
+    print("Create VCF output")
+    output_path = get_output_path(SIMULATION['directories'], i+1, SIMULATION['run_name'], args)  # directories - Path to output folder, run_name - Processed name string based on input.
+    vcf_output_path = output_path.rsplit('.', 1)[0] + ('.vcf.gz' if args['bgzip'] else '.vcf')        # 1 specifies the number of times split() will occur.
+    
+    vcf_writer(run['chr_info'], vcf_output_path, compress=args['bgzip'], validate=args['validate_vcf'], metrics=metrics)
+    
+    if args['metrics']:
+        metrics.write(output_path.rsplit('.', 1)[0] + '.metrics.json', run=i+1)
+    SIMULATION['journal'].mark_done(i)
+    return i, None, metrics.snapshot()
 
-# 
-def read_transcript_list(transcript_list_file):
+
+# Function to perform one run of the simulation
+def run_simulation(i, seed_sequence):
     """
-    Reads in list of transcript IDs to consider
+    Simulates, writes and resolves run i, using its own random stream (seed_sequence), one stage after the other.
+    The output of a run only depends on its seed, not on which process it runs in or in which order.
+    Returns the same as write_run().
     """
-    seqIDs = []
-    with open(transcript_list_file, "r") as list_in:
-        lines = list_in.readlines()
-    seqIDs = [(l.strip().split('|')[0]).split('.')[0] for l in lines] # processing to ignore .version and other info
-    return seqIDs                                                     # example output: ['ENST000001', 'ENST000002']
+    
+    METRICS.reset()                                          # Metrics of this run only
+    return write_run(resolve_run(simulate_run(i, seed_sequence)))
 
 
-# Opens a txt file containing HGVS coding sequences and returns a list
-def open_hgvsc(args):
+# Function to write the results of all runs into one file
+def write_combined_output(results, state, store, output_path):
     """
-    Reads a file of HGVS coding sequences and returns a list
+    Writes the (rows, positions, HGVS coding, genomic information) results of all runs, in run order,
+    as one multi-sample VCF or as one npz file of columns.
     """
-    with open(args["o"], "r") as file:
-        lines = [line.strip() for line in file.readlines()]
     
-    return lines
+    args = state['args']
+    
+    if args['output_mode'] == 'multisample':
+        from vcf_output import multisample_vcf_writer
+        vcf_output_path = output_path + ('.vcf.gz' if args['bgzip'] else '.vcf')
+        multisample_vcf_writer([chr_info for _, _, _, chr_info in results], vcf_output_path, compress=args['bgzip'], validate=args['validate_vcf'])
+        return vcf_output_path
+    
+    # One row per simulated mutation. Transcripts and channels are stored as codes into lookup tables.
+    rows = np.concatenate([rows for rows, _, _, _ in results])
+    used_rows, transcript_codes = np.unique(rows, return_inverse=True)
+    channels = state['channels']
+    
+    genomic = [chr_info.get(hgvsc, ('', -1)) for _, _, hgvsc_list, chr_info in results for hgvsc in hgvsc_list]   # Unresolved mutations: chrom '' and pos -1
+    columns = {
+        'run_id': np.repeat(np.arange(1, len(results) + 1, dtype=np.uint32), [len(rows) for rows, _, _, _ in results]),
+        'transcript': transcript_codes.astype(np.uint32),
+        'c_position': np.concatenate([positions for _, positions, _, _ in results]).astype(np.int64) + 1,
+        'channel': np.tile(state['channel_codes'], len(results)).astype(np.uint16),
+        'chrom': np.array([site[0] for site in genomic], dtype=str),
+        'pos': np.array([site[1] for site in genomic], dtype=np.int64),
+        'transcripts': np.array([store.transcripts[row] for row in used_rows.tolist()], dtype=str),
+        'channels': np.array(channel_names(channels), dtype=str),          # Example: 'A[C>A]A'
+    }
+    write_columnar(output_path + '.npz', columns)
+    return output_path + '.npz'
 
 #endregion
 
@@ -112,13 +268,18 @@ def open_hgvsc(args):
 
 #region MainProgram
 
-if __name__ == "__main__":                                                  # Checks if the script is executed as the main program or imported as module. If the script is executed as the main program, the code block is executed, not if it is imported as a module.
+def main(argv=None, prog=None):
+    """
+    Runs the simulator with the command-line arguments argv (default sys.argv[1:]), as 'speculator.py simulate' does.
+    """
     
     print("\nParse arguments")
     
     # Parse command-line arguments
-    args = parse_arguments()                                                # Calls the function to parse command-line arguments and return the arguments as a dictionary
+    args = parse_arguments(argv, prog)                                      # Calls the function to parse command-line arguments and return the arguments as a dictionary
     db_folder = args['d']                                                   # Assign database folder to a variable    
+    profiler = Profiler(args['profile'], args['tracemalloc'])              # Does nothing without --profile or --tracemalloc
+    profiler.start()
     # TODO: Check if db_folder exist, otherwise, create it.
     
     #### Override block ####
@@ -126,26 +287,32 @@ if __name__ == "__main__":                                                  # Ch
     if args['o'] is not None:     # if a list of HGVS coding is provided
         print("Simulation override. HGVSC list provided")
         
-        hgvsc_list = open_hgvsc(args)  
-        # TODO: Move these inside function instead?              
-        url = "https://rest.ensembl.org/variant_recoder/homo_sapiens"
-        headers = {"Content-Type": "application/json", "Accept": "application/json"}
-        
-        print("Access ensemble API")
-        hgvs_genomic, hgvs_failed = get_hgvs_genomic(hgvsc_list, url, headers)        # Calls the function to get the HGVS genomic notation from the REST API. The function returns 1 dictionary, 1 list: hgvs_genomic and hgvs_failed.
-        
-        print("Extract data for VCF")
-        chr_info = hgvs_converter(hgvs_genomic)
+        hgvsc_list = read_hgvsc_list(args['o'])
+        METRICS.count('bytes_read', os.path.getsize(args['o']))
+        from vcf_output import vcf_writer
+        cds_index = cache = None
+        if args['g'] is not None:
+            from gtf_mapping import load_cds_index
+            cds_index = load_cds_index(args['g'])                            # Offline c. to genomic index
+        elif args['cache'] is not None:
+            from hgvs_cache import HGVSCache
+            cache = HGVSCache(args['cache'], args['cache_size'])             # HGVSC to HGVSG results of earlier runs and invocations
+        with METRICS.stage('resolve'):
+            chr_info, hgvs_failed = resolve_hgvsc(hgvsc_list, args, cds_index, cache)      # Genomic information for the VCF, offline (-g) or from the REST API
         
         print("\nWrite VCF:\n")
         ##### Write VCF #####
         # TODO: fix the VCF output path
         # TODO: Make output naming based on input file name?
         
-        vcf_output_path = args['o'].rsplit('.', 1)[0] + '.vcf'
+        vcf_output_path = args['o'].rsplit('.', 1)[0] + ('.vcf.gz' if args['bgzip'] else '.vcf')
         print(f"This is '-o' input: {args['o']}")
         print(f"This is the changed string: {vcf_output_path}")
-        vcf_writer(chr_info, vcf_output_path)
+        vcf_writer(chr_info, vcf_output_path, compress=args['bgzip'], validate=args['validate_vcf'])
+        
+        profiler.stop()
+        if args['metrics']:
+            METRICS.write(args['o'].rsplit('.', 1)[0] + '.metrics.json')
     
     
     ########## If no HGVSC list is provided, the program will continue with the simulation ##########
@@ -154,123 +321,157 @@ if __name__ == "__main__":                                                  # Ch
         print("Read input files and calculate frequencies")
         
         # Read input files and calculate frequencies
-        freq = get_freq(args['f'])                                              # Calculate frequencies from mutational profile file and store in freq dictionary
         if args['i'] is not None:     # if a fasta file is provided
-            sequences = read_fasta_list(args['i'])                              # Read FASTA file and return list of tuples of IDs and sequences
-            triplet_counts = process_triplet_positions(sequences, db_folder)    # In this case new database is processed based on fasta
+            from build_database import build_database                    # Only imported when indexing a FASTA, like the process pool below
+            transcripts = build_database(args['i'], db_folder, args['workers'])  # Streams the FASTA and indexes the transcripts not in the database yet
             run_name = '.'.join(args['i'].split('/')[-1].split('.')[:-1])       # split('/')[-1] - Picks the string after the last "/". split('.')[:-1] and '.'.join() removes the file type and joins the string.
         elif args['t'] is not None:   # if a list of transcripts is provided
             transcripts = read_transcript_list(args['t'])
-            triplet_counts = compute_triplet_counts(transcripts, db_folder)
             run_name = '.'.join(args['t'].split('/')[-1].split('.')[:-1])       # split('/')[-1] - Picks the string after the last "/". split('.')[:-1] and '.'.join() removes the file type and joins the string.
-        else:                         # use all entries in pre-processed count file
-            with open(args['c'], 'rb') as read_db:     # Read in saved count file
-                triplet_counts = pickle.load(read_db)
+        elif args['c'] is not None:   # use all entries in pre-processed count file
+            transcripts = None
             run_name = '.'.join(args['c'].split('/')[-1].split('.')[:-1])
-        # TODO: add checks for ensuring database and triplet_counts contain the same transcripts
+        else:                         # use all transcripts of the database
+            transcripts = None
+            run_name = os.path.basename(os.path.normpath(db_folder))
         
-        # Calculate triplet counts, gene lengths, and probabilities
-        # triplet_count, gene_length, pos_in_gene, counting = calculate_triplet_counts(sequences)   # The function returns 4 dictionaries
-        # probabilities = calculate_probabilities(triplet_count, counting)                          # Calculate probabilities for each triplet in each transcript and store in probabilities dictionary 
+        with METRICS.stage('load_counts'):
+            store = PositionStore(db_folder)                                    # Memory-maps the triplet position store and count matrix once for all runs
+            if transcripts is None and args['c'] is not None:
+                count_rows, counts = load_count_file(args['c'], store)          # .npy count matrix (or an old pickled count dictionary)
+            else:
+                count_rows, counts = compute_count_matrix(transcripts, store)   # Row selection of the transcript x triplet count matrix. Raises a KeyError naming transcripts missing from the database.
+        print(f"Transcripts: {len(count_rows)}, triplets: {int(counts.sum())}")  # Column sums give the total of each triplet
         
         print("Perform random sampling")
         
+        # A resumed simulation continues with the seed of its journal
+        from run_journal import RunJournal
+        journal = None
+        if args['resume'] is not None:
+            journal_folder = os.path.join(args['resume'], 'journal') if args['output_mode'] == 'runs' else args['resume'] + '.journal'
+            journal = RunJournal.resume(journal_folder, args)             # Raises a ValueError if the simulation arguments differ
+        
+        # Independent random streams: one for the channel sampling and one per run. Run k gets the same stream whatever the number of workers.
+        seed_sequence = np.random.SeedSequence(journal.seed if journal is not None else args['seed'])
+        print(f"Seed: {seed_sequence.entropy}")                                         # Reusing this value with --seed reproduces the simulation
+        channel_seed, *run_seeds = seed_sequence.spawn(args['r'] + 1)
+        
         # Perform random sampling based on triplet frequencies
-        sampled_triplets = random_sampling(freq, args['n'])      # takes -n mutations as input. Returns a list of sampled elements.
+        context_table = None
+        with METRICS.stage('channel_sampling'):
+            if args['f'] is not None:
+                from context_index import profile_context_length
+                freq = get_freq(args['f'])                                              # Calculate frequencies from mutational profile file and store in freq dictionary
+                if profile_context_length(freq) == 3:
+                    channels, channel_triplets, channel_probs = build_channel_table(freq)   # Integer-coded substitutions of the profile, e.g. [('CGA', 'G', 'A'), ...]
+                else:
+                    # Longer (or shorter) contexts, e.g. pentanucleotide profiles: counts and positions come from the context index of the database
+                    from context_index import ContextIndex, build_context_channel_table
+                    channels, channel_triplets, channel_probs, contexts = build_context_channel_table(freq)     # channel_triplets holds context codes here
+                    context_counts, context_starts = ContextIndex.open(db_folder).count_matrix(contexts, count_rows)
+                    context_table = (count_rows, context_counts, context_starts)
+                channel_codes = sample_channels(channel_probs, args['n'], np.random.default_rng(channel_seed))   # takes -n mutations as input. Returns an array of sampled channel codes.
+            else:
+                from signature_matrix import build_signature_channel_table, sample_channel_counts
+                channels, channel_triplets, channel_probs = build_signature_channel_table(args['s'], args['signature_matrix'])   # Mixed profile straight from the signature matrix
+                channel_codes = sample_channel_counts(channel_probs, args['n'], np.random.default_rng(channel_seed))   # Channel counts from one multinomial draw
+        with METRICS.stage('alias_tables'):
+            if context_table is None:
+                alias_tables = get_alias_tables(count_rows, counts, db_folder)          # Alias tables for weighted transcript selection, cached in the database folder
+            else:
+                alias_tables = get_alias_tables(np.arange(len(count_rows)), context_counts, db_folder, kind="context")    # Indices into count_rows, see simulate_context_mutations()
+        
+        # Sites for --no-replacement: the count matrix and the start of every (transcript, triplet) slice of the position array
+        site_table = None
+        if args['no_replacement']:
+            site_table = context_table if context_table is not None else (count_rows, counts, store.offsets[count_rows, :-1].astype(np.int64))
         
         print("Create output directories")
         
         # Creating output directory
-        directories = get_output_folders(run_name, args)             # Returns the intended output directory path as a string.
-        os.makedirs(directories, exist_ok=True)                # Creates the output directories if they do not exist already.
+        if args['output_mode'] == 'runs':
+            directories = os.path.join(args['resume'], '') if journal is not None else get_output_folders(run_name, args)   # Returns the intended output directory path as a string.
+            os.makedirs(directories, exist_ok=True)                # Creates the output directories if they do not exist already.
+            journal_folder = os.path.join(directories, 'journal')
+        else:
+            directories = None
+            output_path = args['resume'] if journal is not None else get_combined_output_path(run_name, args)     # One file for all runs, no directory scan
+            os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+            journal_folder = output_path + '.journal'
+        
+        # Journal of the simulation: arguments, seed, resolved mutations and failures of every run
+        if journal is None:
+            journal = RunJournal.create(journal_folder, args, seed_sequence.entropy)
+        
+        # Runs still to do. The combined output modes need every run, but completed ones are read back from the journal instead of resolved again.
+        if args['output_mode'] == 'runs':
+            pending = journal.pending_runs(args['r'], args['retry_failed'])
+        else:
+            pending = list(range(args['r']))
+        if args['resume'] is not None:
+            print(f"Resume: {len(pending)} of {args['r']} runs to do")
         
         
         #### Main simulation part ####: 
         
         print("Start simulation")
         
-        # Iterating over sampled triplets and looping runs
-        for i in range(args['r']):                            # Run the simulation -r times. Numbers series created with range(). The loop will run the number of times specified by the -r argument.
-            
-            print(f"\nRun {i+1}\n")                           # Print the run number
-            print("Simulate mutations")
-            
-            hgvsc_list = []                                   # Create an empty list to store the output strings
-            
-            for run in sampled_triplets:                      # Each element in this list is a string representing a triplet and a substitution separated by an underscore "_". The loop iterates over these strings. 
-                trip, sub = run.split("_")                    # split() splits the string  at the underscore. The parts are unpacked into the variables trip (triplet) and sub (substitution). If run was a string like "CGA_G/A", then trip would become "CGA" and sub would become "G/A".
-                
-                # probabilities is a dictionary containing information about each triplet, including names and probabilities.
-                # names = probabilities[trip]['name']         # names is a list of transcripts
-                # probs = probabilities[trip]['prob']         # probs is a list of probabilities
-                names = triplet_counts[trip][0]
-                counts = triplet_counts[trip][1]              # counts are used as weights to not have to compute probabilities (faster)
-                
-                # Randomly select a transcript based on probabilities
-                # selected_transcript = np.random.choice(names, p=probs)       # np.random.choice() returns a random transcript based on the probabilities. p=probs is the list of probabilities
-                selected_transcript = random.choices(names, weights=counts)[0] # using random.choices (since faster), returns a randomly selected one weighted by the number of times each transcript has the triplet
-                
-                # Get a random position in the selected gene
-                # position = get_random_position_in_gene(pos_in_gene, selected_transcript, trip)   # Inside the function, it first retrieves the list of positions where the given triplet occurs in the given transcript from the posingene dictionary. Then it uses the random.choice() function to select a random position from this list.
-                position = get_transcript_position(selected_transcript, trip, db_folder)           # Reads in the corresponding transcript dictionary file, and chooses a random position where that triplet can be found
-                
-                # Create HGVS coding string
-                ch = sub.split("/")                          # split() splits the string at the slash and saves into a list. The parts are unpacked into the variables ch[0] and ch[1]. If sub was a string like "A/B", then ch would become the list ['A', 'B'].
-                output_string = f"{selected_transcript}:c.{position + 1}{ch[0]}>{ch[1]}"
-                hgvsc_list.append(output_string)             # Append the output string to the list hgvsc_list
-                
-                # Output HGVS coding to file
-                write_output(output_string,directories, run_name, args, i)
-            
-            
-            #### Retrieve chromosome and chromosome position from ENSEMBL REST API ####
-            # TODO: Clean up all prints
-            
-            print("Access ensemble API")
-            
-            url = "https://rest.ensembl.org/variant_recoder/homo_sapiens"
-            headers = {"Content-Type": "application/json", "Accept": "application/json"}
-            
-            hgvs_genomic, hgvs_failed = get_hgvs_genomic(hgvsc_list, url, headers, args['b'])        # Calls the function to get the HGVS genomic notation from the REST API. The function returns 1 dictionary, 1 list: hgvs_genomic and hgvs_failed.
-            
-            # Print matching/failed HGVS coding
-            print(f"Number of matches: {len(hgvs_genomic)}")
-            #for key,value in hgvs_genomic.items():
-                #print(f"key: {key}, value: {value}")
-                
-            print(f"Number of failed matches: {len(hgvs_failed)}")
-            for value in hgvs_failed:
-                print(value)
-            
-            # TODO: Remove testprints when the problem is fixed.
-            # Testprint to see if ensembl gives wrong pos.
-            
-            #print("\nBefore converting\n")
-            
-            #for key, value in hgvs_genomic.items():
-                #print(f"Key: {key}, value: {value}")
-            
-            #### Create VCF ####
-            # TODO: Change name of simulator in vcf_output once decided.
-            
-            print("Create VCF output")
-            chr_info = hgvs_converter(hgvs_genomic)
-            
-            # TODO: Remove testprints when the problem is fixed.
-            # Testprint to see if hgvd converter or vcf output fails
-            
-            #print("\nAfter converting\n")
-            
-            #for key, value in chr_info.items():
-                #print(f"Key: {key}, value: {value}")
-                
-            
-            vcf_output_path = get_output_path(directories, i+1, run_name, args)  # directories - Path to output folder, run_name - Processed name string based on input.
-            vcf_output_path = vcf_output_path.rsplit('.', 1)[0] + '.vcf'        # 1 specifies the number of times split() will occur.
-            
-            vcf_writer(chr_info, vcf_output_path)
-            
-            print("\nEnd of program")
+        state = {'args': args, 'channels': channels, 'channel_triplets': channel_triplets, 'channel_codes': channel_codes,
+                 'alias_tables': alias_tables, 'context_table': context_table, 'site_table': site_table, 'directories': directories, 'run_name': run_name,
+                 'journal_folder': journal_folder}
+        
+        results = []                                          # Simulated mutations of every run, only kept for the combined output modes
+        totals = Metrics()                                    # Metrics of the whole invocation: setup and all runs (wherever they ran)
+        totals.merge(METRICS.snapshot())
+        if args['workers'] > 1:
+            # Runs are spread over a process pool. Every worker opens the memory-mapped database once, read-only.
+            from concurrent.futures import ProcessPoolExecutor   # Process pool for running simulation runs in parallel
+            with ProcessPoolExecutor(max_workers=args['workers'], initializer=init_simulation, initargs=(state,)) as executor:
+                for i, result, run_metrics in executor.map(run_simulation, pending, [run_seeds[i] for i in pending]):
+                    print(f"Run {i+1} done")
+                    totals.merge(run_metrics)
+                    if result is not None:
+                        results.append(result)
+        elif args['queue_size'] > 0:
+            # Stages of consecutive runs overlap: run i+1 is simulated while run i is resolved and run i-1 is written.
+            # Every run records its stage timers and counters (API, cache, VCF, ...) in its own Metrics, whichever stage thread it is in.
+            from pipeline import run_pipeline
+            init_simulation(state)
+            METRICS.reset()
+            stages = (lambda i: simulate_run(i, run_seeds[i], Metrics()), resolve_run, write_run)
+            for i, result, run_metrics in run_pipeline(pending, stages, args['queue_size']):
+                print(f"Run {i+1} done")
+                totals.merge(run_metrics)
+                if result is not None:
+                    results.append(result)
+            totals.merge(METRICS.snapshot())
+        else:
+            init_simulation(state)
+            for i in pending:                                 # Run the simulation -r times (minus the runs a resumed simulation already did)
+                _, result, run_metrics = run_simulation(i, run_seeds[i])
+                totals.merge(run_metrics)
+                if result is not None:
+                    results.append(result)
+        
+        METRICS.reset()
+        if args['output_mode'] != 'runs':
+            with METRICS.stage('combined_output'):
+                print(f"Write combined output: {write_combined_output(results, state, store, output_path)}")
+        
+        profiler.stop()
+        if args['metrics']:
+            totals.merge(METRICS.snapshot())
+            totals.extra = METRICS.extra                      # Memory trace, if any
+            metrics_path = os.path.join(directories, 'metrics.json') if args['output_mode'] == 'runs' else output_path + '.metrics.json'
+            totals.write(metrics_path, runs=args['r'], workers=args['workers'])
+            print(f"Metrics written to {metrics_path}")
+        
+        print("\nEnd of program")
+
+
+if __name__ == "__main__":                                                  # Checks if the script is executed as the main program or imported as module. If the script is executed as the main program, the code block is executed, not if it is imported as a module.
+    main()
 
 #endregion
 
@@ -288,8 +489,3 @@ if __name__ == "__main__":                                                  # Ch
 
 
 # argumenr batchsize
-
-# TODO: Fix VCF problem!
-# If several mutations are in the same gene, the VCF file will only contain the first repeated several times.
-# Problem narrowed down to occur in the request function. 
-#      - Only one HGVSgenomic is returned for all identical transcripts with different mutations
\ No newline at end of file
@@ -0,0 +1,178 @@
+"""Command-line entry point with one subcommand per step. Every subcommand imports only the modules it needs, so short invocations start fast."""
+
+# Import modules
+import os                                # Library for interacting with the operating system
+import sys                               # Library for the exit code
+import argparse                          # Library for parsing command-line arguments
+
+# Nothing else is imported here: Biopython, NumPy, requests and vcfpy each take about as long to import as the interpreter takes to start.
+# The handlers below import what they use, e.g. 'to-vcf -g' never loads requests and '--help' loads none of them.
+
+
+# ====================
+# ARGUMENTS
+# ====================
+
+#region Arguments
+
+# Function to add the options of HGVS resolution, shared by resolve and to-vcf
+def add_resolution_arguments(parser):
+    """
+    Adds the resolution options of simulator.py: the local GTF (-g), or the Ensembl REST API with its cache.
+    """
+    parser.add_argument('-o', required=True, help="HGVS coding list")
+    parser.add_argument('-g', required=False, help="Local GTF annotation. Converts HGVS coding to genomic positions offline instead of using the Ensembl REST API")
+    parser.add_argument('-b', type=int, required=False, default=50, help="Batch size for API requests")
+    parser.add_argument('--api-workers', type=int, required=False, default=4, help="Number of API request batches in flight at the same time")
+    parser.add_argument('--retries', type=int, required=False, default=5, help="Retries of a rate limited or failed API request batch")
+    parser.add_argument('--ensembl-url', required=False, default="https://rest.ensembl.org/variant_recoder/homo_sapiens", help="Ensembl variant_recoder endpoint (e.g. a local stand-in)")
+    parser.add_argument('--cache', required=False, help="SQLite HGVS cache file. Only HGVS coding not in the cache is sent to the Ensembl REST API")
+    parser.add_argument('--cache-size', type=int, required=False, default=1000000, help="Maximum number of entries kept in the HGVS cache")
+    parser.add_argument('--output', required=False, help="Output file (default: the -o list with its extension replaced)")
+    parser.add_argument('--metrics', action='store_true', help="Write stage timers and counters as JSON next to the output")
+
+
+# Function to build the parser of all subcommands
+def build_parser():
+    """
+    Returns the argument parser. build-db and simulate pass their arguments on unchanged to build_database.py and simulator.py.
+    """
+
+    parser = argparse.ArgumentParser(prog="speculator.py", description="Simulation of mutational signatures on coding sequences.")
+    subparsers = parser.add_subparsers(dest='command', required=True, metavar='command')
+
+    # Subcommands with their own parser: its help needs the module, so it is only built once the subcommand is chosen
+    build_db = subparsers.add_parser('build-db', add_help=False, help="Build, extend or sync the triplet position database (build_database.py)")
+    build_db.set_defaults(handler=run_build_db, passthrough=True)
+    simulate = subparsers.add_parser('simulate', add_help=False, help="Simulate mutations and write HGVS, VCF or columnar output (simulator.py)")
+    simulate.set_defaults(handler=run_simulate, passthrough=True)
+
+    counts = subparsers.add_parser('counts', help="Write the triplet count file (-c) of a transcript selection")
+    counts.add_argument('-d', required=True, help="Database folder with the pre-processed triplet position store")
+    counts.add_argument('-t', required=False, help="Transcript list (file). Default: all transcripts of the database")
+    counts.add_argument('--output', required=True, help="Count file (.npy, with its .transcripts.txt)")
+    counts.set_defaults(handler=run_counts, passthrough=False)
+
+    resolve = subparsers.add_parser('resolve', help="Convert a HGVS coding list to genomic positions (TSV: hgvsc, chromosome, position, reference, alternative)")
+    add_resolution_arguments(resolve)
+    resolve.set_defaults(handler=run_resolve, passthrough=False)
+
+    to_vcf = subparsers.add_parser('to-vcf', help="Convert a HGVS coding list to a VCF, as simulator.py -o does")
+    add_resolution_arguments(to_vcf)
+    to_vcf.add_argument('--bgzip', action='store_true', help="Write the VCF output bgzip compressed (.vcf.gz) with a tabix index (.vcf.gz.tbi)")
+    to_vcf.add_argument('--validate-vcf', action='store_true', help="Read the VCF output back with vcfpy to check it")
+    to_vcf.set_defaults(handler=run_to_vcf, passthrough=False)
+
+    return parser
+
+#endregion
+
+
+# ====================
+# SUBCOMMANDS
+# ====================
+
+#region Subcommands
+
+# build-db: build_database.py with its own arguments
+def run_build_db(args, argv):
+    from build_database import main as build_database_main
+    build_database_main(argv, prog="speculator.py build-db")
+
+
+# simulate: simulator.py with its own arguments
+def run_simulate(args, argv):
+    from simulator import main as simulator_main
+    simulator_main(argv, prog="speculator.py simulate")
+
+
+# counts: count file of a transcript selection, for simulate -c
+def run_counts(args, argv):
+    from frequency import read_transcript_list, compute_count_matrix, save_count_file
+    from position_store import PositionStore
+
+    store = PositionStore(args['d'])
+    transcripts = read_transcript_list(args['t']) if args['t'] is not None else None
+    rows, counts = compute_count_matrix(transcripts, store)              # Raises a KeyError naming transcripts missing from the database
+    output = args['output'] if args['output'].endswith(".npy") else args['output'] + ".npy"
+    save_count_file(output, [store.transcripts[row] for row in rows.tolist()], counts)
+    print(f"Transcripts: {len(rows)}, triplets: {int(counts.sum())}, written to {output}")
+
+
+# Function to resolve the HGVS coding list of resolve and to-vcf
+def resolve_hgvsc_file(args):
+    """
+    Reads the -o list and resolves it offline (-g) or through the Ensembl REST API (with the --cache, if given).
+    Returns the genomic information {hgvsc: (chromosome, locus, reference, alternative)} and the failed HGVS coding strings.
+    """
+    from hgvs_resolution import read_hgvsc_list, resolve_hgvsc
+    from metrics import METRICS
+
+    hgvsc_list = read_hgvsc_list(args['o'])
+    METRICS.count('bytes_read', os.path.getsize(args['o']))
+    cds_index = cache = None
+    if args['g'] is not None:
+        from gtf_mapping import load_cds_index
+        cds_index = load_cds_index(args['g'])                             # Offline c. to genomic index, cached next to the GTF
+    elif args['cache'] is not None:
+        from hgvs_cache import HGVSCache
+        cache = HGVSCache(args['cache'], args['cache_size'])
+    with METRICS.stage('resolve'):
+        return resolve_hgvsc(hgvsc_list, args, cds_index, cache)
+
+
+# resolve: genomic positions of a HGVS coding list as TSV, failures in <output>.failed.txt
+def run_resolve(args, argv):
+    from metrics import METRICS
+
+    chr_info, hgvs_failed = resolve_hgvsc_file(args)
+    output = args['output'] or args['o'].rsplit('.', 1)[0] + '.tsv'
+    with open(output, "w") as outfile:                                   # Same columns as the resolutions of the run journal
+        outfile.writelines("\t".join((coding, *map(str, info))) + "\n" for coding, info in chr_info.items())
+    if hgvs_failed:
+        with open(output.rsplit('.', 1)[0] + '.failed.txt', "w") as outfile:
+            outfile.writelines(coding + "\n" for coding in sorted(hgvs_failed))
+    print(f"Resolved: {len(chr_info)}, failed: {len(hgvs_failed)}, written to {output}")
+    if args['metrics']:
+        METRICS.write(output.rsplit('.', 1)[0] + '.metrics.json')
+
+
+# to-vcf: VCF of a HGVS coding list, the -o override of simulator.py
+def run_to_vcf(args, argv):
+    from vcf_output import vcf_writer
+    from metrics import METRICS
+
+    chr_info, hgvs_failed = resolve_hgvsc_file(args)
+    output = args['output'] or args['o'].rsplit('.', 1)[0] + ('.vcf.gz' if args['bgzip'] else '.vcf')
+    vcf_writer(chr_info, output, compress=args['bgzip'] or None, validate=args['validate_vcf'])
+    print(f"VCF written to {output}")
+    if args['metrics']:
+        METRICS.write(args['o'].rsplit('.', 1)[0] + '.metrics.json')
+
+#endregion
+
+
+# ====================
+# MAIN PROGRAM
+# ====================
+
+#region MainProgram
+
+def main(argv=None):
+    """
+    Runs the subcommand of the command-line arguments argv (default sys.argv[1:]).
+    """
+
+    parser = build_parser()
+    parsed, remaining = parser.parse_known_args(argv)
+    if remaining and not parsed.passthrough:
+        parser.error(f"unrecognized arguments: {' '.join(remaining)}")
+    args = vars(parsed)
+    args['handler'](args, remaining)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+#endregion
@@ -0,0 +1,189 @@
+"""Start-up regression check: times short speculator.py invocations and checks which modules each subcommand imports."""
+
+# Import modules
+import os                                # Library for interacting with the operating system
+import sys                               # Library for the interpreter running the invocations
+import json                              # Library for writing and reading the results
+import time                              # Library for the timers
+import random                            # Library for the synthetic transcripts
+import platform                          # Library for the machine description in the metadata
+import tempfile                          # Library for the temporary fixture folder
+import subprocess                        # Library for running the invocations in fresh interpreters
+import argparse                          # Library for parsing command-line arguments
+from datetime import datetime            # Library for handling dates
+
+
+SCRIPT_FOLDER = os.path.dirname(os.path.abspath(__file__))
+SPECULATOR = os.path.join(SCRIPT_FOLDER, "speculator.py")
+PROFILE = os.path.join(SCRIPT_FOLDER, "signatures", "test_signature.counts")
+
+# Modules that are slow to import (about as long as the interpreter start each) and the ones only some subcommands need
+HEAVY = ("numpy", "requests", "Bio", "vcfpy")
+OFFLINE = ("requests", "Bio", "vcfpy")
+# Modules simulator.py only imports in the branch of the simulation that uses them
+SIMULATE_LAZY = ("context_index", "signature_matrix", "gtf_mapping", "hgvs_cache", "run_journal", "pipeline", "vcf_output")
+
+
+# ====================
+# FIXTURES
+# ====================
+
+#region Fixtures
+
+# Function to write the inputs of the invocations
+def write_fixtures(folder, n_transcripts=20, length=600, seed=0):
+    """
+    Writes a FASTA of synthetic transcripts, a GTF placing them on the genome and a HGVS coding list, and builds the database.
+    Returns the paths as a dictionary.
+    """
+
+    rng = random.Random(seed)
+    paths = {name: os.path.join(folder, file) for name, file in
+             (('fasta', "startup.fasta"), ('gtf', "startup.gtf"), ('hgvsc', "startup.txt"), ('db', "db"), ('counts', "startup.npy"))}
+
+    sequences = [(f"ENSTSTART{i:06d}", "ATG" + "".join(rng.choice("ACGT") for _ in range(length - 3))) for i in range(n_transcripts)]
+    with open(paths['fasta'], "w") as fasta, open(paths['gtf'], "w") as gtf, open(paths['hgvsc'], "w") as hgvsc:
+        for i, (transcript, sequence) in enumerate(sequences):
+            fasta.write(f">{transcript}\n{sequence}\n")
+            start = 10000 * (i + 1)
+            gtf.write(f'1\tensembl\tCDS\t{start}\t{start + length - 1}\t.\t+\t0\tgene_id "G{i}"; transcript_id "{transcript}";\n')
+            position = rng.randrange(length)
+            alternative = rng.choice([base for base in "ACGT" if base != sequence[position]])
+            hgvsc.write(f"{transcript}:c.{position + 1}{sequence[position]}>{alternative}\n")
+
+    os.makedirs(os.path.join(folder, "output"), exist_ok=True)               # Output folder of the runs output mode
+    # Database and GTF index cache, so the timed invocations only read them
+    subprocess.run([sys.executable, SPECULATOR, "build-db", "-i", paths['fasta'], "-d", paths['db'], "--workers", "1"],
+                   check=True, capture_output=True)
+    subprocess.run([sys.executable, SPECULATOR, "resolve", "-o", paths['hgvsc'], "-g", paths['gtf']], check=True, capture_output=True)
+    return paths
+
+
+# Function to list the invocations to time
+def startup_cases(paths, folder):
+    """
+    Returns (name, speculator.py arguments, modules that must not be imported) for every checked invocation.
+    """
+
+    return [
+        ("help", ["--help"], HEAVY),
+        ("resolve --help", ["resolve", "--help"], HEAVY),
+        ("to-vcf --help", ["to-vcf", "--help"], HEAVY),
+        ("simulate --help", ["simulate", "--help"], OFFLINE + SIMULATE_LAZY),
+        ("resolve -g", ["resolve", "-o", paths['hgvsc'], "-g", paths['gtf'], "--output", os.path.join(folder, "out.tsv")], OFFLINE),
+        ("to-vcf -g", ["to-vcf", "-o", paths['hgvsc'], "-g", paths['gtf'], "--output", os.path.join(folder, "out.vcf")], OFFLINE),
+        ("counts", ["counts", "-d", paths['db'], "--output", paths['counts']], OFFLINE),
+        ("simulate -g", ["simulate", "-d", paths['db'], "-f", PROFILE, "-n", "10", "-r", "1", "--seed", "1", "-g", paths['gtf'],
+                         "--queue-size", "0"], OFFLINE + ("signature_matrix", "hgvs_cache", "pipeline")),    # Every repeat writes a new folder in <folder>/output
+    ]
+
+#endregion
+
+
+# ====================
+# TIMING
+# ====================
+
+#region Timing
+
+# Function to time one invocation in a fresh interpreter
+def time_invocation(command, repeat, folder):
+    """
+    Runs command repeat times and returns the wall clock seconds of each run. Raises a CalledProcessError if it fails.
+    """
+
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, check=True, capture_output=True, cwd=folder)
+        seconds.append(time.perf_counter() - start)
+    return seconds
+
+
+# Function to list the modules an invocation imports
+def imported_modules(command, folder):
+    """
+    Runs command once with -X importtime and returns the names of all modules it imported.
+    """
+
+    finished = subprocess.run([command[0], "-X", "importtime", *command[1:]], check=True, capture_output=True, text=True, cwd=folder)
+    modules = set()
+    for line in finished.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            name = line.rsplit("|", 1)[1].strip()
+            if name != "package":                                         # Header line
+                modules.add(name)
+    return modules
+
+
+# Function to run all checks
+def check_startup(args, folder):
+    """
+    Times every invocation and the bare interpreter start. Returns the results as
+    {'command', 'best', 'mean', 'overhead' (best minus the bare interpreter start), 'forbidden' (heavy modules imported)} entries.
+    """
+
+    paths = write_fixtures(folder)
+    baseline = min(time_invocation([sys.executable, "-c", "pass"], args['repeat'], folder))
+    results = [{'command': "python -c pass", 'best': baseline, 'mean': baseline, 'overhead': 0.0, 'forbidden': []}]
+
+    for name, arguments, forbidden in startup_cases(paths, folder):
+        command = [sys.executable, SPECULATOR, *arguments]
+        seconds = time_invocation(command, args['repeat'], folder)
+        modules = imported_modules(command, folder)
+        results.append({'command': name, 'best': min(seconds), 'mean': sum(seconds) / len(seconds), 'overhead': min(seconds) - baseline,
+                        'forbidden': sorted(module for module in forbidden if module in modules)})
+        print(f"{name:<16} best {min(seconds) * 1000:7.1f} ms  overhead {(min(seconds) - baseline) * 1000:7.1f} ms"
+              + (f"  imports {', '.join(results[-1]['forbidden'])}" if results[-1]['forbidden'] else ""))
+    return results
+
+
+# Function to compare two result files
+def compare_results(baseline, current, threshold):
+    """
+    Prints the ratio current / baseline of the start-up overhead of every invocation measured in both files.
+    Returns the entries slower than threshold (e.g. 1.5 = 50 % more overhead). Overheads below 20 ms are not compared, they are noise.
+    """
+
+    baseline_overhead = {entry['command']: entry['overhead'] for entry in baseline['results']}
+    regressions = []
+    for entry in current['results']:
+        if entry['command'] not in baseline_overhead or entry['overhead'] < 0.02:
+            continue
+        ratio = entry['overhead'] / max(baseline_overhead[entry['command']], 0.02)
+        flag = " REGRESSION" if ratio > threshold else ""
+        print(f"{entry['command']:<16} {ratio:6.2f}x{flag}")
+        if ratio > threshold:
+            regressions.append(entry)
+    return regressions
+
+#endregion
+
+
+#### Start-up check ####
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Times short speculator.py invocations and fails if a subcommand imports a module it does not need.")
+    parser.add_argument('--repeat', type=int, default=5, help="Timed runs of every invocation (the best one is reported)")
+    parser.add_argument('-o', required=False, default="startup.json", help="JSON result file")
+    parser.add_argument('--compare', required=False, help="Earlier JSON result file to compare with")
+    parser.add_argument('--threshold', type=float, default=1.5, help="Overhead ratio reported as a regression by --compare")
+    args = vars(parser.parse_args())
+
+    with tempfile.TemporaryDirectory() as folder:
+        results = check_startup(args, folder)
+
+    metadata = {'date': datetime.now().isoformat(timespec='seconds'), 'python': sys.version.split()[0], 'platform': platform.platform(),
+                'arguments': args}
+    report = {'metadata': metadata, 'results': results}
+    with open(args['o'], "w") as outfile:
+        json.dump(report, outfile, indent=1)
+    print(f"Results written to {args['o']}")
+
+    failed = [entry['command'] for entry in results if entry['forbidden']]
+    if failed:
+        print(f"Heavy modules imported by: {', '.join(failed)}")
+    if args['compare'] is not None:
+        with open(args['compare'], "r") as baseline_file:
+            failed += [entry['command'] for entry in compare_results(json.load(baseline_file), report, args['threshold'])]
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,7 @@
+"""The modules live in the repository root, next to simulator.py. Tests import them from there and run from any folder."""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
@@ -0,0 +1,85 @@
+"""Alias tables: exact distribution of a table, draws, and the npz cache."""
+
+import os
+
+import numpy as np
+
+from alias_tables import build_alias_table, draw_alias, build_alias_tables, save_alias_tables, load_alias_tables, get_alias_tables, \
+    count_matrix_digest, purge_alias_cache
+
+
+# Probability of every entry implied by an alias table: its own column share plus the columns it is the alias of
+def table_distribution(prob, alias):
+    n = len(prob)
+    distribution = prob.copy()
+    np.add.at(distribution, alias, 1.0 - prob)
+    return distribution / n
+
+
+def test_table_reproduces_weights():
+    rng = np.random.default_rng(0)
+    for weights in ([1], [3, 1], [0, 5, 0, 1], rng.integers(1, 1000, size=500), rng.random(64) ** 4):
+        weights = np.asarray(weights, dtype=np.float64)
+        prob, alias = build_alias_table(weights)
+        assert np.allclose(table_distribution(prob, alias), weights / weights.sum())
+
+
+def test_draws_follow_weights():
+    rng = np.random.default_rng(1)
+    weights = np.array([1, 2, 3, 4, 10, 80], dtype=np.float64)
+    prob, alias = build_alias_table(weights)
+    size = 200000
+    observed = np.bincount(draw_alias(prob, alias, size, rng), minlength=len(weights))
+    expected = size * weights / weights.sum()
+    chi2 = ((observed - expected) ** 2 / expected).sum()
+    assert chi2 < 20.5                                                  # 99.9 % quantile of chi2 with 5 degrees of freedom
+
+
+def test_tables_per_column_and_cache(tmp_path):
+    rng = np.random.default_rng(2)
+    counts = rng.integers(0, 4, size=(30, 64)).astype(np.uint32)
+    counts[:, 7] = 0                                                    # A triplet found in no transcript gets no table
+    rows = np.arange(100, 130, dtype=np.int64)
+
+    tables = build_alias_tables(rows, counts)
+    assert 7 not in tables and set(tables) == set(np.flatnonzero(counts.sum(axis=0)).tolist())
+    for code, (table_rows, prob, alias) in tables.items():
+        present = np.flatnonzero(counts[:, code])
+        assert np.array_equal(table_rows, rows[present])
+        assert np.allclose(table_distribution(prob, alias), counts[present, code] / counts[present, code].sum())
+
+    save_alias_tables(tables, str(tmp_path / "tables.npz"))
+    loaded = load_alias_tables(str(tmp_path / "tables.npz"))
+    assert set(loaded) == set(tables)
+    assert all(all(np.array_equal(a, b) for a, b in zip(loaded[code], tables[code])) for code in tables)
+
+    cached = get_alias_tables(rows, counts, str(tmp_path))
+    assert len(list(tmp_path.glob("alias_*.npz"))) == 1
+    assert all(np.array_equal(cached[code][0], tables[code][0]) for code in tables)
+
+
+def test_digest_separates_table_kinds_and_shapes():
+    rows = np.arange(4)
+    counts = np.arange(16, dtype=np.uint32).reshape(4, 4)
+    assert count_matrix_digest(rows, counts) == count_matrix_digest(rows, counts.copy())
+    assert count_matrix_digest(rows, counts) != count_matrix_digest(rows, counts, kind="context")
+    assert count_matrix_digest(rows, counts) != count_matrix_digest(rows, counts.reshape(2, 8))
+
+
+def test_cache_keeps_the_most_recently_used_tables(tmp_path):
+    counts = np.ones((4, 64), dtype=np.uint32)
+    selections = [np.arange(i, i + 4, dtype=np.int64) for i in range(5)]          # One cached file per distinct selection
+    paths = []
+    for age, rows in enumerate(selections[:3]):
+        get_alias_tables(rows, counts, str(tmp_path), max_cached=3)
+        paths.append(tmp_path / f"alias_{count_matrix_digest(rows, counts)}.npz")
+        os.utime(paths[-1], (1000 + age, 1000 + age))                             # Distinct use times, oldest first
+
+    get_alias_tables(selections[0], counts, str(tmp_path), max_cached=3)         # A cache hit marks the oldest file as used
+    get_alias_tables(selections[3], counts, str(tmp_path), max_cached=3)         # A fourth file evicts the least recently used one
+    assert paths[0].exists() and not paths[1].exists() and paths[2].exists()
+    assert len(list(tmp_path.glob("alias_*.npz"))) == 3
+
+    assert purge_alias_cache(str(tmp_path), keep=1) == 2
+    assert purge_alias_cache(str(tmp_path)) == 1
+    assert not list(tmp_path.glob("alias_*.npz"))
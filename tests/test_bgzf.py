@@ -0,0 +1,107 @@
+"""BGZF blocks and the tabix index written by vcf_output.vcf_writer(), checked with a small reader of both formats."""
+
+import gzip
+import struct
+import zlib
+
+import numpy as np
+
+from bgzf import BLOCK_SIZE, EOF_BLOCK, PSEUDO_BIN, MIN_SHIFT, reg2bin
+from vcf_output import vcf_writer
+
+
+# Function to read the blocks of a BGZF file
+def read_blocks(path):
+    """
+    Returns {compressed block start: uncompressed data}, checking the BSIZE field, CRC and size of every block.
+    """
+    with open(path, "rb") as handle:
+        content = handle.read()
+    blocks, start = {}, 0
+    while start < len(content):
+        assert content[start:start + 4] == b"\x1f\x8b\x08\x04" and content[start + 12:start + 16] == b"BC\x02\x00"
+        block_size = struct.unpack("<H", content[start + 16:start + 18])[0] + 1
+        data = zlib.decompress(content[start + 18:start + block_size - 8], -15)
+        crc, size = struct.unpack("<II", content[start + block_size - 8:start + block_size])
+        assert crc == zlib.crc32(data) and size == len(data) <= BLOCK_SIZE
+        blocks[start] = data
+        start += block_size
+    assert content.endswith(EOF_BLOCK)
+    return blocks
+
+
+# Function to read a tabix index
+def read_tabix(path):
+    """
+    Returns {chromosome: (bins {bin: [(start, end), ...]}, linear offsets)} of an uncompressed .tbi content.
+    """
+    content = gzip.decompress(open(path, "rb").read())
+    assert content[:4] == b"TBI\x01"
+    n_references = struct.unpack("<i", content[4:8])[0]
+    names_length = struct.unpack("<i", content[32:36])[0]
+    names = content[36:36 + names_length].split(b"\0")[:n_references]
+    at = 36 + names_length
+    index = {}
+    for name in names:
+        bins = {}
+        (n_bins,) = struct.unpack_from("<i", content, at); at += 4
+        for _ in range(n_bins):
+            bin_number, n_chunks = struct.unpack_from("<Ii", content, at); at += 8
+            bins[bin_number] = [struct.unpack_from("<QQ", content, at + 16 * j) for j in range(n_chunks)]; at += 16 * n_chunks
+        (n_linear,) = struct.unpack_from("<i", content, at); at += 4
+        linear = list(struct.unpack_from(f"<{n_linear}Q", content, at)); at += 8 * n_linear
+        index[name.decode()] = (bins, linear)
+    return index
+
+
+def make_data(n, seed=0):
+    rng = np.random.default_rng(seed)
+    chromosomes = ["1", "2", "10", "X"]
+    return {f"ENST{i:011d}:c.{i + 1}C>T": (chromosomes[i % 4], str(int(rng.integers(1, 3000000))), "C", "T") for i in range(n)}
+
+
+def test_bgzf_matches_plain_vcf(tmp_path):
+    data = make_data(5000)
+    vcf_writer(data, str(tmp_path / "plain.vcf"))
+    vcf_writer(data, str(tmp_path / "compressed.vcf.gz"))
+    plain = (tmp_path / "plain.vcf").read_bytes()
+
+    blocks = read_blocks(str(tmp_path / "compressed.vcf.gz"))
+    assert len(blocks) > 3                                               # Several full blocks, then the EOF block
+    assert b"".join(blocks[start] for start in sorted(blocks)) == plain
+    assert gzip.decompress((tmp_path / "compressed.vcf.gz").read_bytes()) == plain
+
+
+def test_tabix_index_locates_every_record(tmp_path):
+    data = make_data(5000, seed=1)
+    vcf_writer(data, str(tmp_path / "out.vcf.gz"))
+    blocks = read_blocks(str(tmp_path / "out.vcf.gz"))
+    index = read_tabix(str(tmp_path / "out.vcf.gz.tbi"))
+
+    # Uncompressed offset of every block, to turn virtual offsets into file offsets
+    starts = sorted(blocks)
+    before = dict(zip(starts, np.cumsum([0] + [len(blocks[start]) for start in starts[:-1]]).tolist()))
+    content = b"".join(blocks[start] for start in starts)
+
+    def plain_offset(virtual):
+        return before[virtual >> 16] + (virtual & 0xffff)
+
+    # Records with their offsets in the uncompressed file
+    records, offset = [], 0
+    for line in content.splitlines(keepends=True):
+        if not line.startswith(b"#"):
+            chrom, pos = line.split(b"\t")[:2]
+            records.append((chrom.decode(), int(pos), offset, offset + len(line)))
+        offset += len(line)
+    assert len(records) == len(data)
+    assert list(index) == list(dict.fromkeys(chrom for chrom, _, _, _ in records))     # One reference per chromosome, in file order
+
+    for chrom, (bins, linear) in index.items():
+        own = [record for record in records if record[0] == chrom]
+        (first, last), (n, _) = bins[PSEUDO_BIN]
+        assert n == len(own) and plain_offset(first) == own[0][2] and plain_offset(last) == own[-1][3]
+        for _, pos, start, end in own:
+            # The bin of the record has a chunk covering it, and its linear window starts at or before it
+            chunks = [(plain_offset(s), plain_offset(e)) for s, e in bins[reg2bin(pos - 1, pos)]]
+            assert any(s <= start and end <= e for s, e in chunks)
+            assert plain_offset(linear[(pos - 1) >> MIN_SHIFT]) <= start
@@ -0,0 +1,63 @@
+"""Hash-driven incremental sync of the database (build_database.sync_database)."""
+
+import os
+
+import numpy as np
+
+import build_database
+from build_database import build_database as build, sync_database, read_manifest, stream_fasta
+from frequency import index_sequence
+from position_store import PositionStore
+
+SAMPLE_FASTA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sample.fasta")
+
+
+def write_fasta(path, records):
+    with open(path, "w") as fasta:
+        fasta.writelines(f">{transcript}\n{sequence}\n" for transcript, sequence in records)
+
+
+def test_sync_reindexes_only_the_changed_transcript(tmp_path, monkeypatch):
+    records = [(transcript, sequence) for transcript, _, sequence in stream_fasta(SAMPLE_FASTA)]
+    db_folder = str(tmp_path / "db")
+    build(SAMPLE_FASTA, db_folder, workers=1)
+    before = read_manifest(db_folder)['transcripts']
+
+    # One base of one transcript changes, to another base so the sequence stays ACGT
+    changed, sequence = records[3]
+    position = len(sequence) // 2
+    records[3] = (changed, sequence[:position] + {"A": "C", "C": "G", "G": "T", "T": "A"}.get(sequence[position], "A") + sequence[position + 1:])
+    changed_fasta = str(tmp_path / "changed.fasta")
+    write_fasta(changed_fasta, records)
+
+    indexed = []
+    index_chunk = build_database.index_chunk
+    monkeypatch.setattr(build_database, "index_chunk", lambda chunk: indexed.extend(t for t, _ in chunk) or index_chunk(chunk))
+
+    assert sync_database(changed_fasta, db_folder, workers=1) == (len(records) - 1, 1, 0)
+    assert indexed == [changed]
+
+    after = read_manifest(db_folder)['transcripts']
+    assert after[changed]['sha1'] != before[changed]['sha1']
+    assert {t: e for t, e in after.items() if t != changed} == {t: e for t, e in before.items() if t != changed}
+
+    # Every transcript, rewritten or copied, matches a fresh index of its sequence
+    store = PositionStore(db_folder)
+    assert store.transcripts == [transcript for transcript, _ in records]
+    for transcript, sequence in records:
+        counts, positions = index_sequence(sequence)
+        row = store.offsets[store.row[transcript]]
+        assert np.array_equal(store.get_counts(transcript), counts)
+        assert np.array_equal(store.positions[row[0]:row[-1]], positions)
+
+
+def test_sync_drops_removed_transcripts(tmp_path):
+    records = [(transcript, sequence) for transcript, _, sequence in stream_fasta(SAMPLE_FASTA)]
+    db_folder = str(tmp_path / "db")
+    build(SAMPLE_FASTA, db_folder, workers=1)
+
+    smaller_fasta = str(tmp_path / "smaller.fasta")
+    write_fasta(smaller_fasta, records[1:])
+    assert sync_database(smaller_fasta, db_folder, workers=1) == (len(records) - 1, 0, 1)
+    assert records[0][0] not in read_manifest(db_folder)['transcripts']
+    assert records[0][0] not in PositionStore(db_folder)
@@ -0,0 +1,113 @@
+"""Cohort mode (cohort.py): sample sheet, signatures of the samples and the per-sample output files."""
+
+import os
+
+import numpy as np
+import pytest
+
+import cohort
+from build_database import build_database, stream_fasta
+from cohort import Cohort, read_sample_sheet
+from signature_matrix import build_signature_channel_table
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_FASTA = os.path.join(ROOT, "sample.fasta")
+
+
+def write_lines(path, lines):
+    with open(path, "w") as outfile:
+        outfile.writelines(line + "\n" for line in lines)
+    return str(path)
+
+
+def parse_hgvsc(coding):
+    transcript, change = coding.split(":c.")
+    return transcript, int(change[:-3]) - 1, change[-3], change[-1]          # 0-based position, reference and alternative
+
+
+@pytest.fixture(scope="module")
+def database(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("cohort")
+    db_folder = str(folder / "db")
+    build_database(SAMPLE_FASTA, db_folder, workers=1)
+    sequences = {transcript: sequence for transcript, _, sequence in stream_fasta(SAMPLE_FASTA)}
+    return db_folder, sequences
+
+
+def test_sample_sheet(tmp_path):
+    sheet = write_lines(tmp_path / "sheet.tsv", ["# comment", "sample_id\tn\tsignature\ttranscripts",
+                                                 "T1\t10\tSBS1:0.3,SBS4:0.7\t", "T2\t5\tprofile.counts\tlist.txt"])
+    assert read_sample_sheet(sheet) == [
+        {'sample_id': "T1", 'n': 10, 'signature': "SBS1:0.3,SBS4:0.7", 'transcripts': None},
+        {'sample_id': "T2", 'n': 5, 'signature': "profile.counts", 'transcripts': "list.txt"},
+    ]
+
+    with pytest.raises(ValueError, match="missing columns signature"):
+        read_sample_sheet(write_lines(tmp_path / "bad.tsv", ["sample_id\tn", "T1\t10"]))
+
+
+@pytest.mark.parametrize("sample_id", ["../x", "a/b", "a\\b", "..", ""])
+def test_sample_ids_must_be_file_names(tmp_path, sample_id):
+    sheet = write_lines(tmp_path / "sheet.tsv", ["sample_id\tn\tsignature", f"{sample_id}\t10\tSBS1"])
+    with pytest.raises(ValueError, match="cannot be used as a file name"):
+        read_sample_sheet(sheet)
+
+
+def test_sample_ids_must_be_unique(tmp_path):
+    sheet = write_lines(tmp_path / "sheet.tsv", ["sample_id\tn\tsignature", "T1\t10\tSBS1", "T1\t5\tSBS4"])
+    with pytest.raises(ValueError, match="used more than once"):
+        read_sample_sheet(sheet)
+
+
+def test_exposures(database, tmp_path):
+    db_folder, sequences = database
+    exposure_file = write_lines(tmp_path / "exposures.txt", ["SBS1\t0.3", "SBS4\t0.7"])
+    simulation = Cohort(db_folder)
+    channels, _, probs = build_signature_channel_table("SBS1:0.3,SBS4:0.7")
+    allowed = {f"{ref}>{alt}" for (_, ref, alt), prob in zip(channels, probs) if prob > 0}
+
+    inline = simulation.simulate({'sample_id': "T1", 'n': 200, 'signature': "SBS1:0.3,SBS4:0.7", 'transcripts': None}, np.random.SeedSequence(1))
+    from_file = simulation.simulate({'sample_id': "T2", 'n': 200, 'signature': exposure_file, 'transcripts': None}, np.random.SeedSequence(1))
+    assert inline[3] == from_file[3]                                           # Same exposures, same seed: same mutations
+    assert len(inline[3]) == 200
+    for coding in inline[3]:
+        transcript, position, ref, alt = parse_hgvsc(coding)
+        assert sequences[transcript][position] == ref and f"{ref}>{alt}" in allowed
+
+
+def test_pentanucleotide_profile(database, tmp_path):
+    db_folder, sequences = database
+    transcript, sequence = next(iter(sequences.items()))
+    contexts = {sequence[start:start + 5] for start in (10, 40, 70)}
+    profile = write_lines(tmp_path / "penta.counts",
+                          [f"{context}\t{context[2]}/{'A' if context[2] != 'A' else 'C'}\t10" for context in sorted(contexts)])
+
+    rows, positions, channel_codes, hgvsc_list = Cohort(db_folder).simulate(
+        {'sample_id': "P1", 'n': 100, 'signature': profile, 'transcripts': None}, np.random.SeedSequence(2))
+    assert len(hgvsc_list) == 100
+    for coding in hgvsc_list:
+        transcript, position, ref, alt = parse_hgvsc(coding)
+        assert sequences[transcript][position - 2:position + 3] in contexts and sequences[transcript][position] == ref
+
+
+def test_per_sample_output_files(database, tmp_path):
+    db_folder, sequences = database
+    transcripts = list(sequences)[:3]
+    transcript_list = write_lines(tmp_path / "list.txt", transcripts)
+    gtf = write_lines(tmp_path / "cds.gtf", [f'1\tensembl\tCDS\t{100000 * (i + 1)}\t{100000 * (i + 1) + len(sequence) - 1}\t.\t+\t0\t'
+                                             f'gene_id "G{i}"; transcript_id "{transcript}";' for i, (transcript, sequence) in enumerate(sequences.items())])
+    sheet = write_lines(tmp_path / "sheet.tsv", ["sample_id\tn\tsignature\ttranscripts",
+                                                 "T1\t30\tSBS1:0.3,SBS4:0.7\t", f"T2\t20\tSBS1\t{transcript_list}"])
+    output = str(tmp_path / "out")
+
+    cohort.main([sheet, "-d", db_folder, "-o", output, "--seed", "1", "--vcf", "-g", gtf])
+    assert sorted(os.listdir(output)) == ["T1.txt", "T1.vcf", "T2.txt", "T2.vcf"]
+    for sample_id, n in (("T1", 30), ("T2", 20)):
+        with open(os.path.join(output, sample_id + ".txt")) as hgvsc_file:
+            hgvsc_list = [line.strip() for line in hgvsc_file if line.strip()]
+        with open(os.path.join(output, sample_id + ".vcf")) as vcf:
+            records = [line for line in vcf if not line.startswith("#")]
+        assert len(hgvsc_list) == n
+        assert 0 < len(records) <= n                                           # Mutations at the same site share a record
+        if sample_id == "T2":
+            assert {parse_hgvsc(coding)[0] for coding in hgvsc_list} <= set(transcripts)
@@ -0,0 +1,68 @@
+"""k-mer context index (context_index.py) built from the sequences kept in the position store."""
+
+import random
+from itertools import product
+
+import numpy as np
+import pytest
+
+from build_database import build_database as build, sync_database
+from context_index import ContextIndex, build_context_index
+from frequency import index_sequence
+from position_store import PositionStoreWriter
+
+# Bases next to N are only covered by triplets containing N, so they cannot be read back from the triplet positions
+SEQUENCES = [
+    ("ENSTN1", "GNCAN"),
+    ("ENSTN2", "ACGTNACGTACNGTACGTTNNACN"),
+    ("ENSTN3", "NNAANN"),
+    ("ENSTN4", "AC"),
+]
+
+
+def write_fasta(path, records):
+    with open(path, "w") as fasta:
+        fasta.writelines(f">{transcript}\n{sequence}\n" for transcript, sequence in records)
+
+
+def brute_force_positions(sequence, context):
+    centre = len(context) // 2
+    return [p for p in range(centre, len(sequence) - centre) if sequence[p - centre:p + centre + 1] == context]
+
+
+def test_contexts_next_to_n_match_a_brute_force_scan(tmp_path):
+    rng = random.Random(1)
+    records = SEQUENCES + [(f"ENSTR{i}", "".join(rng.choice("ACGTN" if i % 2 else "ACGT") for _ in range(300))) for i in range(6)]
+    fasta = str(tmp_path / "n.fasta")
+    write_fasta(fasta, records)
+    db_folder = str(tmp_path / "db")
+    build(fasta, db_folder, workers=1)
+
+    index = ContextIndex.open(db_folder)
+    assert index.get_positions("ENSTN1", "C").tolist() == [2]
+    assert index.get_positions("ENSTN3", "A").tolist() == [2, 3]
+    assert index.get_count("ENSTN4", "C") == 1
+
+    for k in (1, 3, 5, 7):
+        contexts = ["".join(bases) for bases in product("ACGT", repeat=k)]
+        counts, _ = index.count_matrix(contexts, np.arange(len(records)))
+        for row, (transcript, sequence) in enumerate(records):
+            expected = [len(brute_force_positions(sequence, context)) for context in contexts]
+            assert counts[row].tolist() == expected, (transcript, k)
+            for context in rng.sample(contexts, min(10, len(contexts))):
+                assert index.get_positions(transcript, context).tolist() == brute_force_positions(sequence, context)
+
+
+def test_rows_without_a_sequence_need_a_sync(tmp_path):
+    fasta = str(tmp_path / "n.fasta")
+    write_fasta(fasta, SEQUENCES)
+    db_folder = str(tmp_path / "db")
+    with PositionStoreWriter(db_folder) as writer:                 # As convert_pkl_folder() writes it: triplet positions only
+        for transcript, sequence in SEQUENCES:
+            writer.add(transcript, *index_sequence(sequence))
+
+    with pytest.raises(ValueError, match="no sequence"):
+        build_context_index(db_folder)
+
+    sync_database(fasta, db_folder, workers=1)                     # Nothing to read back, so every transcript is re-indexed with its sequence
+    assert ContextIndex.open(db_folder).get_positions("ENSTN1", "C").tolist() == [2]
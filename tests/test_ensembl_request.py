@@ -0,0 +1,78 @@
+"""Retries of post_batch() against the local stand-in API (ensembl_stub.py)."""
+
+import email.utils
+import time
+
+import pytest
+
+from ensembl_request import RateLimit, make_session, post_batch, get_hgvs_genomic, parse_retry_after
+from ensembl_stub import start_stub_server, fake_hgvsg
+
+HEADERS = {"Content-Type": "application/json", "Accept": "application/json"}
+BATCH = ["ENST00000169551:c.609G>A", "ENST00000558353:c.323G>A"]
+
+
+@pytest.fixture
+def stub(request):
+    server, url = start_stub_server(retry_after=0.2, script=request.param)
+    yield server, url
+    server.shutdown()
+
+
+@pytest.mark.parametrize("stub", [["429"]], indirect=True)
+def test_rate_limited_then_success(stub):
+    server, url = stub
+    # A long backoff would show up in the latency: after a 429 only the Retry-After pause is taken
+    result, status, latency, attempts = post_batch(make_session(1), url, HEADERS, BATCH, RateLimit(), max_retries=3, backoff=5.0)
+    assert status == 200 and attempts == 2 and server.n_requests == 2
+    assert 0.2 <= latency < 2.0
+    assert [next(iter(entry.values()))["input"] for entry in result] == BATCH
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("2") == 2.0 and parse_retry_after("0.5") == 0.5
+    assert 5 < parse_retry_after(email.utils.formatdate(time.time() + 10, usegmt=True)) <= 10
+    assert parse_retry_after(email.utils.formatdate(time.time() - 10, usegmt=True)) == 0.0   # A date in the past: retry now
+    assert parse_retry_after("soon") is None and parse_retry_after("nan") is None
+
+
+@pytest.mark.parametrize("stub", [["429_date"]], indirect=True)
+def test_rate_limited_with_http_date(stub):
+    server, url = stub
+    result, status, latency, attempts = post_batch(make_session(1), url, HEADERS, BATCH, RateLimit(), max_retries=3, backoff=5.0)
+    assert status == 200 and attempts == 2
+    assert latency < 2.5                                         # The date is rounded to whole seconds, the backoff is not taken
+    assert len(result) == len(BATCH)
+
+
+@pytest.mark.parametrize("stub", [["429_invalid"]], indirect=True)
+def test_unreadable_retry_after_falls_back_to_backoff(stub):
+    server, url = stub
+    result, status, latency, attempts = post_batch(make_session(1), url, HEADERS, BATCH, RateLimit(), max_retries=3, backoff=0.3)
+    assert status == 200 and attempts == 2
+    assert latency >= 0.15                                       # The normal backoff (0.3 s with jitter) before the retry
+    assert len(result) == len(BATCH)
+
+
+@pytest.mark.parametrize("stub", [["bad_json"]], indirect=True)
+def test_bad_json_body_is_retried(stub):
+    server, url = stub
+    result, status, latency, attempts = post_batch(make_session(1), url, HEADERS, BATCH, RateLimit(), max_retries=3, backoff=0.01)
+    assert status == 200 and attempts == 2
+    assert len(result) == len(BATCH)
+
+
+@pytest.mark.parametrize("stub", [["bad_json"] * 3], indirect=True)
+def test_bad_json_body_fails_after_retries(stub):
+    server, url = stub
+    result, status, latency, attempts = post_batch(make_session(1), url, HEADERS, BATCH, RateLimit(), max_retries=2, backoff=0.01)
+    assert result is None and attempts == 3
+    assert status == "error: invalid JSON body"
+
+
+@pytest.mark.parametrize("stub", [["bad_json", "429"]], indirect=True)
+def test_get_hgvs_genomic_survives_bad_answers(stub):
+    server, url = stub
+    hgvs_genomic, hgvs_failed = get_hgvs_genomic(BATCH, url, HEADERS, 50, workers=1, max_retries=3)
+    assert hgvs_genomic == {coding: fake_hgvsg(coding) for coding in BATCH}
+    assert not hgvs_failed
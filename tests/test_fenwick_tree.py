@@ -0,0 +1,53 @@
+"""Sampling of sites without replacement (fenwick_tree.py)."""
+
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from fenwick_tree import FenwickTree, draw_sites_without_replacement
+
+
+def test_weighted_tree_pops_the_entry_of_every_site():
+    weights = np.array([0, 3, 1, 0, 5, 2, 0])
+    assert FenwickTree(len(weights), weights).remaining == weights.sum()
+    # Entry and rank of the k-th site, each popped from a fresh tree
+    assert [FenwickTree(len(weights), weights).pop(k) for k in range(weights.sum())] == [(entry, rank) for entry, weight in enumerate(weights) for rank in range(weight)]
+
+    tree = FenwickTree(len(weights), weights)
+    assert tree.pop(4) == (4, 0)                                 # Sites 0-2 in entry 1, site 3 in entry 2, site 4 is the first of entry 4
+    assert tree.remaining == weights.sum() - 1
+    left = weights - (np.arange(len(weights)) == 4)
+    assert [tree.pop(0)[0] for _ in range(tree.remaining)] == np.repeat(np.arange(len(weights)), left).tolist()
+    assert tree.remaining == 0
+
+
+def test_drawing_every_site_returns_each_exactly_once():
+    rng = np.random.default_rng(0)
+    counts = rng.integers(0, 6, size=(8, 3)).astype(np.uint32)
+    counts[2, :] = 0                                             # A row without sites is never drawn
+    codes = np.repeat(np.arange(3), counts.sum(axis=0).astype(np.int64))
+    rng.shuffle(codes)
+
+    local_rows, offsets = draw_sites_without_replacement(codes, counts, rng)
+    for code in range(3):
+        drawn = sorted(zip(local_rows[codes == code].tolist(), offsets[codes == code].tolist()))
+        assert drawn == [(row, offset) for row in range(len(counts)) for offset in range(int(counts[row, code]))]
+
+
+def test_more_draws_than_sites_raise():
+    counts = np.array([[2, 1], [1, 0]], dtype=np.uint32)
+    with pytest.raises(ValueError, match="which has only 1 sites"):
+        draw_sites_without_replacement(np.array([0, 1, 1]), counts, np.random.default_rng(0))
+
+
+def test_sites_are_drawn_uniformly():
+    counts = np.array([[1], [3]], dtype=np.uint32)
+    rng = np.random.default_rng(1)
+    draws = Counter()
+    for _ in range(4000):
+        local_rows, offsets = draw_sites_without_replacement(np.array([0, 0]), counts, rng)
+        draws.update(zip(local_rows.tolist(), offsets.tolist()))
+    expected = 2 * 4000 / 4                                      # Every one of the 4 sites is in a pair of draws with probability 1/2
+    chi2 = sum((draws[site] - expected) ** 2 / expected for site in [(0, 0), (1, 0), (1, 1), (1, 2)])
+    assert chi2 < 16.3                                           # 3 degrees of freedom, p = 0.001
@@ -0,0 +1,29 @@
+"""Triplet indexing into the position store and the count matrix of a transcript selection (frequency.py)."""
+
+import numpy as np
+
+from frequency import process_triplet_positions, compute_count_matrix, index_sequence
+from position_store import PositionStore, PositionStoreWriter
+
+SEQUENCES = [("ENST1", "ATGCGTACGTTAG"), ("ENST2", "ATGAAACCCGGGTTTTAA"), ("ENST3", "ATGCCCTGA")]
+
+
+def test_processing_again_adds_no_rows(tmp_path):
+    db_folder = str(tmp_path / "db")
+    first = process_triplet_positions(SEQUENCES, db_folder)
+    second = process_triplet_positions(SEQUENCES + [SEQUENCES[0]], db_folder)
+    assert PositionStore(db_folder).transcripts == [transcript for transcript, _ in SEQUENCES]
+    assert second == first                                           # Transcripts already in the database are still counted
+
+
+def test_whole_database_uses_every_transcript_once(tmp_path):
+    db_folder = str(tmp_path / "db")
+    with PositionStoreWriter(db_folder) as writer:                   # A database with ENST1 added twice, e.g. by an older version
+        for transcript, sequence in SEQUENCES + [("ENST1", "ATGATGATG")]:
+            writer.add(transcript, *index_sequence(sequence))
+
+    store = PositionStore(db_folder)
+    rows, counts = compute_count_matrix(None, store)
+    assert [store.transcripts[row] for row in rows.tolist()] == ["ENST2", "ENST3", "ENST1"]
+    assert rows.tolist() == [1, 2, 3]                                # The latest row of ENST1, as store.row resolves it
+    assert np.array_equal(counts[-1], index_sequence("ATGATGATG")[0])
@@ -0,0 +1,71 @@
+"""Offline c. to genomic conversion with the CDS index, against a base-by-base walk of the GTF segments."""
+
+import numpy as np
+
+from gtf_mapping import CDSIndex, load_cds_index, gtf_hgvs_converter
+
+# Two multi-exon transcripts on opposite strands (exons listed out of order, stop codon separate), one single-exon one
+GTF = [
+    ("chr1", "CDS", 100, 120, "+", "ENSTPLUS.3"),
+    ("chr1", "CDS", 200, 209, "+", "ENSTPLUS.3"),
+    ("chr1", "CDS", 150, 155, "+", "ENSTPLUS.3"),
+    ("chr1", "stop_codon", 210, 212, "+", "ENSTPLUS.3"),
+    ("7", "CDS", 5000, 5010, "-", "ENSTMINUS"),
+    ("7", "CDS", 4000, 4020, "-", "ENSTMINUS"),
+    ("7", "stop_codon", 3997, 3999, "-", "ENSTMINUS"),
+    ("X", "CDS", 1, 30, "+", "ENSTSINGLE"),
+]
+
+
+def write_gtf(path):
+    with open(path, "w") as gtf:
+        gtf.write("#!genome-build test\n")
+        for chromosome, feature, start, end, strand, transcript in GTF:
+            gtf.write(f'{chromosome}\tensembl\t{feature}\t{start}\t{end}\t.\t{strand}\t0\tgene_id "G"; transcript_id "{transcript}";\n')
+        gtf.write('1\tensembl\texon\t1\t1000\t.\t+\t.\tgene_id "G"; transcript_id "ENSTPLUS.3";\n')   # Not a coding feature
+
+
+# Genomic position of every coding base, in transcript order
+def coding_positions(transcript):
+    segments = [(start, end, strand) for _, _, start, end, strand, name in GTF if name.split(".")[0] == transcript]
+    strand = segments[0][2]
+    bases = sorted(position for start, end, _ in segments for position in range(start, end + 1))
+    return (bases if strand == "+" else bases[::-1]), strand
+
+
+def test_every_coding_position(tmp_path):
+    write_gtf(str(tmp_path / "test.gtf"))
+    cds_index = CDSIndex.from_gtf(str(tmp_path / "test.gtf"))
+
+    hgvsc, expected = [], {}
+    for transcript, chromosome in (("ENSTPLUS", "1"), ("ENSTMINUS", "7"), ("ENSTSINGLE", "X")):
+        bases, strand = coding_positions(transcript)
+        for c_position, locus in enumerate(bases, start=1):
+            coding = f"{transcript}:c.{c_position}A>G"
+            hgvsc.append(coding)
+            expected[coding] = (chromosome, str(locus), "A", "G") if strand == "+" else (chromosome, str(locus), "T", "C")
+
+    chr_info, failed = gtf_hgvs_converter(hgvsc, cds_index)
+    assert chr_info == expected and not failed
+
+
+def test_failures_and_versions(tmp_path):
+    write_gtf(str(tmp_path / "test.gtf"))
+    cds_index = CDSIndex.from_gtf(str(tmp_path / "test.gtf"))
+    plus_length = len(coding_positions("ENSTPLUS")[0])
+
+    chr_info, failed = gtf_hgvs_converter(["ENSTPLUS.3:c.1A>G", f"ENSTPLUS:c.{plus_length + 1}A>G", "ENSTPLUS:c.0A>G",
+                                           "ENSTUNKNOWN:c.1A>G", "ENSTPLUS:c.1del"], cds_index)
+    assert chr_info == {"ENSTPLUS.3:c.1A>G": ("1", "100", "A", "G")}
+    assert failed == {f"ENSTPLUS:c.{plus_length + 1}A>G", "ENSTPLUS:c.0A>G", "ENSTUNKNOWN:c.1A>G", "ENSTPLUS:c.1del"}
+
+
+def test_cached_index(tmp_path):
+    gtf = str(tmp_path / "test.gtf")
+    write_gtf(gtf)
+    built = load_cds_index(gtf)
+    assert (tmp_path / "test.gtf.cds_index.npz").exists()
+    loaded = load_cds_index(gtf)
+    assert loaded.transcripts == built.transcripts and loaded.chromosomes == built.chromosomes
+    for name in ("tx_chromosome", "tx_strand", "tx_offsets", "seg_start", "seg_end", "seg_before"):
+        assert np.array_equal(getattr(loaded, name), getattr(built, name))
@@ -0,0 +1,39 @@
+"""Channel sampling from signature mixtures."""
+
+import numpy as np
+import pytest
+
+from signature_matrix import mix_signatures, parse_exposures, sample_channel_counts
+
+
+def test_exposures_from_a_string_and_a_file(tmp_path):
+    assert parse_exposures("SBS1:0.3,SBS4:0.7,SBS1:0.1") == pytest.approx({'SBS1': 0.4, 'SBS4': 0.7})
+    exposure_file = tmp_path / "exposures.txt"
+    exposure_file.write_text("# comment\nSBS1\t0.3\nSBS4\n")
+    assert parse_exposures(str(exposure_file)) == {'SBS1': 0.3, 'SBS4': 1.0}
+
+
+@pytest.mark.parametrize("mixture, message", [
+    ("SBS1:-0.3,SBS4:0.7", "finite non-negative"),
+    ("SBS1:nan", "finite non-negative"),
+    ("SBS1:inf,SBS4:1", "finite non-negative"),
+    ("SBS1:0,SBS4:0", "sum to zero"),
+])
+def test_invalid_exposures_raise(mixture, message):
+    with pytest.raises(ValueError, match=message):
+        parse_exposures(mixture)
+
+
+def test_unknown_signatures_are_named():
+    names = ["SBS1", "SBS4"]
+    matrix = np.array([[0.5, 0.2], [0.5, 0.8]])
+    assert mix_signatures(names, matrix, {'SBS1': 1.0, 'SBS4': 1.0}).tolist() == pytest.approx([0.35, 0.65])
+    with pytest.raises(KeyError, match="SBS2, SBS99"):
+        mix_signatures(names, matrix, {'SBS1': 1.0, 'SBS2': 0.5, 'SBS99': 0.5})
+
+
+def test_channel_counts_are_multinomial_and_shuffled():
+    probs = np.array([0.1, 0.2, 0.3, 0.4])
+    codes = sample_channel_counts(probs, 1000, np.random.default_rng(5))
+    assert np.array_equal(np.bincount(codes, minlength=4), np.random.default_rng(5).multinomial(1000, probs))
+    assert np.count_nonzero(np.diff(codes)) > 100                       # Not grouped by channel (grouped would give 3 changes)
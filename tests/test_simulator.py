@@ -0,0 +1,74 @@
+"""End-to-end runs of simulator.py against the local stand-in API (ensembl_stub.py)."""
+
+import os
+import json
+
+import pytest
+
+import simulator
+from ensembl_stub import start_stub_server
+from hgvs_cache import HGVSCache
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_FASTA = os.path.join(ROOT, "sample.fasta")
+PROFILE = os.path.join(ROOT, "signatures", "test_signature.counts")
+
+
+@pytest.fixture
+def stub():
+    server, url = start_stub_server()
+    yield server, url
+    server.shutdown()
+
+
+def test_pipelined_runs_with_cache(stub, tmp_path, monkeypatch):
+    server, url = stub
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("output")
+    cache_path = str(tmp_path / "c.sqlite")
+    arguments = ["-i", SAMPLE_FASTA, "-d", str(tmp_path / "db"), "-f", PROFILE, "-n", "50", "-r", "3", "--seed", "1",
+                 "--ensembl-url", url, "--cache", cache_path]
+
+    simulator.main(arguments)                          # Default --queue-size: the cache is opened in the main thread, used in the resolve stage
+    n_requests = server.n_requests
+    assert n_requests > 0
+    cache = HGVSCache(cache_path)
+    assert len(cache) > 0
+    cache.close()
+
+    simulator.main(arguments)                          # Same seed: every HGVS coding is answered by the cache
+    assert server.n_requests == n_requests
+    for folder in os.listdir("output"):                # One dated folder per invocation
+        assert sorted(name for name in os.listdir(os.path.join("output", folder)) if name.endswith(".vcf")) == \
+            [f"sample_test_signature_{i}_of_3.vcf" for i in range(1, 4)]
+
+
+def test_pipelined_run_metrics_hold_their_own_counters(stub, tmp_path, monkeypatch):
+    server, url = stub
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("output")
+    simulator.main(["-i", SAMPLE_FASTA, "-d", str(tmp_path / "db"), "-f", PROFILE, "-n", "50", "-r", "2", "--seed", "1",
+                    "--ensembl-url", url, "--metrics"])
+
+    (folder,) = os.listdir("output")
+    for i in (1, 2):
+        with open(os.path.join("output", folder, f"sample_test_signature_{i}_of_2.metrics.json")) as metrics_file:
+            metrics = json.load(metrics_file)
+        assert metrics['counters']['mutations'] == 50
+        assert metrics['counters']['api_batches'] >= 1                  # Resolve stage thread
+        assert metrics['histograms']['api_latency_seconds']['count'] == metrics['counters']['api_batches']
+        assert metrics['counters']['vcf_records'] > 0                  # Write stage thread
+        assert metrics['counters']['bytes_written'] > 0
+        assert 'vcf_writer' in metrics['timers']
+
+
+def test_hgvsc_list_override(stub, tmp_path, monkeypatch):
+    server, url = stub
+    monkeypatch.chdir(tmp_path)
+    hgvsc_file = tmp_path / "list.txt"
+    hgvsc_file.write_text("ENST00000169551:c.609G>A\n\nENST00000558353:c.323G>A\n  \n")
+    simulator.main(["-d", str(tmp_path / "db"), "-f", PROFILE, "-n", "1", "-r", "1", "-o", str(hgvsc_file), "--ensembl-url", url])
+
+    with open(tmp_path / "list.vcf") as vcf:
+        records = [line for line in vcf if not line.startswith("#")]
+    assert len(records) == 2                           # One record per HGVS coding, empty lines skipped
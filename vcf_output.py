@@ -2,8 +2,12 @@
 Create VCF output from the processed HGVS.
 """
 
-import vcfpy
+import os
 import re
+import numpy as np
+
+from bgzf import BGZFWriter, TabixIndex
+from metrics import METRICS
 
 # TODO in main program:
 # TODO: Change output path to run folder
@@ -25,87 +29,181 @@ def chromosome_sort_key(chrom):
     return [int(text) if text.isdigit() else text for text in re.split('([0-9]+)', chrom)]
 
 
-# VCF writer function
-def vcf_writer(data, output):
+# Dictionary of chromosome lengths (GRCh38)
+CHROMOSOME_LENGTHS = {
+    "1": "248956422",
+    "2": "242193529",
+    "3": "198295559",
+    "4": "190214555",
+    "5": "181538259",
+    "6": "170805979",
+    "7": "159345973",
+    "8": "145138636",
+    "9": "138394717",
+    "10": "133797422",
+    "11": "135086622",
+    "12": "133275309",
+    "13": "114364328",
+    "14": "107043718",
+    "15": "101991189",
+    "16": "90338345",
+    "17": "83257441",
+    "18": "80373285",
+    "19": "58617616",
+    "20": "64444167",
+    "21": "46709983",
+    "22": "50818468",
+    "X": "156040895",
+    "Y": "57227415",
+}
+
+# Canonical chromosomes sorted by numerical order and then lexicographical order for 'X', 'Y'. The index is the sort rank.
+CHROMOSOMES = sorted(CHROMOSOME_LENGTHS.keys(), key=chromosome_sort_key)
+CHROMOSOME_RANK = {chrom: rank for rank, chrom in enumerate(CHROMOSOMES)}
+
+SAMPLE_NAME = 'SimulatedSample'
+
+
+# Function to build the VCF header
+def vcf_header(samples=(SAMPLE_NAME,)):
     """
-    Takes a dictionary of mutation and genomic information and creates a vcf
+    Returns the VCF header lines (including the #CHROM line) as one string.
     """
-    # Dictionary of chromosome lengths
-    chromosome_lengths = {
-        "1": "248956422",
-        "2": "242193529",
-        "3": "198295559",
-        "4": "190214555",
-        "5": "181538259",
-        "6": "170805979",
-        "7": "159345973",
-        "8": "145138636",
-        "9": "138394717",
-        "10": "133797422",
-        "11": "135086622",
-        "12": "133275309",
-        "13": "114364328",
-        "14": "107043718",
-        "15": "101991189",
-        "16": "90338345",
-        "17": "83257441",
-        "18": "80373285",
-        "19": "58617616",
-        "20": "64444167",
-        "21": "46709983",
-        "22": "50818468",
-        "X": "156040895",
-        "Y": "57227415",
-    }
-    
-    # Filter data to include only canonical chromosomes
-    valid_chromosomes = set([str(i) for i in range(1, 23)] + ['X', 'Y'])
-    filtered_data = {key: val for key, val in data.items() if val[0] in valid_chromosomes}
-    
-    # Prepare header lines for a new VCF writer
-    header_lines = [
-        vcfpy.HeaderLine(key='fileformat', value='VCFv4.2'),                         
-        vcfpy.HeaderLine(key='source', value='SPECulator'),      
-        # Automatically add contig lines for every unique chromosome sorted by numerical order and then lexicographical order for 'X', 'Y'.
-        *[
-            vcfpy.ContigHeaderLine.from_mapping({'ID': chrom, 'length': chromosome_lengths[chrom]}) 
-            for chrom in sorted(chromosome_lengths.keys(), key=chromosome_sort_key)
-        ],
-        
-        # 
-        vcfpy.InfoHeaderLine.from_mapping({'ID': 'AC', 'Number': 'A', 'Type': 'Integer', 'Description': 'Allele count in genotypes, for autosomal chromosomes assume 1'}),
-        vcfpy.FormatHeaderLine.from_mapping({'ID': 'GT', 'Number': '1', 'Type': 'String', 'Description': 'Genotype call'})
+
+    lines = ['##fileformat=VCFv4.2', '##source=SPECulator']
+    lines += [f'##contig=<ID={chrom},length={CHROMOSOME_LENGTHS[chrom]}>' for chrom in CHROMOSOMES]
+    lines += [
+        '##INFO=<ID=AC,Number=A,Type=Integer,Description="Allele count in genotypes, for autosomal chromosomes assume 1">',
+        '##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype call">',
+        '\t'.join(['#CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO', 'FORMAT', *samples]),
     ]
-    
-    # Create a new VCF writer
-    writer = vcfpy.Writer.from_path(
-        output,  
-        vcfpy.Header(
-            lines=header_lines,
-            samples=vcfpy.SamplesInfos(['SimulatedSample'])
-        )
-    )
-    
-    # Add records to the VCF file
-    for key, (chrom, pos, ref, alt) in filtered_data.items():
-        # Assuming the type of substitution is SNV for single nucleotide variants
-        alt_type = 'SNV' if len(ref) == 1 and len(alt) == 1 else 'MNV'  # Example types, adjust as necessary
-        record = vcfpy.Record(
-            CHROM=chrom,
-            POS=int(pos),
-            ID=[key],
-            REF=ref,
-            ALT=[vcfpy.Substitution(type_=alt_type, value=alt)],
-            QUAL='.',
-            FILTER=['PASS'],  # Use 'PASS' to indicate the variant passed all filters, or '.' if no filtering was applied
-            INFO={},
-            FORMAT=['GT'],
-            calls=[vcfpy.Call(sample='SimulatedSample', data={'GT': '0/1'})]  # Using heterozygous as placeholder
-        )
-        writer.write_record(record)
-        
-    # Close the VCF writer
-    writer.close()
+    return '\n'.join(lines) + '\n'
+
+
+# Function to sort mutations by chromosome and position
+def sort_records(data):
+    """
+    Keeps mutations on canonical chromosomes and returns their keys sorted by chromosome_sort_key() and position.
+    The sort is one vectorized lexsort on the chromosome rank and the position.
+    """
+
+    keys = [key for key, val in data.items() if val[0] in CHROMOSOME_RANK]
+    ranks = np.fromiter((CHROMOSOME_RANK[data[key][0]] for key in keys), dtype=np.int64, count=len(keys))
+    positions = np.fromiter((int(data[key][1]) for key in keys), dtype=np.int64, count=len(keys))
+    order = np.lexsort((positions, ranks))                                # Last key is the primary one
+    return [keys[j] for j in order]
+
+
+# Function to write sorted VCF lines, plain or BGZF with a tabix index
+def write_vcf(records, output, samples=(SAMPLE_NAME,), compress=None, metrics=METRICS):
+    """
+    Writes the header and sorted records, given as (chrom, pos, ref, line) tuples.
+    If compress is set (default: output ends with .gz), the VCF is written as BGZF blocks and a tabix index
+    (<output>.tbi) is built in the same pass. The timer and byte counts go to metrics. Returns the number of records written.
+    """
+
+    if compress is None:
+        compress = output.endswith('.gz')
+    n_records = 0
+
+    with metrics.stage('vcf_writer'):
+        if compress:
+            index = TabixIndex()
+            with BGZFWriter(output) as writer:
+                writer.write(vcf_header(samples).encode())
+                for chrom, pos, ref, line in records:
+                    start_offset = writer.tell()
+                    writer.write(line.encode())
+                    index.add(chrom, int(pos) - 1, int(pos) - 1 + len(ref), start_offset, writer.tell())
+                    n_records += 1
+            index.save(output + '.tbi')
+            metrics.count('bytes_written', os.path.getsize(output + '.tbi'))
+        else:
+            with open(output, 'w') as writer:
+                writer.write(vcf_header(samples))
+                for chrom, pos, ref, line in records:
+                    writer.write(line)
+                    n_records += 1
+
+    metrics.count('vcf_records', n_records)
+    metrics.count('bytes_written', os.path.getsize(output))
+    return n_records
+
+
+# VCF writer function
+def vcf_writer(data, output, compress=None, validate=False, metrics=METRICS):
+    """
+    Takes a dictionary of mutation and genomic information and creates a VCF sorted by chromosome and position.
+    Lines are written directly, without building vcfpy records. Output ending in .gz (or compress=True) is BGZF compressed
+    and indexed with tabix. With validate, the written file is read back with vcfpy.
+    """
+
+    # Assuming heterozygous genotype as placeholder
+    records = ((data[key][0], data[key][1], data[key][2], f'{data[key][0]}\t{data[key][1]}\t{key}\t{data[key][2]}\t{data[key][3]}\t.\tPASS\t.\tGT\t0/1\n')
+               for key in sort_records(data))
+    n_records = write_vcf(records, output, compress=compress, metrics=metrics)
+
+    if validate:
+        validate_vcf(output, n_records)
+
+
+# Multi-sample VCF writer function
+def multisample_vcf_writer(run_data, output, samples=None, compress=None, validate=False):
+    """
+    Takes one dictionary of mutation and genomic information per run and creates one VCF with a sample column per run.
+    A site mutated in a run is 0/1 in its column and 0/0 elsewhere. ID lists the HGVS coding strings of the site, AC the number of runs carrying it.
+    """
+
+    if samples is None:
+        samples = [f'run_{i + 1}' for i in range(len(run_data))]
+
+    # Sites (chrom, pos, ref, alt) -> HGVS coding strings and the runs the site was simulated in
+    sites = {}
+    for i, data in enumerate(run_data):
+        for key, site in data.items():
+            ids, runs = sites.setdefault(tuple(site), ({}, {}))
+            ids[key] = None                                   # dict keeps the order the strings were seen in
+            runs[i] = None
+
+    def records():
+        genotypes = np.full(len(samples), '0/0', dtype=object)
+        for site in sort_records({site: site for site in sites}):
+            chrom, pos, ref, alt = site
+            ids, runs = sites[site]
+            carriers = list(runs)
+            genotypes[carriers] = '0/1'
+            line = f'{chrom}\t{pos}\t{";".join(ids)}\t{ref}\t{alt}\t.\tPASS\tAC={len(carriers)}\tGT\t' + '\t'.join(genotypes) + '\n'
+            genotypes[carriers] = '0/0'
+            yield chrom, pos, ref, line
+
+    n_records = write_vcf(records(), output, samples, compress)
+
+    if validate:
+        validate_vcf(output, n_records)
+
+
+# Function to check a written VCF with vcfpy
+def validate_vcf(path, n_records):
+    """
+    Reads a VCF with vcfpy and raises a ValueError if it has the wrong number of records or is not sorted.
+    """
+
+    import vcfpy                         # Only needed for validation
+
+    reader = vcfpy.Reader.from_path(path)
+    previous = None
+    n_read = 0
+    for record in reader:
+        current = (CHROMOSOME_RANK[record.CHROM], record.POS)
+        if previous is not None and current < previous:
+            raise ValueError(f"{path}: record {record.CHROM}:{record.POS} is out of order")
+        previous = current
+        n_read += 1
+    reader.close()
+
+    if n_read != n_records:
+        raise ValueError(f"{path}: {n_read} records read, {n_records} written")
+
 
 # Test program for vcf writer.
 if __name__ == "__main__":
@@ -118,4 +216,5 @@ if __name__ == "__main__":
     
     filepath = 'output.vcf'
     
-    vcf_writer(mut_info, filepath)
\ No newline at end of file
+    vcf_writer(mut_info, filepath, validate=True)
+    vcf_writer(mut_info, filepath + '.gz', validate=True)
\ No newline at end of file